@@ -0,0 +1,136 @@
+import sys
+import types
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+# loop -> the thread's current loop before it was made current, restored by close_event_loop()
+_previous_loops = {}
+# Marks a generator function as a coroutine that can be awaited/scheduled by asyncio (no-op where not needed)
+_iterable_coroutine = getattr(types, 'coroutine', lambda func: func)
+
+
+def is_coroutine(obj):
+    return asyncio is not None and asyncio.iscoroutine(obj)
+
+
+def is_coroutine_function(func):
+    return asyncio is not None and asyncio.iscoroutinefunction(func)
+
+
+def new_event_loop():
+    if asyncio is None:
+        raise RuntimeError(u'Running coroutines requires asyncio (or trollius on Python 2)')
+    try:
+        previous_loop = asyncio.get_event_loop()
+    except RuntimeError:
+        previous_loop = None
+    loop = asyncio.new_event_loop()
+    _previous_loops[loop] = previous_loop
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def close_event_loop(loop):
+    """Closes a loop of new_event_loop(), making the loop that was current before it current again."""
+    asyncio.set_event_loop(_previous_loops.pop(loop, None))
+    loop.close()
+
+
+def current_task(loop):
+    """Returns the task of loop running right now, None outside of its tasks."""
+    if hasattr(asyncio, 'current_task'):
+        return asyncio.current_task(loop) if loop.is_running() else None
+    return asyncio.Task.current_task(loop)
+
+
+def wait_for(coro, seconds, timeout_exception):
+    """Returns a coroutine running coro for at most seconds, cancelling it and raising timeout_exception() then."""
+    def steps():
+        try:
+            yield lambda: asyncio.wait_for(coro, seconds)
+        except asyncio.TimeoutError:
+            raise timeout_exception()
+    return steps_coroutine(steps())
+
+
+def run_steps(steps):
+    """Drives a generator of step callables synchronously.
+
+    Every callable yielded by steps is called and its return value is sent back into the generator, an exception
+    raised by it is thrown into the generator instead. A coroutine returned by a step is run to completion on a
+    private event loop, created on first use and closed when steps is exhausted.
+    """
+    loop = None
+    value, exc_info = None, None
+    try:
+        while True:
+            try:
+                if exc_info is not None:
+                    step = steps.throw(*exc_info)
+                else:
+                    step = steps.send(value)
+            except StopIteration:
+                return
+            value, exc_info = None, None
+            try:
+                value = step()
+                if is_coroutine(value):
+                    if loop is None:
+                        loop = new_event_loop()
+                    value = loop.run_until_complete(value)
+            except:
+                exc_info = sys.exc_info()
+    finally:
+        if loop is not None:
+            close_event_loop(loop)
+
+
+@_iterable_coroutine
+def steps_coroutine(steps):
+    """Same as run_steps, but returns a coroutine running the steps on the caller's event loop.
+
+    Coroutines returned by steps are driven from within this coroutine (the equivalent of awaiting them), so many
+    step generators can run concurrently as tasks of one shared loop.
+    """
+    value, exc_info = None, None
+    while True:
+        try:
+            if exc_info is not None:
+                step = steps.throw(*exc_info)
+            else:
+                step = steps.send(value)
+        except StopIteration:
+            return
+        value, exc_info = None, None
+        try:
+            value = step()
+            if is_coroutine(value):
+                coro, value = value, None
+                coro_value, coro_exc_info = None, None
+                while True:
+                    try:
+                        if coro_exc_info is not None:
+                            awaited = coro.throw(*coro_exc_info)
+                        else:
+                            awaited = coro.send(coro_value)
+                    except StopIteration as e:
+                        value = getattr(e, 'value', None)
+                        break
+                    coro_value, coro_exc_info = None, None
+                    try:
+                        coro_value = yield awaited
+                    except GeneratorExit:
+                        coro.close()
+                        raise
+                    except:
+                        coro_exc_info = sys.exc_info()
+        except GeneratorExit:
+            raise
+        except:
+            exc_info = sys.exc_info()
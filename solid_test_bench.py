@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+
+import solid_test_case
+import solid_test_suite
+import solid_test_report
+
+log = logging.getLogger()
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_RUN_TESTS = 10000
+DEFAULT_CAPTURE_ITERATIONS = 10000
+DEFAULT_APPEND_REPORTS = 10000
+DEFAULT_THRESHOLD = 0.1
+
+
+class _EmptyTestCase(solid_test_case.SolidTestCase):
+    def test_empty(self):
+        pass
+
+
+def _report_dict(i):
+    return {'name': u'test_{}'.format(i), 'class_name': u'BenchmarkCase', 'suite': u'benchmark',
+            'outcome': ('pass', 'fail', 'error', 'skip')[i % 4], 'time': 0.001, 'stdout': u'out\n', 'stderr': u'',
+            'logger': u'', 'exc': [u'Traceback (most recent call last):\nAssertionError'] if i % 4 in (1, 2) else [],
+            'fixture_time': {'set_up': 0.0, 'tear_down': 0.0}}
+
+
+def _result(value, unit, higher_is_better=False):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def bench_run_overhead(work_dir, tests):
+    """Seconds SolidTestSuite.run spends per empty test, reporting included."""
+    suite = solid_test_suite.SolidTestSuite()
+    suite.load_from_test_case_class(_EmptyTestCase)
+    suite.multiply_tests(tests, fresh=True)
+    start_time = time.time()
+    suite.run(os.path.join(work_dir, 'run.json'), stop_trigger=False)
+    return _result((time.time() - start_time) / tests, 's/test')
+
+
+def bench_capture(iterations):
+    """Seconds of one start_capture/stop_capture pair."""
+    suite = solid_test_suite.SolidTestSuite()
+    start_time = time.time()
+    for _ in xrange(iterations):
+        suite.start_capture()
+        suite.stop_capture()
+    return _result((time.time() - start_time) / iterations, 's/capture')
+
+
+def bench_json_append(work_dir, reports):
+    """Reports per second written with append_to_a_json_report."""
+    path = os.path.join(work_dir, 'append.json')
+    report_dicts = [_report_dict(i) for i in xrange(reports)]
+    start_time = time.time()
+    for report_dict in report_dicts:
+        solid_test_report.append_to_a_json_report(path, report_dict)
+    return _result(reports / (time.time() - start_time), 'reports/s', higher_is_better=True)
+
+
+def _write_json_report(path, cases):
+    with open(path, 'wb') as jf:
+        for i in xrange(cases):
+            jf.write(solid_test_report.json_report_line(_report_dict(i)).encode('utf-8'))
+
+
+def _convert_in_child(json_path, xml_path, connection):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+    solid_test_report.create_junit_report_from_json_report(json_path, xml_path)
+    elapsed = time.time() - start_time
+    connection.send((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before))
+    connection.close()
+
+
+def bench_junit(work_dir, cases):
+    """Cases per second and peak memory growth (KB) of create_junit_report_from_json_report.
+
+    The conversion runs in a child process, so the peak is not hidden by the memory this process already uses.
+    """
+    json_path = os.path.join(work_dir, 'junit_{}.json'.format(cases))
+    xml_path = os.path.join(work_dir, 'junit_{}.xml'.format(cases))
+    _write_json_report(json_path, cases)
+    parent_end, child_end = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_convert_in_child, args=(json_path, xml_path, child_end))
+    process.start()
+    child_end.close()
+    elapsed, peak_memory = parent_end.recv()
+    process.join()
+    os.remove(json_path)
+    os.remove(xml_path)
+    return {'junit.{}.cases_per_second'.format(cases): _result(cases / elapsed, 'cases/s', higher_is_better=True),
+            'junit.{}.peak_memory_kb'.format(cases): _result(peak_memory, 'KB')}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, run_tests=DEFAULT_RUN_TESTS, capture_iterations=DEFAULT_CAPTURE_ITERATIONS,
+                   append_reports=DEFAULT_APPEND_REPORTS):
+    """Runs all benchmarks, returns the machine-readable results."""
+    work_dir = tempfile.mkdtemp(prefix='solid_test_bench_')
+    benchmarks = {}
+    try:
+        log.info(u'Benchmarking run overhead with {} empty tests'.format(run_tests))
+        benchmarks['run.per_test_overhead'] = bench_run_overhead(work_dir, run_tests)
+        log.info(u'Benchmarking capture start/stop')
+        benchmarks['capture.start_stop'] = bench_capture(capture_iterations)
+        log.info(u'Benchmarking append_to_a_json_report with {} reports'.format(append_reports))
+        benchmarks['json_append.reports_per_second'] = bench_json_append(work_dir, append_reports)
+        for cases in sizes:
+            log.info(u'Benchmarking create_junit_report_from_json_report with {} cases'.format(cases))
+            benchmarks.update(bench_junit(work_dir, cases))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'time': time.time(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'benchmarks': benchmarks}
+
+
+def compare(results, baseline, thresholds=None, default_threshold=DEFAULT_THRESHOLD):
+    """Compares results with baseline results, returns the regressions as (name, baseline value, value, change).
+
+    A benchmark regressed if it got worse by more than its threshold (relative, 0.1 is 10%), given per name in
+    thresholds or default_threshold. Benchmarks missing from either side are not compared.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for name, result in sorted(results['benchmarks'].iteritems()):
+        base = baseline['benchmarks'].get(name)
+        if base is None or not base['value']:
+            continue
+        change = (result['value'] - base['value']) / float(base['value'])
+        worse = -change if result['higher_is_better'] else change
+        if worse > thresholds.get(name, default_threshold):
+            regressions.append((name, base['value'], result['value'], change))
+    return regressions
+
+
+def _parse_thresholds(values):
+    thresholds = {}
+    for value in values:
+        name, _, threshold = value.rpartition('=')
+        thresholds[name] = float(threshold)
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Benchmarks of the solid test framework itself.')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help=u'comma separated JUnit conversion sizes (default: %(default)s)')
+    parser.add_argument('--run-tests', type=int, default=DEFAULT_RUN_TESTS)
+    parser.add_argument('--capture-iterations', type=int, default=DEFAULT_CAPTURE_ITERATIONS)
+    parser.add_argument('--append-reports', type=int, default=DEFAULT_APPEND_REPORTS)
+    parser.add_argument('--output', help=u'write the results as JSON to this file')
+    parser.add_argument('--baseline', help=u'compare with the results stored in this file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=u'allowed relative regression (default: %(default)s)')
+    parser.add_argument('--benchmark-threshold', action='append', default=[], metavar='NAME=THRESHOLD',
+                        help=u'allowed relative regression of one benchmark')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks([int(s) for s in args.sizes.split(',') if s], args.run_tests,
+                             args.capture_iterations, args.append_reports)
+    for name, result in sorted(results['benchmarks'].iteritems()):
+        print(u'{:45} {:>16.6g} {}'.format(name, result['value'], result['unit']))
+    if args.output:
+        with open(args.output, 'wb') as rf:
+            json.dump(results, rf, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, 'rb') as bf:
+            baseline = json.load(bf)
+        regressions = compare(results, baseline, _parse_thresholds(args.benchmark_threshold), args.threshold)
+        for name, base_value, value, change in regressions:
+            print(u'REGRESSION {}: {:.6g} -> {:.6g} ({:+.1%})'.format(name, base_value, value, change))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import inspect
+import hashlib
+import logging
+
+import solid_test_report
+
+log = logging.getLogger()
+
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def cache_inputs(files=(), env=()):
+    """Declares the data files and environment variables a test method or test class depends on.
+
+    Their contents and values become part of the test's cache key, see test_cache_key().
+    """
+    def decorator(obj):
+        obj.__solid_cache_files__ = tuple(getattr(obj, '__solid_cache_files__', ())) + tuple(files)
+        obj.__solid_cache_env__ = tuple(getattr(obj, '__solid_cache_env__', ())) + tuple(env)
+        return obj
+    return decorator
+
+
+class _FileDigests(object):
+    """Content digests of files, recomputed only when a file's size or mtime changes."""
+
+    def __init__(self):
+        self._digests = {}
+
+    def digest(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 'missing'
+        signature = (stat.st_size, stat.st_mtime)
+        cached = self._digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as df:
+            for chunk in iter(lambda: df.read(1024 * 1024), ''):
+                digest.update(chunk)
+        self._digests[path] = (signature, digest.hexdigest())
+        return self._digests[path][1]
+
+
+_file_digests = _FileDigests()
+
+
+def test_cache_key(test):
+    """Returns a hash of everything a test's outcome is assumed to depend on, None if it can not be computed.
+
+    The key covers the test id, the source of the test method, of its class and of the modules defining them,
+    and the files and environment variables declared with cache_inputs().
+    """
+    method_name = getattr(test, '_testMethodName', None)
+    if method_name is None:
+        return None
+    method = getattr(test, method_name)
+    cls = test.__class__
+    key = hashlib.sha1()
+    key.update(solid_test_report.test_id(solid_test_report.test_identity(test)).encode('utf-8'))
+    try:
+        key.update(inspect.getsource(method))
+        key.update(inspect.getsource(cls))
+        module_paths = set(inspect.getsourcefile(obj) for obj in (method, cls))
+    except (IOError, TypeError):
+        return None
+    for path in sorted(p for p in module_paths if p):
+        key.update(path)
+        key.update(_file_digests.digest(path))
+
+    for owner in (cls, getattr(method, '__func__', method)):
+        for path in getattr(owner, '__solid_cache_files__', ()):
+            key.update(path)
+            key.update(_file_digests.digest(path))
+        for name in getattr(owner, '__solid_cache_env__', ()):
+            key.update(json.dumps([name, os.environ.get(name)]))
+    return key.hexdigest()
+
+
+class ResultCache(object):
+    """Cache keys of tests that passed, stored on disk as one JSON object.
+
+    Every key maps to [time it was last stored, test id]. Entries older than max_age seconds are evicted, and past
+    max_entries the oldest ones are.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as cf:
+                    self._entries = json.load(cf)
+            except ValueError:
+                log.warn(u'Ignoring corrupted result cache {}'.format(path))
+        self.evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key is not None and key in self._entries
+
+    def add(self, key, test_id):
+        self._entries[key] = [time.time(), test_id]
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def add_report(self, report_dict):
+        key = report_dict.get('cache_key')
+        if key is None or report_dict['outcome'] == 'cached':
+            return
+        if report_dict['outcome'] == 'pass':
+            self.add(key, solid_test_report.test_id(report_dict))
+        else:
+            self.discard(key)
+
+    def evict(self):
+        oldest_allowed = time.time() - self.max_age
+        for key in [k for k, (stored, _) in self._entries.iteritems() if stored < oldest_allowed]:
+            del self._entries[key]
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            for key in sorted(self._entries, key=lambda k: self._entries[k][0])[:excess]:
+                del self._entries[key]
+
+    def save(self):
+        self.evict()
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as cf:
+            json.dump(self._entries, cf, separators=(',', ':'))
+        os.rename(temp_path, self.path)
+
+
+class ResultCacheReporter(solid_test_report.SolidTestReporter):
+    """Records passed and failed tests of a run into a ResultCache and saves it when the run is over."""
+
+    def __init__(self, result_cache):
+        self.result_cache = result_cache
+
+    def write(self, reports):
+        for report_dict in reports:
+            self.result_cache.add_report(report_dict)
+
+    def close(self):
+        self.result_cache.save()
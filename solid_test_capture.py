@@ -0,0 +1,256 @@
+import sys
+import codecs
+import logging
+import tempfile
+import threading
+import collections
+
+import solid_test_async
+
+DEFAULT_SPILL_THRESHOLD = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class CaptureBuffer(object):
+    """File-like object capturing test output in place of StringIO.
+
+    Output is kept in memory up to spill_threshold bytes and spilled to a temporary file past it. When head_limit
+    or tail_limit is set, only the first head_limit and the last tail_limit bytes are kept, the number of
+    dropped bytes is stored in truncated_bytes and a marker is put in their place when the output is read.
+    The captured text is read with iter_chunks(), getvalue() builds it in one piece.
+    """
+
+    def __init__(self, spill_threshold=DEFAULT_SPILL_THRESHOLD, head_limit=None, tail_limit=None, encoding='utf-8'):
+        self.encoding = encoding
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.truncated_bytes = 0
+        self.size = 0
+        self._truncating = head_limit is not None or tail_limit is not None
+        self._head = tempfile.SpooledTemporaryFile(max_size=spill_threshold)
+        self._head_size = 0
+        self._tail = collections.deque()
+        self._tail_size = 0
+
+    def write(self, data):
+        if self._head is None:
+            return
+        if isinstance(data, unicode):
+            data = data.encode(self.encoding)
+        self.size += len(data)
+        if not self._truncating:
+            self._head.write(data)
+            return
+
+        head_room = (self.head_limit or 0) - self._head_size
+        if head_room > 0:
+            self._head.write(data[:head_room])
+            self._head_size += len(data[:head_room])
+            data = data[head_room:]
+        if data:
+            self._tail.append(data)
+            self._tail_size += len(data)
+            self._trim_tail()
+
+    def _trim_tail(self):
+        excess = self._tail_size - (self.tail_limit or 0)
+        while excess > 0:
+            chunk = self._tail.popleft()
+            if len(chunk) > excess:
+                self._tail.appendleft(chunk[excess:])
+                dropped = excess
+            else:
+                dropped = len(chunk)
+            self._tail_size -= dropped
+            self.truncated_bytes += dropped
+            excess -= dropped
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self._head is not None:
+            self._head.close()
+            self._head = None
+            self._tail.clear()
+
+    @property
+    def closed(self):
+        return self._head is None
+
+    def iter_chunks(self, chunk_size=READ_CHUNK_SIZE):
+        """Yields the captured output as unicode chunks, without building it in memory."""
+        if self._head is None:
+            return
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        position = self._head.tell()
+        self._head.seek(0)
+        try:
+            while True:
+                data = self._head.read(chunk_size)
+                if not data:
+                    break
+                text = decoder.decode(data)
+                if text:
+                    yield text
+        finally:
+            self._head.seek(position)
+        text = decoder.decode('', final=True)
+        if text:
+            yield text
+
+        if self.truncated_bytes:
+            yield u'\n... [{} bytes truncated] ...\n'.format(self.truncated_bytes)
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        for data in list(self._tail):
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode('', final=True)
+        if text:
+            yield text
+
+    def getvalue(self):
+        return u''.join(self.iter_chunks())
+
+    def __unicode__(self):
+        return self.getvalue()
+
+    def __str__(self):
+        return self.getvalue().encode(self.encoding)
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        return self.size > 0
+
+
+def materialize(value):
+    """Returns the captured text of a CaptureBuffer, other values are returned as they are."""
+    if isinstance(value, CaptureBuffer):
+        return value.getvalue()
+    return value
+
+
+_routing = threading.local()
+
+
+def route_tasks_of(loop):
+    """Makes the tasks of loop, not the current thread, own the output written by them, see OutputRouter."""
+    _routing.loop = loop
+
+
+def current_owner():
+    """Returns the current asyncio task of the loop passed to route_tasks_of() if any, or the current thread."""
+    loop = getattr(_routing, 'loop', None)
+    if loop is not None:
+        task = solid_test_async.current_task(loop)
+        if task is not None:
+            return task
+    return threading.current_thread()
+
+
+class _Routes(object):
+    """Buffers by owner, the current owner by default, see current_owner()."""
+
+    def register(self, buffer, owner=None):
+        self.buffers[owner or current_owner()] = buffer
+
+    def unregister(self, owner=None):
+        """Stops routing the output of the owner, returns its buffer or None if it had none."""
+        return self.buffers.pop(owner or current_owner(), None)
+
+    def current_buffer(self):
+        return self.buffers.get(current_owner())
+
+
+class RoutingStream(_Routes):
+    """Stands in for sys.stdout or sys.stderr, writing to the buffer registered for the current owner.
+
+    Output of owners without a buffer, e.g. threads started by a test, goes to the replaced stream.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.buffers = {}
+
+    def _target(self):
+        # not "or", an empty CaptureBuffer is false
+        buffer = self.buffers.get(current_owner())
+        return self.fallback if buffer is None else buffer
+
+    def write(self, data):
+        self._target().write(data)
+
+    def writelines(self, lines):
+        self._target().writelines(lines)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        return current_owner() not in self.buffers and self.fallback.isatty()
+
+    # the print statement keeps the pending separator on the stream, kept per target so threads do not share it
+    @property
+    def softspace(self):
+        return getattr(self._target(), 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self._target().softspace = value
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+class RoutingHandler(logging.Handler, _Routes):
+    """Root logger handler writing records to the buffer registered for the owner logging them."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.buffers = {}
+
+    def emit(self, record):
+        buffer = self.buffers.get(current_owner())
+        if buffer is None:
+            return
+        try:
+            buffer.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+class OutputRouter(object):
+    """Captures output per thread (or asyncio task) while tests run concurrently.
+
+    install() puts RoutingStreams in place of sys.stdout and sys.stderr and a RoutingHandler on the root logger,
+    the capture methods of SolidTestSuite then register the buffers of the current owner instead of replacing
+    the global streams.
+    """
+
+    def __init__(self):
+        self.stdout = None
+        self.stderr = None
+        self.logger_handler = RoutingHandler()
+
+    def install(self):
+        self.stdout = sys.stdout = RoutingStream(sys.stdout)
+        self.stderr = sys.stderr = RoutingStream(sys.stderr)
+        logging.getLogger().addHandler(self.logger_handler)
+        return self
+
+    def uninstall(self):
+        logging.getLogger().removeHandler(self.logger_handler)
+        if sys.stdout is self.stdout:
+            sys.stdout = self.stdout.fallback
+        if sys.stderr is self.stderr:
+            sys.stderr = self.stderr.fallback
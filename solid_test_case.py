@@ -1,6 +1,13 @@
+import gc
 import sys
 import os
+import json
+import math
+import timeit
 import unittest
+import solid_test_async
+import solid_test_report
+import solid_test_timeout
 from solid_test_suite import SolidTestResult
 
 
@@ -20,65 +27,221 @@ class SolidTestCase(unittest.TestCase):
         if not isinstance(result, SolidTestResult):
             super(SolidTestCase, self).run(result)
         else:
-            if result is None:
-                raise Exception('No valid test result passed in a argument')
-            test_method = getattr(self, self._testMethodName)
-            if (getattr(self.__class__, "__unittest_skip__", False) or
-                    getattr(test_method, "__unittest_skip__", False)):
-                # If the class or method was skipped.
-                try:
-                    skip_why = (getattr(self.__class__, '__unittest_skip_why__', '')
-                                or getattr(test_method, '__unittest_skip_why__', ''))
-                    result.add_skip(self, skip_why)
-                finally:
-                    return
+            solid_test_async.run_steps(self._run_steps(result))
+
+    def run_async(self, result):
+        """Returns a coroutine running the test on the current event loop.
+
+        Coroutine test methods and coroutine setUp/tearDown are awaited, synchronous ones are called as in run().
+        """
+        if result is None:
+            raise Exception('No valid test result passed in a argument')
+        return solid_test_async.steps_coroutine(self._run_steps(result))
+
+    def _run_steps(self, result):
+        """Generator with the body of run(), yielding the test's callables so they can be driven sync or async."""
+        if result is None:
+            raise Exception('No valid test result passed in a argument')
+        test_method = getattr(self, self._testMethodName)
+        if (getattr(self.__class__, "__unittest_skip__", False) or
+                getattr(test_method, "__unittest_skip__", False)):
+            # If the class or method was skipped.
+            try:
+                skip_why = (getattr(self.__class__, '__unittest_skip_why__', '')
+                            or getattr(test_method, '__unittest_skip_why__', ''))
+                result.add_skip(self, skip_why)
+            finally:
+                return
 
-            success = False
+        success = False
+        try:
+            result.start_phase('setUp')
             try:
-                self.setUp()
+                yield self.setUp
+            finally:
+                result.end_phase('setUp')
+        except unittest.SkipTest as e:
+            result.add_skip(self, unicode(e))
+        except KeyboardInterrupt:
+            raise
+        except:
+            result.add_error(self, sys.exc_info())
+        else:
+            try:
+                result.start_phase('test')
+                try:
+                    yield _with_coroutine_timeout(self._test_step(test_method, result), result.coroutine_timeout)
+                finally:
+                    result.end_phase('test')
+            except KeyboardInterrupt:
+                raise
+            except self.failureException:
+                result.add_failure(self, sys.exc_info())
+            except unittest.case._ExpectedFailure as e:
+                addExpectedFailure = getattr(result, 'addExpectedFailure', None)
+                if addExpectedFailure is not None:
+                    addExpectedFailure(self, e.exc_info)
+                else:
+                    result.addSuccess(self)
+            except unittest.case._UnexpectedSuccess:
+                addUnexpectedSuccess = getattr(result, 'addUnexpectedSuccess', None)
+                if addUnexpectedSuccess is not None:
+                    addUnexpectedSuccess(self)
+                else:
+                    result.addFailure(self, sys.exc_info())
             except unittest.SkipTest as e:
                 result.add_skip(self, unicode(e))
+            except:
+                result.addError(self, sys.exc_info())
+            else:
+                success = True
+
+            try:
+                result.start_phase('tearDown')
+                try:
+                    yield self.tearDown
+                finally:
+                    result.end_phase('tearDown')
             except KeyboardInterrupt:
                 raise
             except:
                 result.add_error(self, sys.exc_info())
-            else:
-                try:
-                    test_method()
-                except KeyboardInterrupt:
-                    raise
-                except self.failureException:
-                    result.add_failure(self, sys.exc_info())
-                except unittest.case._ExpectedFailure as e:
-                    addExpectedFailure = getattr(result, 'addExpectedFailure', None)
-                    if addExpectedFailure is not None:
-                        addExpectedFailure(self, e.exc_info)
-                    else:
-                        result.addSuccess(self)
-                except unittest.case._UnexpectedSuccess:
-                    addUnexpectedSuccess = getattr(result, 'addUnexpectedSuccess', None)
-                    if addUnexpectedSuccess is not None:
-                        addUnexpectedSuccess(self)
-                    else:
-                        result.addFailure(self, sys.exc_info())
-                except unittest.SkipTest as e:
-                    result.add_skip(self, unicode(e))
-                except:
-                    result.addError(self, sys.exc_info())
-                else:
-                    success = True
+                success = False
+        try:
+            clean_up_success = yield self.doCleanups
+        except:
+            clean_up_success = False
+        success = success and clean_up_success
+        if success:
+            result.add_success(self)
 
-                try:
-                    self.tearDown()
-                except KeyboardInterrupt:
-                    raise
-                except:
-                    result.add_error(self, sys.exc_info())
-                    success = False
+    def _test_step(self, test_method, result):
+        """Returns the callable running the test method, subclasses can wrap it."""
+        return test_method
+
+
+def _with_coroutine_timeout(step, seconds):
+    """Wraps a test step, so a coroutine it returns is cancelled after seconds (None for no timeout).
+
+    A synchronous test method is interrupted with solid_test_timeout.alarm() instead.
+    """
+    if seconds is None:
+        return step
+
+    def step_with_timeout():
+        with solid_test_timeout.alarm(seconds):
+            value = step()
+        if solid_test_async.is_coroutine(value):
+            return solid_test_async.wait_for(value, seconds, lambda: solid_test_timeout.SolidTestTimeoutException(
+                u'Test timed out after {}s'.format(seconds)))
+        return value
+    return step_with_timeout
+
+
+def _percentile(ordered, percent):
+    """Linearly interpolated percentile of an ordered list of numbers."""
+    position = (len(ordered) - 1) * percent / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def benchmark_statistics(samples):
+    """Returns min, max, mean, median, stddev and the 90th and 99th percentile of samples."""
+    ordered = sorted(samples)
+    mean = sum(ordered) / len(ordered)
+    variance = sum((s - mean) ** 2 for s in ordered) / (len(ordered) - 1) if len(ordered) > 1 else 0.0
+    return {'min': ordered[0], 'max': ordered[-1], 'mean': mean, 'median': _percentile(ordered, 50),
+            'stddev': math.sqrt(variance), 'p90': _percentile(ordered, 90), 'p99': _percentile(ordered, 99)}
+
+
+class SolidBenchmarkCase(SolidTestCase):
+    """Test case whose test methods are benchmarks: their body is timed over many rounds.
+
+    After warmup_rounds untimed calls the number of calls per round is doubled until a round takes at least
+    min_round_time seconds, then rounds rounds are timed (with the garbage collector disabled, unless
+    disable_gc is False). The statistics of the time per call go into a 'benchmark' field of the report.
+    If baseline_path names a baseline written by update_benchmark_baseline(), the test fails when its median is
+    more than baseline_margin (relative, 0.2 is 20%) slower than the baseline's. Coroutine methods are not
+    supported.
+    """
+    warmup_rounds = 3
+    min_round_time = 0.05
+    max_iterations = 1000000
+    rounds = 20
+    disable_gc = True
+    baseline_path = None
+    baseline_margin = 0.2
+
+    _baselines = {}
+
+    def _test_step(self, test_method, result):
+        return lambda: self._benchmark(test_method, result)
+
+    @staticmethod
+    def _time_round(test_method, iterations):
+        start_time = timeit.default_timer()
+        for _ in xrange(iterations):
+            test_method()
+        return timeit.default_timer() - start_time
+
+    def _benchmark(self, test_method, result):
+        for _ in xrange(self.warmup_rounds):
+            test_method()
+        gc_was_enabled = gc.isenabled()
+        if self.disable_gc:
+            gc.disable()
+        try:
+            iterations = 1
+            while self._time_round(test_method, iterations) < self.min_round_time and \
+                    iterations < self.max_iterations:
+                iterations = min(iterations * 2, self.max_iterations)
+            samples = [self._time_round(test_method, iterations) / iterations for _ in xrange(self.rounds)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        statistics = benchmark_statistics(samples)
+        statistics.update({'rounds': self.rounds, 'iterations': iterations})
+        result.report_fields['benchmark'] = statistics
+        self._check_baseline(statistics)
+
+    def _check_baseline(self, statistics):
+        if self.baseline_path is None:
+            return
+        baseline = self._load_baseline(self.baseline_path)
+        baseline_median = baseline.get(solid_test_report.test_id(solid_test_report.test_identity(self)))
+        if baseline_median is None:
+            return
+        statistics['baseline_median'] = baseline_median
+        if statistics['median'] > baseline_median * (1 + self.baseline_margin):
+            raise self.failureException(u'Median {:.6g}s is more than {:.0%} slower than the baseline {:.6g}s'.format(
+                statistics['median'], self.baseline_margin, baseline_median))
+
+    @classmethod
+    def _load_baseline(cls, path):
+        if path not in cls._baselines:
             try:
-                clean_up_success = self.doCleanups()
-            except:
-                clean_up_success = False
-            success = success and clean_up_success
-            if success:
-                result.add_success(self)
+                with open(path, 'rb') as bf:
+                    cls._baselines[path] = json.load(bf)
+            except IOError:
+                cls._baselines[path] = {}
+        return cls._baselines[path]
+
+
+def update_benchmark_baseline(json_report_path, baseline_path):
+    """Stores the benchmark medians of a JSON report as the baseline of SolidBenchmarkCase, by test id.
+
+    Tests already in the baseline but not in the report keep their baseline.
+    """
+    try:
+        with open(baseline_path, 'rb') as bf:
+            baseline = json.load(bf)
+    except IOError:
+        baseline = {}
+    for report_dict in solid_test_report.iter_json_report(json_report_path):
+        if report_dict.get('benchmark'):
+            baseline[solid_test_report.test_id(report_dict)] = report_dict['benchmark']['median']
+    with open(baseline_path, 'wb') as bf:
+        json.dump(baseline, bf, indent=1, sort_keys=True)
+    SolidBenchmarkCase._baselines.pop(baseline_path, None)
@@ -0,0 +1,316 @@
+import os
+import ast
+import sys
+import json
+import fnmatch
+import collections
+import hashlib
+import logging
+import importlib
+import py_compile
+import multiprocessing
+
+import solid_test_case
+import solid_test_report
+import solid_test_sources
+
+log = logging.getLogger()
+
+DEFAULT_PATTERN = 'test*.py'
+TEST_METHOD_PREFIX = 'test'
+# Base classes whose subclasses are test classes, more are added from the discovered test classes themselves
+TEST_CASE_BASES = ('SolidTestCase',)
+
+
+class DiscoveredTest(object):
+    """A test method found in a source file, not imported yet."""
+
+    def __init__(self, path, module, class_name, method):
+        self.path = path
+        self.module = module
+        self.class_name = class_name
+        self.method = method
+
+    @property
+    def test_id(self):
+        return u'{}.{}.{}'.format(self.module, self.class_name, self.method)
+
+    @property
+    def identity(self):
+        """The identity fields of the test's reports, unless its class overrides get_module(), get_class() or
+        get_name(), see solid_test_report.test_identity()."""
+        return {'name': self.method, 'class_name': self.class_name,
+                'suite': solid_test_case.SolidTestCase.get_module.__func__(None)}
+
+    @property
+    def report_id(self):
+        """The id the test's reports will have, see identity."""
+        return solid_test_report.test_id(self.identity)
+
+    @property
+    def fixture_names(self):
+        return self.module, self.class_name
+
+    def __repr__(self):
+        return '<DiscoveredTest {}>'.format(self.test_id)
+
+
+def _base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _parse_classes(source, path):
+    """Returns [class name, base names, test method names] of the classes defined at the top of a module."""
+    classes = []
+    for node in ast.parse(source, path).body:
+        if isinstance(node, ast.ClassDef):
+            methods = [n.name for n in node.body
+                       if isinstance(n, ast.FunctionDef) and n.name.startswith(TEST_METHOD_PREFIX)]
+            classes.append([node.name, [b for b in map(_base_name, node.bases) if b], methods])
+    return classes
+
+
+def _module_name(path, top_level_dir):
+    relative = os.path.splitext(os.path.relpath(path, top_level_dir))[0]
+    return '.'.join(relative.split(os.sep))
+
+
+class DiscoveryCache(object):
+    """Classes found in source files, stored on disk as one JSON object keyed by path.
+
+    Every path maps to [mtime, size, sha1 of the contents, classes], a file is parsed again only when its
+    contents changed, a changed mtime with the same contents only costs reading and hashing it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._changed = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'rb') as cf:
+                    self._entries = json.load(cf)
+            except ValueError:
+                log.warn(u'Ignoring corrupted discovery cache {}'.format(path))
+
+    def classes(self, path):
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry[:2] == [stat.st_mtime, stat.st_size]:
+            return entry[3]
+        with open(path, 'rb') as sf:
+            source = sf.read()
+        digest = hashlib.sha1(source).hexdigest()
+        if entry is not None and entry[2] == digest:
+            classes = entry[3]
+        else:
+            classes = _parse_classes(source, path)
+        self._entries[path] = [stat.st_mtime, stat.st_size, digest, classes]
+        self._changed = True
+        return classes
+
+    def save(self):
+        if self.path is None or not self._changed:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as cf:
+            json.dump(self._entries, cf, separators=(',', ':'))
+        os.rename(temp_path, self.path)
+        self._changed = False
+
+
+def _find_files(start_dir, pattern):
+    for directory, directories, files in os.walk(start_dir):
+        # like unittest, only descend into packages
+        directories[:] = sorted(d for d in directories if os.path.exists(os.path.join(directory, d, '__init__.py')))
+        for name in sorted(files):
+            if fnmatch.fnmatch(name, pattern):
+                yield os.path.join(directory, name)
+
+
+def discover(start_dir, pattern=DEFAULT_PATTERN, top_level_dir=None, cache_path=None):
+    """Finds the test methods of SolidTestCase subclasses in the files matching pattern, without importing them.
+
+    Modules are parsed, not imported, so test classes are recognized by their base class names: SolidTestCase and
+    the test classes found in the scanned files. Tests created dynamically (e.g. by a metaclass) are not found.
+    Parsed files are remembered in a DiscoveryCache at cache_path. Returns a list of DiscoveredTest.
+    """
+    start_dir = os.path.abspath(start_dir)
+    top_level_dir = os.path.abspath(top_level_dir or start_dir)
+    cache = DiscoveryCache(cache_path)
+    modules = []
+    for path in _find_files(start_dir, pattern):
+        try:
+            modules.append((path, cache.classes(path)))
+        except (SyntaxError, IOError, OSError):
+            log.exception(u'Could not discover tests in {}, will ignore:'.format(path))
+    cache.save()
+
+    # a class is a test class if one of its bases is, inherited test methods are followed by name: a base name is
+    # the class of that name in the same module, or else the first class of that name in the scanned modules
+    classes_by_key = collections.OrderedDict()
+    keys_by_name = {}
+    for path, classes in modules:
+        module = _module_name(path, top_level_dir)
+        for class_name, bases, methods in classes:
+            classes_by_key.setdefault((module, class_name), (bases, methods))
+            keys_by_name.setdefault(class_name, (module, class_name))
+
+    def base_key(module, base):
+        return (module, base) if (module, base) in classes_by_key else keys_by_name.get(base)
+
+    test_class_keys = set()
+    changed = True
+    while changed:
+        changed = False
+        for key, (bases, _) in classes_by_key.iteritems():
+            if key not in test_class_keys and any(base in TEST_CASE_BASES or base_key(key[0], base) in test_class_keys
+                                                  for base in bases):
+                test_class_keys.add(key)
+                changed = True
+
+    def test_methods(key, seen):
+        if key in seen or key not in classes_by_key:
+            return []
+        seen.add(key)
+        bases, methods = classes_by_key[key]
+        inherited = [m for base in bases for m in test_methods(base_key(key[0], base), seen)]
+        return methods + [m for m in inherited if m not in methods]
+
+    tests = []
+    for path, classes in modules:
+        module = _module_name(path, top_level_dir)
+        for class_name, bases, methods in classes:
+            key = (module, class_name)
+            if key in test_class_keys and class_name not in TEST_CASE_BASES:
+                for method in sorted(set(methods + test_methods(key, set()))):
+                    tests.append(DiscoveredTest(path, module, class_name, method))
+    return tests
+
+
+def filter_tests(tests, patterns):
+    """Returns the tests whose test id ('module.Class.method') matches one of the fnmatch patterns."""
+    return [test for test in tests if any(fnmatch.fnmatch(test.test_id, p) for p in patterns)]
+
+
+class _ImportFailure(solid_test_case.SolidTestCase):
+    """Stands in for a discovered test whose module or class could not be loaded, failing with that error."""
+
+    def __init__(self, methodName='test_import', discovered_test=None, error=None):
+        super(_ImportFailure, self).__init__(methodName)
+        self.discovered_test = discovered_test
+        self.error = error
+
+    def __copy__(self):
+        return self.__class__(self._testMethodName, self.discovered_test, self.error)
+
+    def get_name(self):
+        return self.discovered_test.method
+
+    def get_class(self, full=False):
+        return self.discovered_test.class_name
+
+    def test_import(self):
+        raise ImportError(u'Could not load test {}: {}'.format(self.discovered_test.test_id, self.error))
+
+
+def load_test(test):
+    """Returns an instance of a discovered test, importing its module if needed, an _ImportFailure if that fails."""
+    try:
+        cls = getattr(importlib.import_module(test.module), test.class_name)
+        return cls(test.method)
+    except Exception as e:
+        log.exception(u'Could not load test {}:'.format(test.test_id))
+        return _ImportFailure(discovered_test=test, error=e)
+
+
+def iter_test_instances(tests):
+    """Yields instances of discovered tests, importing their modules only when their first test is needed."""
+    for test in tests:
+        yield load_test(test)
+
+
+class DiscoveredTestSource(solid_test_sources.TestSource):
+    """Discovered tests as a test source of a SolidTestSuite, see iter_test_instances().
+
+    The fixture names and report ids of the tests come from the discovery, so counting the fixtures of a run or
+    estimating its run time imports nothing, and the tests can be reordered and selected like the suite's own.
+    """
+
+    reorderable = True
+
+    def __init__(self, tests):
+        super(DiscoveredTestSource, self).__init__(lambda: iter_test_instances(self.tests))
+        self.tests = list(tests)
+
+    def __len__(self):
+        return len(self.tests)
+
+    def fixture_names(self):
+        return [test.fixture_names for test in self.tests]
+
+    def test_ids(self):
+        return [test.report_id for test in self.tests]
+
+    def identities(self):
+        return [test.identity for test in self.tests]
+
+    def test_at(self, index):
+        return load_test(self.tests[index])
+
+    def reorder(self, order):
+        self.tests = order(self.tests, lambda test: test.report_id, lambda test: test.fixture_names)
+
+
+def _compile(path):
+    try:
+        py_compile.compile(path, doraise=True)
+    except py_compile.PyCompileError as e:
+        return e.msg
+    return None
+
+
+def precompile(paths, workers=None):
+    """Byte-compiles the given modules in parallel worker processes, skipping those with up to date .pyc files.
+
+    Imports are serialized by the import lock, compiling them beforehand is the part that can run in parallel.
+    """
+    stale = []
+    for path in sorted(set(paths)):
+        compiled = path + ('c' if __debug__ else 'o')
+        if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(path):
+            stale.append(path)
+    if not stale:
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for path, error in zip(stale, pool.map(_compile, stale)):
+            if error is not None:
+                log.warn(u'Could not compile {}: {}'.format(path, error))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def add_discovered_tests(suite, start_dir, pattern=DEFAULT_PATTERN, top_level_dir=None, patterns=None,
+                         cache_path=None, compile_workers=None):
+    """Discovers tests and adds them to a SolidTestSuite as a lazy test source, returns the number of tests.
+
+    patterns filters the tests by id, see filter_tests(). Modules are imported when their first test is about to
+    run, so filtered out modules are never imported. With compile_workers the selected modules are byte-compiled
+    in that many processes first.
+    """
+    top_level_dir = os.path.abspath(top_level_dir or start_dir)
+    if top_level_dir not in sys.path:
+        sys.path.insert(0, top_level_dir)
+    tests = discover(start_dir, pattern, top_level_dir, cache_path)
+    if patterns:
+        tests = filter_tests(tests, patterns)
+    if compile_workers:
+        precompile([test.path for test in tests], compile_workers)
+    suite.add_test_source(DiscoveredTestSource(tests))
+    return len(tests)
@@ -0,0 +1,484 @@
+import os
+import sys
+import json
+import time
+import Queue
+import socket
+import logging
+import threading
+import collections
+import SocketServer
+import multiprocessing
+
+import solid_test_report
+import solid_test_fixtures
+import solid_test_exceptions
+
+log = logging.getLogger()
+
+DEFAULT_PORT = 7457
+HEARTBEAT_INTERVAL = 5
+WORKER_TIMEOUT = 60
+CONNECT_TIMEOUT = 30
+MAX_ATTEMPTS = 2
+MAX_BATCH = 32
+
+
+class SolidTestWorkerLostException(Exception):
+    pass
+
+
+def parse_address(address):
+    """Returns (host, port) for 'host:port', 'host', ':port' or a port number."""
+    if isinstance(address, (int, long)):
+        return '', address
+    if isinstance(address, tuple):
+        return address
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, DEFAULT_PORT
+    return host, int(port)
+
+
+def _free_loopback_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def _loopback_worker_main(suite, address, name, failfast):
+    suite.run_worker(address, failfast, name)
+
+
+def run_on_loopback(suite, result_json_path, workers=2, failfast=False, stop_trigger=False):
+    """Runs a SolidTestSuite distributed over workers forked on this machine, connected over loopback.
+
+    Exercises the coordinator and the worker protocol on one host, e.g. to test the distributed mode. The workers
+    are forked before the run starts its threads and connect once the coordinator listens. Returns the exit codes
+    of the worker processes.
+    """
+    address = '127.0.0.1:{}'.format(_free_loopback_port())
+    processes = [multiprocessing.Process(target=_loopback_worker_main, name='solid-test-loopback-{}'.format(i),
+                                         args=(suite, address, u'loopback-{}'.format(i), failfast))
+                 for i in xrange(workers)]
+    for process in processes:
+        process.start()
+    try:
+        suite.run(result_json_path, stop_trigger, failfast, coordinator=address)
+    finally:
+        for process in processes:
+            process.join()
+    return [process.exitcode for process in processes]
+
+
+class _Connection(object):
+    """A socket exchanging JSON objects, one per line. Sending is thread-safe."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._file = sock.makefile('rb')
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message, default=solid_test_report.json_default) + '\n'
+        try:
+            with self._send_lock:
+                self.sock.sendall(data)
+        except socket.error:
+            # the reading side notices the broken connection
+            return False
+        return True
+
+    def receive(self):
+        """Returns the next message, None when the connection is closed."""
+        try:
+            line = self._file.readline()
+        except socket.error:
+            return None
+        return json.loads(line) if line else None
+
+    def shutdown(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+class _WorkerState(object):
+    def __init__(self, name, connection):
+        self.name = name
+        self.connection = connection
+        # positions handed out to the worker and not reported yet
+        self.assigned = set()
+        self.running = None
+        self.last_seen = time.time()
+        self.steal_pending = False
+
+    def unstarted(self):
+        return len(self.assigned) - (1 if self.running in self.assigned else 0)
+
+
+class _CoordinatorServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _CoordinatorRequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.server.coordinator.serve_worker(self.request, self.client_address)
+
+
+class Coordinator(object):
+    """Hands out the tests of a solid_test_sources.TestSchedule to workers connecting over TCP.
+
+    Workers (SolidTestSuite.run_worker() of the same suite on any host) ask for tests and get batches of positions
+    in the schedule with their test ids, shrinking as the queue empties. A worker asking when the queue is empty
+    steals the back half of the unstarted tests of the busiest worker. The tests of a worker that disconnects or
+    stays silent for worker_timeout seconds are queued again, the one it was running counts as an attempt, after
+    max_attempts attempts it is reported as an error. Progress is read from events, see SolidTestSuite.
+    """
+
+    def __init__(self, tests, address, worker_timeout=WORKER_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.worker_timeout = worker_timeout
+        self.max_attempts = max_attempts
+        # (suite, class name, name) of every position, known without creating the tests of discovered sources
+        self.identities = [tuple(identity[k] for k in ('suite', 'class_name', 'name'))
+                           for identity in tests.identities()]
+        # ('start', worker name, test id, start time), ('report', worker name, report), ('lost', worker name,
+        # position) or ('left', worker name, None), consumed by the thread running the suite
+        self.events = Queue.Queue()
+        self._lock = threading.Lock()
+        self._queue = collections.deque(xrange(len(self.identities)))
+        self._workers = {}
+        self._waiting = []
+        self._attempts = collections.Counter()
+        self._done = set()
+        self._stopping = False
+        self._server = _CoordinatorServer(parse_address(address), _CoordinatorRequestHandler)
+        self._server.coordinator = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def test_id(self, position):
+        return u'.'.join(self.identities[position])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='solid-test-coordinator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        with self._lock:
+            workers = self._workers.values()
+        for worker in workers:
+            worker.connection.send({'type': 'stop'})
+            worker.connection.shutdown()
+
+    def finished(self):
+        """Tells if all tests were reported (or the run was stopped and the workers left) and events were read."""
+        with self._lock:
+            over = len(self._done) == len(self.identities) or (self._stopping and not self._workers)
+        return over and self.events.empty()
+
+    def stop(self):
+        """Lets the workers finish their current test and asks them to leave."""
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            for worker in self._workers.values():
+                worker.connection.send({'type': 'stop'})
+            self._dispatch()
+
+    def check_workers(self):
+        """Disconnects the workers that stayed silent for longer than worker_timeout."""
+        deadline = time.time() - self.worker_timeout
+        with self._lock:
+            silent = [worker for worker in self._workers.values() if worker.last_seen < deadline]
+        for worker in silent:
+            log.error(u'Worker {} did not respond for {}s, disconnecting it'.format(worker.name, self.worker_timeout))
+            worker.connection.shutdown()
+
+    def serve_worker(self, sock, client_address):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        connection = _Connection(sock)
+        hello = connection.receive()
+        if not hello or hello.get('type') != 'hello':
+            connection.close()
+            return
+        if hello['tests'] != len(self.identities):
+            log.error(u'Rejecting worker {} from {}: it has {} tests, the coordinator {}'.format(
+                hello['worker'], client_address[0], hello['tests'], len(self.identities)))
+            connection.send({'type': 'reject', 'reason': u'the suite has {} tests, expected {}'.format(
+                hello['tests'], len(self.identities))})
+            connection.close()
+            return
+
+        with self._lock:
+            name = hello['worker']
+            while name in self._workers:
+                name += u"'"
+            worker = self._workers[name] = _WorkerState(name, connection)
+        log.info(u'Worker {} connected from {}'.format(name, client_address[0]))
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                self._handle(worker, message)
+        except Exception:
+            log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(self))
+        finally:
+            self._lost(worker)
+            connection.close()
+
+    def _handle(self, worker, message):
+        kind = message['type']
+        with self._lock:
+            worker.last_seen = time.time()
+            if kind == 'request':
+                self._waiting.append(worker)
+            elif kind == 'start':
+                worker.running = message['position']
+                self.events.put(('start', worker.name, self.test_id(worker.running), message['time']))
+            elif kind == 'report':
+                position = message['position']
+                worker.assigned.discard(position)
+                worker.running = None
+                if position not in self._done:
+                    self._done.add(position)
+                    self.events.put(('report', worker.name, message['report']))
+            elif kind == 'released':
+                worker.steal_pending = False
+                for position in reversed(message['positions']):
+                    worker.assigned.discard(position)
+                    self._queue.appendleft(position)
+            elif kind == 'stop':
+                self._stopping = True
+                for other in self._workers.values():
+                    other.connection.send({'type': 'stop'})
+            self._dispatch()
+
+    def _lost(self, worker):
+        with self._lock:
+            if self._workers.get(worker.name) is not worker:
+                return
+            del self._workers[worker.name]
+            if worker in self._waiting:
+                self._waiting.remove(worker)
+            requeued = []
+            for position in sorted(worker.assigned):
+                if position in self._done:
+                    continue
+                if position == worker.running:
+                    self._attempts[position] += 1
+                    if self._attempts[position] >= self.max_attempts:
+                        self._done.add(position)
+                        self.events.put(('lost', worker.name, position))
+                        continue
+                requeued.append(position)
+            self._queue.extendleft(reversed(requeued))
+            self.events.put(('left', worker.name, None))
+            if requeued or worker.running is not None:
+                log.error(u'Worker {} left with {} unfinished tests, queued them again'.format(
+                    worker.name, len(requeued)))
+            self._dispatch()
+
+    def _dispatch(self):
+        """Serves the waiting workers from the queue or by stealing, called with the lock held."""
+        while self._waiting and self._queue and not self._stopping:
+            worker = self._waiting.pop(0)
+            size = max(1, min(MAX_BATCH, len(self._queue) // (2 * len(self._workers))))
+            positions = [self._queue.popleft() for _ in xrange(min(size, len(self._queue)))]
+            worker.assigned.update(positions)
+            worker.connection.send({'type': 'tests', 'tests': [[p, self.test_id(p)] for p in positions]})
+
+        if self._stopping or len(self._done) == len(self.identities):
+            for worker in self._waiting:
+                worker.connection.send({'type': 'done'})
+            self._waiting = []
+            return
+        for thief in self._waiting:
+            victims = [w for w in self._workers.values() if not w.steal_pending and w.unstarted() > 1]
+            if not victims:
+                break
+            victim = max(victims, key=_WorkerState.unstarted)
+            victim.steal_pending = True
+            victim.connection.send({'type': 'steal', 'count': victim.unstarted() // 2})
+            log.debug(u'Worker {} steals from worker {}'.format(thief.name, victim.name))
+
+
+def lost_test_report(identity, worker_name):
+    """Returns the error report of a test whose worker was lost while running it every time it was tried."""
+    try:
+        raise SolidTestWorkerLostException(u'Worker {} was lost while running the test'.format(worker_name))
+    except SolidTestWorkerLostException:
+        exception = solid_test_exceptions.StructuredException(sys.exc_info())
+    report_dict = dict(zip(('suite', 'class_name', 'name'), identity))
+    report_dict.update({'outcome': 'error', 'time': 0.0, 'stdout': u'', 'stderr': u'', 'logger': u'',
+                        'exc': [exception], 'fixture_time': {'set_up': 0.0, 'tear_down': 0.0}, 'worker': worker_name})
+    return report_dict
+
+
+class Worker(object):
+    """Runs the tests a Coordinator hands out, with the hooks of the suite, see SolidTestSuite.run_worker()."""
+
+    def __init__(self, suite, address, name=None, connect_timeout=CONNECT_TIMEOUT,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.suite = suite
+        self.address = parse_address(address)
+        self.name = name or u'{}:{}'.format(socket.gethostname(), os.getpid())
+        self.connect_timeout = connect_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.tests = None
+        self._connection = None
+        # (position, test) handed out and not started, the back of it can be stolen
+        self._local = collections.deque()
+        # (module name, class name) of every fixture group this worker holds a lease on, see _add_tests()
+        self._leases = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._finished = False
+        self._requested = False
+        self._stopped = threading.Event()
+
+    def _connect(self):
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return _Connection(socket.create_connection(self.address))
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def run(self, failfast=False):
+        """Runs tests until the coordinator has no more, returns the number of tests run."""
+        self.tests = self.suite._scheduled_tests()
+        self.suite.fixture_manager = solid_test_fixtures.FixtureManager(())
+        self._connection = self._connect()
+        self._connection.send({'type': 'hello', 'worker': self.name, 'tests': len(self.tests)})
+        threads = [threading.Thread(target=self._receive_main, name='solid-test-worker-receive'),
+                   threading.Thread(target=self._heartbeat_main, name='solid-test-worker-heartbeat')]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        ran = 0
+        try:
+            while True:
+                position, test = self._next_test()
+                if test is None:
+                    break
+                self._connection.send({'type': 'start', 'position': position, 'time': time.time()})
+                result, test_case_report = self.suite._run_test_case(test)
+                test_case_report['worker'] = self.name
+                self._connection.send({'type': 'report', 'position': position,
+                                       'report': solid_test_report.materialize_report(test_case_report)})
+                solid_test_report.close_captured_output(test_case_report)
+                self.suite.current_test = None
+                ran += 1
+                if self.suite._should_stop(result, failfast) or self.suite.stop_trigger:
+                    self._connection.send({'type': 'stop'})
+                    break
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+            self._stopped.set()
+            self._connection.shutdown()
+            for thread in threads:
+                thread.join()
+            self._connection.close()
+            self._release_leases()
+            self.suite._tear_down_remaining_fixtures()
+        return ran
+
+    def _next_test(self):
+        with self._condition:
+            while not self._local and not self._finished:
+                if not self._requested:
+                    self._requested = True
+                    self._connection.send({'type': 'request'})
+                self._condition.wait(1)
+            if self._finished:
+                return None, None
+            return self._local.popleft()
+
+    def _receive_main(self):
+        while True:
+            message = self._connection.receive()
+            if message is None:
+                break
+            kind = message['type']
+            if kind == 'tests':
+                self._add_tests(message['tests'])
+            elif kind == 'steal':
+                self._release(message['count'])
+            elif kind in ('stop', 'done', 'reject'):
+                if kind == 'reject':
+                    log.error(u'The coordinator rejected this worker: {}'.format(message['reason']))
+                break
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def _add_tests(self, tests):
+        added = []
+        for position, expected_id in tests:
+            test = self.tests.test_at(position)
+            actual_id = solid_test_report.test_id(solid_test_report.test_identity(test))
+            if actual_id != expected_id:
+                log.error(u'Test {} of this worker is {}, the coordinator expected {}, both must run the same '
+                          u'suite in the same order'.format(position, actual_id, expected_id))
+                self._connection.shutdown()
+                return
+            names = solid_test_fixtures.fixture_names(test)
+            if names[1] is not None and names not in self._leases:
+                # keeps the group set up until the coordinator is done, not just until the end of this batch
+                self._leases[names] = True
+                self.suite.fixture_manager.add_names(*names)
+            self.suite.fixture_manager.add(test)
+            added.append((position, test))
+        with self._condition:
+            self._local.extend(added)
+            self._requested = False
+            self._condition.notify_all()
+
+    def _release_leases(self):
+        while self._leases:
+            names, _ = self._leases.popitem()
+            _, error = self.suite.fixture_manager.release_names(*names)
+            if error is not None:
+                log.error(u'Tearing down fixtures of {} failed:\n{}'.format(
+                    u'.'.join(names), solid_test_exceptions.StructuredException(error)))
+
+    def _release(self, count):
+        released = []
+        with self._condition:
+            while self._local and len(released) < count:
+                released.append(self._local.pop())
+        released.reverse()
+        for _, test in released:
+            _, error = self.suite.fixture_manager.tear_down(test)
+            if error is not None:
+                log.error(u'Tearing down fixtures after giving away {} failed:\n{}'.format(
+                    test, solid_test_exceptions.StructuredException(error)))
+        self._connection.send({'type': 'released', 'positions': [position for position, _ in released]})
+
+    def _heartbeat_main(self):
+        # keeps the coordinator from taking a worker busy with a long test for a dead one
+        while not self._stopped.wait(self.heartbeat_interval):
+            self._connection.send({'type': 'heartbeat'})
@@ -0,0 +1,95 @@
+import time
+import weakref
+import hashlib
+import datetime
+import linecache
+import threading
+import traceback
+
+# Distinct tracebacks currently referenced by failures, by key
+_tracebacks = weakref.WeakValueDictionary()
+_tracebacks_lock = threading.Lock()
+
+
+class TracebackRecord(object):
+    """One distinct traceback, kept as its frames (file name, line number, function) and exception lines.
+
+    The source lines are looked up and the text is formatted only when needed. Identical tracebacks share one
+    record, see intern_traceback(), its key identifies it in the reports.
+    """
+
+    def __init__(self, key, frames, exception_lines):
+        self.key = key
+        self.frames = frames
+        self.exception_lines = exception_lines
+        self._text = None
+
+    def format(self):
+        """Returns the text traceback.format_exception() would give, its entries joined with new lines."""
+        if self._text is None:
+            entries = []
+            if self.frames:
+                entries.append('Traceback (most recent call last):\n')
+            for filename, line_number, name in self.frames:
+                linecache.checkcache(filename)
+                entry = '  File "{}", line {}, in {}\n'.format(filename, line_number, name)
+                line = linecache.getline(filename, line_number)
+                if line.strip():
+                    entry += '    {}\n'.format(line.strip())
+                entries.append(entry)
+            entries.extend(self.exception_lines)
+            self._text = '\n'.join(entries)
+        return self._text
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_text'] = None
+        return state
+
+
+def intern_traceback(exc_type, exc_value, tb):
+    """Returns the TracebackRecord of an exception, shared with the failures that have an identical traceback."""
+    frames = []
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((code.co_filename, tb.tb_lineno, code.co_name))
+        tb = tb.tb_next
+    frames = tuple(frames)
+    exception_lines = tuple(traceback.format_exception_only(exc_type, exc_value))
+    key = hashlib.sha1(repr((frames, exception_lines))).hexdigest()[:16]
+    with _tracebacks_lock:
+        record = _tracebacks.get(key)
+        if record is None:
+            record = _tracebacks[key] = TracebackRecord(key, frames, exception_lines)
+    return record
+
+
+class StructuredException(object):
+    """A failure of a test: when it happened and its interned traceback, formatted lazily.
+
+    unicode() of it gives the same text as exception_to_string() of the exception it was created from.
+    """
+
+    def __init__(self, exc_info, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.traceback = intern_traceback(*exc_info)
+
+    @property
+    def key(self):
+        return self.traceback.key
+
+    def timestamp_string(self):
+        return datetime.datetime.fromtimestamp(self.timestamp).isoformat(' ')
+
+    def format(self, timestamped=True):
+        if timestamped:
+            return u'{}\n{}'.format(self.timestamp_string(), self.traceback.format().decode('utf-8', 'replace'))
+        return self.traceback.format().decode('utf-8', 'replace')
+
+    __unicode__ = format
+
+    def __str__(self):
+        return self.format().encode('utf-8')
+
+    def __repr__(self):
+        return '<StructuredException {} at {}>'.format(self.key, self.timestamp_string())
@@ -0,0 +1,160 @@
+import sys
+import time
+import unittest
+import threading
+import collections
+
+
+def fixture_keys(test):
+    """Returns the module name and class whose fixtures a test needs, (None, None) for non TestCase tests."""
+    if not isinstance(test, unittest.TestCase):
+        return None, None
+    return test.__class__.__module__, test.__class__
+
+
+def fixture_names(test):
+    """Returns the module and class name whose fixtures a test needs, (None, None) for non TestCase tests."""
+    module_name, cls = fixture_keys(test)
+    return module_name, cls.__name__ if cls is not None else None
+
+
+def group_tests(tests, shuffle=None, keys=fixture_keys):
+    """Orders tests so the tests of a class and the classes of a module are adjacent.
+
+    Modules and classes keep the order of their first test, tests keep their order within a class. With shuffle
+    given (e.g. random.shuffle) the classes of every module and the tests of every class are shuffled with it.
+    keys returns the module and class of a test, e.g. fixture_names for tests that are not created yet.
+    """
+    modules = collections.OrderedDict()
+    for test in tests:
+        module_name, cls = keys(test)
+        modules.setdefault(module_name, collections.OrderedDict()).setdefault(cls, []).append(test)
+
+    grouped = []
+    for classes in modules.itervalues():
+        class_groups = classes.values()
+        if shuffle is not None:
+            shuffle(class_groups)
+        for class_tests in class_groups:
+            if shuffle is not None:
+                shuffle(class_tests)
+            grouped.extend(class_tests)
+    return grouped
+
+
+def _call_fixture(owner, name):
+    fixture = getattr(owner, name, None)
+    if fixture is None:
+        return None
+    try:
+        fixture()
+    except KeyboardInterrupt:
+        raise
+    except:
+        return sys.exc_info()
+    return None
+
+
+class FixtureManager(object):
+    """Runs setUpModule/setUpClass before the first test of their group and the tear downs after the last one.
+
+    Tests are counted up front, from the tests or from their fixture_names() if they are not created yet, so a
+    fixture is torn down when its last test is released with tear_down(), also when the tests of a group run
+    interleaved or concurrently. A run that stops early releases the fixtures of the tests it did not run with
+    tear_down_all().
+    """
+
+    def __init__(self, tests=(), names=()):
+        # fixture key (module name or (module name, class name)) -> number of tests not released yet
+        self._pending = collections.Counter()
+        # fixture key -> None if set up, exc_info tuple if setting it up failed, in set up order
+        self._set_up = collections.OrderedDict()
+        # class fixture key -> class
+        self._classes = {}
+        self._lock = threading.RLock()
+        for test in tests:
+            self.add(test)
+        for module_name, class_name in names:
+            self.add_names(module_name, class_name)
+
+    def add(self, test):
+        """Counts one more test, for tests that become known while the others run (e.g. distributed workers)."""
+        self.add_names(*fixture_names(test))
+
+    def add_names(self, module_name, class_name):
+        if class_name is not None:
+            with self._lock:
+                self._pending[(module_name, class_name)] += 1
+                self._pending[module_name] += 1
+
+    def set_up(self, test):
+        """Sets up the fixtures of the test's group if needed.
+
+        Returns the time spent and the exc_info of a failed module or class fixture, None if they are fine.
+        """
+        module_name, cls = fixture_keys(test)
+        if cls is None:
+            return 0.0, None
+        key = (module_name, cls.__name__)
+        start_time = time.time()
+        with self._lock:
+            if module_name not in self._set_up:
+                self._set_up[module_name] = _call_fixture(sys.modules.get(module_name), 'setUpModule')
+            if key not in self._set_up:
+                self._classes[key] = cls
+                if self._set_up[module_name] is not None:
+                    self._set_up[key] = self._set_up[module_name]
+                elif getattr(cls, '__unittest_skip__', False):
+                    self._set_up[key] = None
+                else:
+                    self._set_up[key] = _call_fixture(cls, 'setUpClass')
+            error = self._set_up[key]
+        return time.time() - start_time, error
+
+    def tear_down(self, test):
+        """Releases the test, tearing down fixtures it was the last test for.
+
+        Returns the time spent and the exc_info of a failed tear down, None if there was none.
+        """
+        return self.release_names(*fixture_names(test))
+
+    def release_names(self, module_name, class_name):
+        """Releases one count added with add_names(), e.g. a lease held to keep a group set up, see tear_down()."""
+        if class_name is None:
+            return 0.0, None
+        key = (module_name, class_name)
+        start_time = time.time()
+        error = None
+        with self._lock:
+            self._pending[key] -= 1
+            if self._pending[key] == 0 and key in self._set_up:
+                cls = self._classes[key]
+                if self._set_up.pop(key) is None and not getattr(cls, '__unittest_skip__', False):
+                    error = _call_fixture(cls, 'tearDownClass')
+            self._pending[module_name] -= 1
+            if self._pending[module_name] == 0 and module_name in self._set_up:
+                if self._set_up.pop(module_name) is None:
+                    error = _call_fixture(sys.modules.get(module_name), 'tearDownModule') or error
+        return time.time() - start_time, error
+
+    def tear_down_all(self):
+        """Tears down every fixture still set up, in reverse set up order.
+
+        Returns (fixture key, exc_info) of every tear down that failed.
+        """
+        errors = []
+        with self._lock:
+            while self._set_up:
+                key, set_up_error = self._set_up.popitem()
+                self._pending.pop(key, None)
+                if set_up_error is not None:
+                    continue
+                if not isinstance(key, tuple):
+                    error = _call_fixture(sys.modules.get(key), 'tearDownModule')
+                elif getattr(self._classes[key], '__unittest_skip__', False):
+                    continue
+                else:
+                    error = _call_fixture(self._classes[key], 'tearDownClass')
+                if error is not None:
+                    errors.append((u'.'.join(key) if isinstance(key, tuple) else key, error))
+        return errors
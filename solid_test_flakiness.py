@@ -0,0 +1,139 @@
+import math
+import collections
+
+import solid_test_report
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MAX_WIDTH = 0.2
+DEFAULT_MIN_RUNS = 10
+DEFAULT_MAX_RUNS = 100
+# Runs after one preceding test needed before it is compared with the other runs
+MIN_ORDER_SAMPLES = 3
+FAILED_OUTCOMES = ('fail', 'error', 'unexpected_pass', None)
+NOT_RUN_OUTCOMES = ('skip', 'cached')
+
+
+def z_score(confidence):
+    """Returns z of the two-sided normal interval holding confidence, e.g. 1.96 for 0.95."""
+    low, high = 0.0, 10.0
+    for _ in xrange(100):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def wilson_interval(failures, runs, confidence=DEFAULT_CONFIDENCE):
+    """Returns the Wilson score interval (low, high) of a failure rate, (0.0, 1.0) without runs.
+
+    Unlike the normal approximation it stays within [0, 1] and is not empty when all runs passed or failed.
+    """
+    if not runs:
+        return 0.0, 1.0
+    z = z_score(confidence)
+    rate = float(failures) / runs
+    denominator = 1 + z * z / runs
+    centre = (rate + z * z / (2 * runs)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / runs + z * z / (4 * runs * runs)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+class _TestStats(object):
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skips = 0
+        # id of the test that ran right before -> [runs, failures]
+        self.after = collections.defaultdict(lambda: [0, 0])
+
+
+class FlakinessTracker(object):
+    """Counts the failures of repeated tests, in total and by the test that ran right before each run.
+
+    A test has converged once the interval of its failure rate is at most max_width wide after at least min_runs
+    runs, or after max_runs runs. Skipped and cached runs do not count, a test that was only skipped has converged.
+    Reports are added in the order they are submitted, which is the order the tests ran in only in sequential runs.
+    """
+
+    def __init__(self, confidence=DEFAULT_CONFIDENCE, max_width=DEFAULT_MAX_WIDTH, min_runs=DEFAULT_MIN_RUNS,
+                 max_runs=DEFAULT_MAX_RUNS):
+        self.confidence = confidence
+        self.max_width = max_width
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self._tests = collections.OrderedDict()
+        self._previous = None
+
+    def start_round(self):
+        """Forgets the previous test, the first test of a round does not run after the last one of the round before."""
+        self._previous = None
+
+    def add(self, report_dict):
+        test_id = solid_test_report.test_id(report_dict)
+        stats = self._tests.get(test_id)
+        if stats is None:
+            stats = self._tests[test_id] = _TestStats()
+        if report_dict['outcome'] in NOT_RUN_OUTCOMES:
+            stats.skips += 1
+            return
+        failed = report_dict['outcome'] in FAILED_OUTCOMES
+        stats.runs += 1
+        stats.failures += failed
+        if self._previous is not None:
+            after = stats.after[self._previous]
+            after[0] += 1
+            after[1] += failed
+        self._previous = test_id
+
+    def interval(self, test_id):
+        stats = self._tests[test_id]
+        return wilson_interval(stats.failures, stats.runs, self.confidence)
+
+    def converged(self, test_id):
+        stats = self._tests.get(test_id)
+        if stats is None:
+            return False
+        if not stats.runs:
+            return stats.skips > 0
+        if stats.runs >= self.max_runs:
+            return True
+        low, high = self.interval(test_id)
+        return stats.runs >= self.min_runs and high - low <= self.max_width
+
+    def order_dependence(self, test_id):
+        """Returns the preceding tests the failure rate of a test differs significantly after.
+
+        The runs after each preceding test are compared with all other runs, a preceding test is listed if the
+        intervals of the two failure rates do not overlap.
+        """
+        stats = self._tests[test_id]
+        suspects = []
+        for previous, (runs, failures) in sorted(stats.after.iteritems()):
+            other_runs = stats.runs - runs
+            if runs < MIN_ORDER_SAMPLES or other_runs < MIN_ORDER_SAMPLES:
+                continue
+            low, high = wilson_interval(failures, runs, self.confidence)
+            other_low, other_high = wilson_interval(stats.failures - failures, other_runs, self.confidence)
+            if high < other_low or low > other_high:
+                suspects.append(collections.OrderedDict((('after', previous), ('runs', runs),
+                                                         ('failure_rate', float(failures) / runs))))
+        return suspects
+
+    def records(self, order_dependence=False):
+        """Yields a 'flakiness' report record per test, with the order dependence checked if asked to."""
+        for test_id, stats in self._tests.iteritems():
+            low, high = self.interval(test_id)
+            yield collections.OrderedDict((
+                ('record', 'flakiness'),
+                ('test', test_id),
+                ('runs', stats.runs),
+                ('failures', stats.failures),
+                ('skips', stats.skips),
+                ('failure_rate', float(stats.failures) / stats.runs if stats.runs else None),
+                ('interval', [low, high]),
+                ('confidence', self.confidence),
+                ('converged', self.converged(test_id)),
+                ('order_dependent', self.order_dependence(test_id) if order_dependence else None),
+            ))
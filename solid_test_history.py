@@ -0,0 +1,245 @@
+import os
+import json
+import logging
+
+import solid_test_report
+
+log = logging.getLogger()
+
+LONGEST_FIRST = 'longest_first'
+SHORTEST_FIRST = 'shortest_first'
+FAILED_FIRST = 'failed_first'
+ORDERING_STRATEGIES = (LONGEST_FIRST, SHORTEST_FIRST, FAILED_FIRST)
+
+FAILED_OUTCOMES = ('fail', 'error', 'unexpected_pass', None)
+RERUN_OUTCOMES = ('fail', 'error')
+
+LAST_FAILED_ONLY = 'only'
+LAST_FAILED_FIRST = 'first'
+
+# Part of the report index cache signature, indexes cached by other versions are rebuilt
+_INDEX_VERSION = 2
+_INDEXED_FIELDS = ('name', 'class_name', 'suite', 'outcome')
+_INDEXED_FIELD_NEEDLES = tuple((field, '"{}": '.format(field)) for field in _INDEXED_FIELDS)
+
+
+class DurationStore(object):
+    """Durations and outcomes of previous runs, kept on disk as one compact JSON object.
+
+    Every test id ('suite.class_name.name') maps to [duration, runs, failed]: the exponentially weighted moving
+    average of the test's duration, the number of runs it was seen in and 1 if its last outcome was a failure.
+    """
+
+    def __init__(self, path=None, smoothing=0.3):
+        self.path = path
+        self.smoothing = smoothing
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as sf:
+                self._entries = json.load(sf)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, test_id):
+        return test_id in self._entries
+
+    def add_report(self, report_dict):
+        if report_dict['outcome'] == 'cached':
+            return
+        test_id = solid_test_report.test_id(report_dict)
+        failed = int(report_dict['outcome'] in FAILED_OUTCOMES)
+        entry = self._entries.get(test_id)
+        if entry is None:
+            self._entries[test_id] = [report_dict['time'], 1, failed]
+        else:
+            entry[0] += self.smoothing * (report_dict['time'] - entry[0])
+            entry[1] += 1
+            entry[2] = failed
+
+    def load_json_report(self, json_report_path, encoding='utf-8'):
+        """Adds the results of a JSON-lines report, streaming it line by line."""
+        for report_dict in solid_test_report.iter_json_report(json_report_path, encoding=encoding):
+            self.add_report(report_dict)
+
+    def save(self, path=None):
+        path = path or self.path
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as sf:
+            json.dump(self._entries, sf, separators=(',', ':'))
+        os.rename(temp_path, path)
+
+    def duration(self, test_id, default=None):
+        entry = self._entries.get(test_id)
+        return default if entry is None else entry[0]
+
+    def failed(self, test_id):
+        entry = self._entries.get(test_id)
+        return entry is not None and bool(entry[2])
+
+    def typical_duration(self):
+        """Median of the known durations, used for tests without history."""
+        durations = sorted(entry[0] for entry in self._entries.itervalues())
+        if not durations:
+            return 0.0
+        return durations[len(durations) // 2]
+
+    def estimate(self, test_ids):
+        """Returns the estimated total duration of the given tests and how many of them have no history."""
+        default = self.typical_duration()
+        total = 0.0
+        unknown = 0
+        for test_id in test_ids:
+            entry = self._entries.get(test_id)
+            if entry is None:
+                unknown += 1
+                total += default
+            else:
+                total += entry[0]
+        return total, unknown
+
+
+class DurationStoreReporter(solid_test_report.SolidTestReporter):
+    """Records the results of a run into a DurationStore and saves it when the run is over."""
+
+    def __init__(self, duration_store):
+        self.duration_store = duration_store
+
+    def write(self, reports):
+        for report_dict in reports:
+            self.duration_store.add_report(report_dict)
+
+    def close(self):
+        if self.duration_store.path is not None:
+            self.duration_store.save()
+
+
+def _report_test_id(test):
+    return solid_test_report.test_id(solid_test_report.test_identity(test))
+
+
+def order_tests(tests, duration_store, strategy=LONGEST_FIRST, test_id=_report_test_id, group=None):
+    """Returns the tests sorted with one of the ORDERING_STRATEGIES.
+
+    longest_first balances parallel runs, shortest_first gives the fastest feedback and failed_first runs the
+    tests that failed last time first (shortest of them first), keeping the order of the others. Tests without
+    history are assumed to take the typical duration. The sort is stable. test_id returns the report id of a test.
+
+    group (e.g. solid_test_fixtures.group_tests) then keeps the tests of a class together, each class at the place
+    of its first test, so the order only holds from class to class. With failed_first only the other tests are
+    grouped, the failed tests still run first and the classes they belong to stay set up until their other tests.
+    """
+    if strategy not in ORDERING_STRATEGIES:
+        raise ValueError(u'Unknown ordering strategy {!r}, expected one of {}'.format(strategy, ORDERING_STRATEGIES))
+    default = duration_store.typical_duration()
+    test_ids = dict((id(test), test_id(test)) for test in tests)
+
+    def duration(test):
+        return duration_store.duration(test_ids[id(test)], default)
+
+    if strategy == LONGEST_FIRST:
+        ordered = sorted(tests, key=duration, reverse=True)
+    elif strategy == SHORTEST_FIRST:
+        ordered = sorted(tests, key=duration)
+    else:
+        failed = [test for test in tests if duration_store.failed(test_ids[id(test)])]
+        failed.sort(key=duration)
+        failed_ids = set(id(test) for test in failed)
+        others = [test for test in tests if id(test) not in failed_ids]
+        return failed + (group(others) if group is not None else others)
+    return group(ordered) if group is not None else ordered
+
+
+class ReportIndex(object):
+    """Outcomes of the tests of a JSON-lines report, indexed by test id.
+
+    The index is built in one pass that only looks up the identity and outcome fields of each line instead of
+    decoding it completely. It is cached next to the report (report path + '.idx') together with the report's
+    size and modification time, so it is rebuilt only when the report changes. A test that ran several times is
+    indexed with its last failing outcome, or its last outcome if it never failed.
+    """
+
+    def __init__(self, json_report_path, encoding='utf-8', use_cache=True):
+        self.json_report_path = json_report_path
+        self.encoding = encoding
+        self.index_path = json_report_path + '.idx'
+        self._outcomes = None
+        stat = os.stat(json_report_path)
+        self._signature = [_INDEX_VERSION, stat.st_size, stat.st_mtime]
+        if use_cache:
+            self._load_cache()
+        if self._outcomes is None:
+            self._build()
+            if use_cache:
+                self._save_cache()
+
+    def __len__(self):
+        return len(self._outcomes)
+
+    def __contains__(self, test_id):
+        return test_id in self._outcomes
+
+    def outcome(self, test_id, default=None):
+        return self._outcomes.get(test_id, default)
+
+    def failed(self, test_id, outcomes=RERUN_OUTCOMES):
+        return self._outcomes.get(test_id) in outcomes
+
+    def failed_ids(self, outcomes=RERUN_OUTCOMES):
+        return set(test_id for test_id, outcome in self._outcomes.iteritems() if outcome in outcomes)
+
+    def _load_cache(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'rb') as xf:
+                cached = json.load(xf)
+        except ValueError:
+            log.warn(u'Ignoring corrupted report index {}'.format(self.index_path))
+            return
+        if cached.get('signature') == self._signature:
+            self._outcomes = cached['outcomes']
+
+    def _save_cache(self):
+        try:
+            with open(self.index_path, 'wb') as xf:
+                json.dump({'signature': self._signature, 'outcomes': self._outcomes}, xf, separators=(',', ':'))
+        except (IOError, OSError):
+            log.warn(u'Could not write report index {}'.format(self.index_path))
+
+    def _build(self):
+        outcomes = {}
+        with open(self.json_report_path, 'rb') as jf:
+            for line in jf:
+                if not line.strip() or solid_test_report.is_record_line(line):
+                    continue
+                fields = self._parse_line(line)
+                test_id = solid_test_report.test_id(fields)
+                # None is a failed outcome too, so unseen tests are checked for explicitly
+                if (test_id not in outcomes or outcomes[test_id] not in FAILED_OUTCOMES
+                        or fields['outcome'] in FAILED_OUTCOMES):
+                    outcomes[test_id] = fields['outcome']
+        self._outcomes = outcomes
+
+    def _parse_line(self, line):
+        fields = {}
+        for field, needle in _INDEXED_FIELD_NEEDLES:
+            position = line.find(needle)
+            # An unescaped quote can not occur inside a JSON string, so a key preceded by '{' or ', ' is always a
+            # top level key of the line
+            while position != -1 and line[max(0, position - 2):position] not in ('{', ', '):
+                position = line.find(needle, position + 1)
+            if position == -1:
+                break
+            position += len(needle)
+            if line.startswith('"', position):
+                fields[field] = json.decoder.scanstring(line, position + 1, self.encoding)[0]
+            elif line.startswith('null', position):
+                fields[field] = None
+            else:
+                break
+        else:
+            return fields
+        # unusual formatting, fall back to decoding the whole line
+        report_dict = json.loads(line.decode(self.encoding))
+        return dict((key, report_dict[key]) for key in _INDEXED_FIELDS)
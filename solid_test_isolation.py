@@ -0,0 +1,224 @@
+import os
+import sys
+import signal
+import logging
+import importlib
+import traceback
+import multiprocessing
+
+import solid_test_fixtures
+
+log = logging.getLogger()
+
+# Tests of a group share one child process
+GROUP_BY_TEST = 'test'
+GROUP_BY_CLASS = 'class'
+GROUP_BY_MODULE = 'module'
+SERVER_STOP_TIMEOUT = 5
+
+_signal_names = dict((getattr(signal, name), name) for name in dir(signal)
+                     if name.startswith('SIG') and not name.startswith('SIG_'))
+
+
+def group_key(test, position, group_by):
+    """Returns the key of the isolation group of a test, consecutive tests with the same key share a child."""
+    module_name, cls = solid_test_fixtures.fixture_keys(test)
+    if group_by == GROUP_BY_CLASS and cls is not None:
+        return cls
+    if group_by == GROUP_BY_MODULE and module_name is not None:
+        return module_name
+    return position
+
+
+def describe_exit_status(pid, status):
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        return u'Test process {} was killed by signal {} ({})'.format(pid, signum, _signal_names.get(signum, '?'))
+    return u'Test process {} exited with code {} without a result'.format(pid, os.WEXITSTATUS(status))
+
+
+class ForkServer(object):
+    """A process forked from the suite before the run starts, forking a copy-on-write child per group of tests.
+
+    The server is a copy of the suite with its tests loaded and the preload modules imported, so a child starts
+    without interpreter or import startup and every group starts from the same state, whatever earlier groups
+    changed. A child runs the fixtures and the tests of its group, one at a time as the parent asks for them, see
+    run(). A child that dies is reported and replaced by a fresh one for the rest of its group.
+    """
+
+    def __init__(self, suite, tests, preload=()):
+        self.suite = suite
+        self.tests = tests
+        self.preload = preload
+        self._connection = None
+        self._process = None
+
+    def start(self):
+        self._connection, server_end = multiprocessing.Pipe()
+        # not daemonic, the children it forks inherit the flag and daemonic processes can not start processes, e.g.
+        # for subprocess timeouts; close() stops it
+        self._process = multiprocessing.Process(target=_server_main,
+                                                args=(self.suite, self.tests, self.preload, server_end))
+        self._process.start()
+        server_end.close()
+        return self
+
+    def start_group(self, positions):
+        """Starts a group with the tests at the given positions of the schedule, ending the previous one."""
+        self._connection.send(('start_group', positions))
+
+    def run(self, position, result, skip_reason, capture):
+        """Runs the test at position in the child of the current group.
+
+        result is the test's SolidTestResult, skip_reason is passed on like in _run_test_case() and capture tells
+        which outputs the child captures ('stdout', 'stderr', 'logger' and 'combined' for stdout with stderr).
+        Returns ('result', (result, outputs, fixture_time)), ('exception', traceback text) or ('crashed',
+        description).
+        """
+        self._connection.send(('run', position, result, skip_reason, capture))
+        try:
+            return self._connection.recv()
+        except EOFError:
+            return 'crashed', u'Fork server {} terminated unexpectedly (exit code {})'.format(
+                self._process.pid, self._process.exitcode)
+
+    def end_group(self):
+        self._connection.send(('end_group',))
+
+    def close(self):
+        try:
+            self._connection.send(('stop',))
+        except IOError:
+            pass
+        self._process.join(SERVER_STOP_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._connection.close()
+
+
+class _Child(object):
+    def __init__(self, pid, connection):
+        self.pid = pid
+        self.connection = connection
+
+    def wait(self):
+        _, status = os.waitpid(self.pid, 0)
+        return describe_exit_status(self.pid, status)
+
+    def end(self):
+        try:
+            self.connection.send(('exit',))
+        except IOError:
+            pass
+        os.waitpid(self.pid, 0)
+        self.connection.close()
+
+
+def _server_main(suite, tests, preload, connection):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for module_name in preload:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            log.exception(u'Could not preload {}, will ignore:'.format(module_name))
+
+    state = {'child': None}
+
+    def terminate(signum, frame):
+        if state['child'] is not None:
+            os.kill(state['child'].pid, signal.SIGKILL)
+        os._exit(1)
+    signal.signal(signal.SIGTERM, terminate)
+
+    group = []
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        kind = message[0]
+        if kind in ('start_group', 'end_group', 'stop') and state['child'] is not None:
+            state['child'].end()
+            state['child'] = None
+        if kind == 'start_group':
+            group = message[1]
+        elif kind == 'run':
+            if state['child'] is None:
+                state['child'] = _fork_child(suite, tests, group[group.index(message[1]):], connection)
+            child = state['child']
+            try:
+                child.connection.send(message)
+                reply = child.connection.recv()
+            except (EOFError, IOError):
+                reply = ('crashed', child.wait())
+                child.connection.close()
+                state['child'] = None
+            connection.send(reply)
+        elif kind == 'stop':
+            break
+
+
+def _fork_child(suite, tests, positions, server_connection):
+    server_end, child_end = multiprocessing.Pipe()
+    pid = os.fork()
+    if pid == 0:
+        server_connection.close()
+        server_end.close()
+        _child_main(suite, tests, positions, child_end)
+    child_end.close()
+    return _Child(pid, server_end)
+
+
+def _child_main(suite, tests, positions, connection):
+    # leaves with os._exit(), the interpreter's cleanup (atexit, buffered files) belongs to the parent
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        group = dict((position, tests.test_at(position)) for position in positions)
+        suite.fixture_manager = solid_test_fixtures.FixtureManager(group.values())
+        while True:
+            message = connection.recv()
+            if message[0] == 'exit':
+                break
+            _, position, result, skip_reason, capture = message
+            connection.send(_run_in_child(suite, group.pop(position), result, skip_reason, capture))
+        # tests of the group that were not run, e.g. after the run was stopped, release their fixtures
+        suite._tear_down_remaining_fixtures()
+    except (EOFError, IOError):
+        pass
+    except:
+        log.exception(u'Test process {} crashed:'.format(os.getpid()))
+        exit_code = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(exit_code)
+
+
+def _run_in_child(suite, test, result, skip_reason, capture):
+    try:
+        # before the capture starts, so the output of setUpModule/setUpClass is not part of the test's
+        fixture_set_up = suite.fixture_manager.set_up(test)
+        if capture.get('stdout'):
+            suite.start_stdout_capture(combine_with_stderr=capture.get('combined', False))
+        if capture.get('stderr'):
+            suite.start_stderr_capture()
+        if capture.get('logger'):
+            suite.start_root_logger_capture()
+        try:
+            fixture_time = suite._run_fixtures_and_test(test, result, skip_reason, fixture_set_up)
+        finally:
+            outputs = {}
+            if capture.get('logger'):
+                outputs['logger'] = suite.stop_root_logger_capture()
+            if capture.get('stderr'):
+                outputs['stderr'] = suite.stop_stderr_capture()
+            if capture.get('stdout'):
+                outputs['stdout'] = suite.stop_stdout_capture()
+        return 'result', (result, outputs, fixture_time)
+    except:
+        return 'exception', u''.join(traceback.format_exception(*sys.exc_info()))
@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+import socket
+import bisect
+import logging
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+log = logging.getLogger()
+
+DEFAULT_WINDOW = 1000
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RunMetrics(object):
+    """Live counters of a test run, fed by SolidTestSuite when metrics are enabled.
+
+    Recording a test is a few dictionary and deque operations under a lock, everything else (rates, ETA, the
+    histogram buckets) is computed when the metrics are read. Rates and the duration histogram cover the last
+    window finished tests, so they follow changes in the speed of the run.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # (finish time, duration, bucket index) of the last window tests
+        self._recent = collections.deque(maxlen=window)
+        self._bucket_counts = [0] * (len(self.buckets) + 1)
+        self._recent_time = 0.0
+        self.start_run(0)
+
+    def start_run(self, total):
+        with self._lock:
+            self.total = total
+            self.start_time = time.time()
+            self.outcomes = {}
+            self.finished = 0
+            self.running = {}
+            self._recent.clear()
+            self._bucket_counts = [0] * (len(self.buckets) + 1)
+            self._recent_time = 0.0
+
+    def test_started(self, key, test_id, start_time=None):
+        """Marks a test as running, key tells apart the tests running at the same time."""
+        with self._lock:
+            self.running[key] = (test_id, time.time() if start_time is None else start_time)
+
+    def test_finished(self, key, outcome, duration):
+        bucket = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            self.running.pop(key, None)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.finished += 1
+            if len(self._recent) == self._recent.maxlen:
+                _, old_duration, old_bucket = self._recent[0]
+                self._bucket_counts[old_bucket] -= 1
+                self._recent_time -= old_duration
+            self._recent.append((time.time(), duration, bucket))
+            self._bucket_counts[bucket] += 1
+            self._recent_time += duration
+
+    def test_stopped(self, key):
+        """Forgets a running test that will not finish, e.g. because its worker died."""
+        with self._lock:
+            self.running.pop(key, None)
+
+    def snapshot(self):
+        """Returns the current metrics as a dictionary, see format_prometheus() and format_progress()."""
+        now = time.time()
+        with self._lock:
+            elapsed = now - self.start_time
+            if len(self._recent) > 1 and now > self._recent[0][0]:
+                # the first finish time in the window marks its start, it is not counted
+                rate = (len(self._recent) - 1) / (now - self._recent[0][0])
+            else:
+                rate = self.finished / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, self.total - self.finished)
+            return {
+                'total': self.total,
+                'finished': self.finished,
+                'outcomes': dict(self.outcomes),
+                'elapsed': elapsed,
+                'tests_per_second': rate,
+                'eta': remaining / rate if rate > 0 else None,
+                'running': sorted((test_id, now - start_time) for test_id, start_time in self.running.values()),
+                'buckets': zip(self.buckets + (float('inf'),), self._cumulative_bucket_counts()),
+                'recent_count': len(self._recent),
+                'recent_time': self._recent_time,
+            }
+
+    def _cumulative_bucket_counts(self):
+        counts = []
+        total = 0
+        for count in self._bucket_counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+def _label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _bound(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def format_prometheus(snapshot):
+    """Formats a RunMetrics snapshot in the Prometheus text exposition format."""
+    lines = [
+        '# HELP solid_test_cases Test cases scheduled in the run.',
+        '# TYPE solid_test_cases gauge',
+        'solid_test_cases {}'.format(snapshot['total']),
+        '# HELP solid_test_cases_finished_total Test cases finished, by outcome.',
+        '# TYPE solid_test_cases_finished_total counter',
+    ]
+    for outcome, count in sorted(snapshot['outcomes'].iteritems()):
+        lines.append(u'solid_test_cases_finished_total{{outcome="{}"}} {}'.format(_label_value(outcome), count))
+    lines.extend([
+        '# HELP solid_test_run_elapsed_seconds Seconds since the run started.',
+        '# TYPE solid_test_run_elapsed_seconds gauge',
+        'solid_test_run_elapsed_seconds {!r}'.format(snapshot['elapsed']),
+        '# HELP solid_test_tests_per_second Test cases finished per second, over the recent tests.',
+        '# TYPE solid_test_tests_per_second gauge',
+        'solid_test_tests_per_second {!r}'.format(snapshot['tests_per_second']),
+        '# HELP solid_test_eta_seconds Estimated seconds until the run finishes.',
+        '# TYPE solid_test_eta_seconds gauge',
+        'solid_test_eta_seconds {}'.format('NaN' if snapshot['eta'] is None else repr(snapshot['eta'])),
+        '# HELP solid_test_recent_case_duration_seconds Durations of the recent test cases, over a rolling window of '
+        'tests, so the counts can go down.',
+        '# TYPE solid_test_recent_case_duration_seconds histogram',
+    ])
+    for bound, count in snapshot['buckets']:
+        lines.append('solid_test_recent_case_duration_seconds_bucket{{le="{}"}} {}'.format(_bound(bound), count))
+    lines.extend([
+        'solid_test_recent_case_duration_seconds_sum {!r}'.format(snapshot['recent_time']),
+        'solid_test_recent_case_duration_seconds_count {}'.format(snapshot['recent_count']),
+        '# HELP solid_test_running_test_elapsed_seconds Seconds the currently running test cases have been running.',
+        '# TYPE solid_test_running_test_elapsed_seconds gauge',
+    ])
+    for test_id, elapsed in snapshot['running']:
+        lines.append(u'solid_test_running_test_elapsed_seconds{{test="{}"}} {!r}'.format(_label_value(test_id),
+                                                                                         elapsed))
+    return u'\n'.join(lines) + u'\n'
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return u'?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return u'{}h{:02d}m{:02d}s'.format(hours, minutes, seconds)
+    if minutes:
+        return u'{}m{:02d}s'.format(minutes, seconds)
+    return u'{}s'.format(seconds)
+
+
+def format_progress(snapshot):
+    """Formats a RunMetrics snapshot as a one line progress summary."""
+    total = snapshot['total']
+    percent = 100.0 * snapshot['finished'] / total if total else 0.0
+    outcomes = u', '.join(u'{} {}'.format(count, outcome) for outcome, count in sorted(snapshot['outcomes'].items()))
+    line = u'Progress: {}/{} ({:.1f}%), {:.1f} tests/s, ETA {}'.format(
+        snapshot['finished'], total, percent, snapshot['tests_per_second'], _format_seconds(snapshot['eta']))
+    if outcomes:
+        line += u' [{}]'.format(outcomes)
+    if snapshot['running']:
+        test_id, elapsed = max(snapshot['running'], key=lambda running: running[1])
+        line += u', running {} for {:.1f}s'.format(test_id, elapsed)
+        if len(snapshot['running']) > 1:
+            line += u' (+{} more)'.format(len(snapshot['running']) - 1)
+    return line
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = format_prometheus(self.server.metrics.snapshot()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+
+
+def parse_address(address):
+    """Returns (host, port) for 'host:port', ':port' or a port number, other strings are Unix socket paths."""
+    if isinstance(address, (int, long)):
+        return '127.0.0.1', address
+    if isinstance(address, tuple):
+        return address
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return host or '127.0.0.1', int(port)
+    return address
+
+
+class MetricsServer(object):
+    """Serves RunMetrics in the Prometheus text format over HTTP, on a TCP address or a Unix socket.
+
+    Any GET path but '/' and '/metrics' gets a 404. Requests are handled in daemon threads, the tests never wait
+    on them. With port 0 a free port is picked, see address.
+    """
+
+    def __init__(self, metrics, address):
+        self.metrics = metrics
+        address = parse_address(address)
+        if isinstance(address, tuple):
+            self._server = _HTTPServer(address, _MetricsRequestHandler)
+        else:
+            self._server = _UnixHTTPServer(address, _MetricsRequestHandler)
+        self._server.metrics = metrics
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='solid-test-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        if self._server.address_family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class ProgressLogger(object):
+    """Writes format_progress() of the metrics every interval seconds from a daemon thread.
+
+    The lines go to the process' original stderr by default, not to the root logger, so they never end up in the
+    captured output of the running test.
+    """
+
+    def __init__(self, metrics, interval, stream=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._main, name='solid-test-progress')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _main(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stream = self.stream or sys.__stderr__
+                stream.write((format_progress(self.metrics.snapshot()) + u'\n').encode('utf-8'))
+                stream.flush()
+            except:
+                log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(self))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,115 @@
+import time
+import functools
+import threading
+
+
+class _Measurement(object):
+    """Adds the time spent in its block, without the time of measurements nested in it, to its category."""
+
+    def __init__(self, totals, category, active):
+        self.totals = totals
+        self.category = category
+        # stack of the measurements of the current thread
+        self.active = active
+        self.start_time = None
+        self.nested_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.time() - self.start_time
+        self.active.pop()
+        if self.active:
+            self.active[-1].nested_time += elapsed
+        self.totals[self.category] = self.totals.get(self.category, 0.0) + elapsed - self.nested_time
+        return False
+
+
+class _NoMeasurement(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_no_measurement = _NoMeasurement()
+
+
+class OverheadTimer(object):
+    """Accumulates the seconds spent in framework code, by category.
+
+    Categories are the names of the hook functions (pre_test_*, post_test_*, ...), 'capture_start',
+    'capture_stop', 'exception_capture', 'report_submit' and 'report_write.<reporter class>'. Measurements of
+    the current test (see start_test() and finish_test()) end up in its report, the others only in the run totals.
+    Time spent in a nested measurement, e.g. a capture started by a hook, counts for the nested category only, so
+    the categories add up to the total overhead. Does nothing until enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.test_totals = {}
+        self.run_totals = {}
+        self._local = threading.local()
+
+    def _active(self):
+        if not hasattr(self._local, 'active'):
+            self._local.active = []
+        return self._local.active
+
+    def measure(self, category):
+        """Context manager adding the time spent in its block to the current test."""
+        if not self.enabled:
+            return _no_measurement
+        return _Measurement(self.test_totals, category, self._active())
+
+    def measure_run(self, category):
+        """Context manager adding the time spent in its block to the run totals only."""
+        if not self.enabled:
+            return _no_measurement
+        return _Measurement(self.run_totals, category, self._active())
+
+    def add(self, category, seconds):
+        if self.enabled and seconds:
+            self.test_totals[category] = self.test_totals.get(category, 0.0) + seconds
+
+    def add_to_run(self, totals):
+        if self.enabled:
+            for category, seconds in totals.iteritems():
+                self.run_totals[category] = self.run_totals.get(category, 0.0) + seconds
+
+    def start_run(self):
+        self.test_totals = {}
+        self.run_totals = {}
+
+    def start_test(self):
+        self.test_totals = {}
+
+    def finish_test(self):
+        """Returns the measurements of the current test and starts collecting for the next one."""
+        totals, self.test_totals = self.test_totals, {}
+        return totals
+
+
+def measured(category):
+    """Decorator measuring the time spent in a SolidTestSuite method as overhead of the current test."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.overhead.measure(category):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def format_overhead(run_totals, run_time):
+    """Returns a log friendly table of the run totals, biggest first."""
+    total = sum(run_totals.itervalues())
+    lines = [u'Framework overhead: {:.3f}s of {:.3f}s run time ({:.1f}%)'.format(
+        total, run_time, 100.0 * total / run_time if run_time else 0.0)]
+    for category, seconds in sorted(run_totals.iteritems(), key=lambda c: c[1], reverse=True):
+        lines.append(u'{:12.6f}s  {}'.format(seconds, category))
+    return u'\n'.join(lines)
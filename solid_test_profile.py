@@ -0,0 +1,144 @@
+import os
+import re
+import sys
+import json
+import heapq
+import pstats
+import cProfile
+import logging
+
+import solid_test_report
+
+log = logging.getLogger()
+
+DEFAULT_TOP = 50
+DEFAULT_CONTRIBUTORS = 5
+
+
+class TestProfiler(object):
+    """Runs test calls under cProfile and saves one profile file per test in output_dir."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._count = 0
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    def profile_path(self, test_id):
+        self._count += 1
+        safe_id = re.sub(r'[^\w.-]+', '_', test_id)
+        # the process id keeps the names of profiles saved by parallel workers apart
+        return os.path.join(self.output_dir, u'{}_{}_{:06d}.prof'.format(safe_id, os.getpid(), self._count))
+
+    def call(self, test_id, func, *args):
+        """Calls func(*args) under the profiler, returns the path its profile was saved to."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(func, *args)
+        finally:
+            path = self.profile_path(test_id)
+            profiler.dump_stats(path)
+        return path
+
+
+class HotspotAggregator(object):
+    """Merges per-test profiles into run-wide totals per function, remembering the tests that contributed most.
+
+    Profiles are added one at a time, so memory depends on the number of distinct functions, not on the number of
+    tests.
+    """
+
+    def __init__(self, contributors=DEFAULT_CONTRIBUTORS):
+        self.contributors = contributors
+        self.tests_profiled = 0
+        # function -> [calls, total time, cumulative time, heap of (cumulative time, test id)]
+        self._functions = {}
+
+    def add_profile(self, test_id, profile_path):
+        stats = pstats.Stats(profile_path).stats
+        self.tests_profiled += 1
+        for function, (_, calls, total_time, cumulative_time, _) in stats.iteritems():
+            name = pstats.func_std_string(function)
+            entry = self._functions.get(name)
+            if entry is None:
+                entry = self._functions[name] = [0, 0.0, 0.0, []]
+            entry[0] += calls
+            entry[1] += total_time
+            entry[2] += cumulative_time
+            if len(entry[3]) < self.contributors:
+                heapq.heappush(entry[3], (cumulative_time, test_id))
+            elif cumulative_time > entry[3][0][0]:
+                heapq.heapreplace(entry[3], (cumulative_time, test_id))
+
+    def hotspots(self, top=DEFAULT_TOP):
+        """Returns the top functions by cumulative time across all tests."""
+        names = heapq.nlargest(top, self._functions, key=lambda n: self._functions[n][2])
+        return [{'function': name,
+                 'calls': self._functions[name][0],
+                 'tottime': self._functions[name][1],
+                 'cumtime': self._functions[name][2],
+                 'tests': [[test_id, cumulative_time]
+                           for cumulative_time, test_id in sorted(self._functions[name][3], reverse=True)]}
+                for name in names]
+
+    def write(self, json_path, text_path=None, top=DEFAULT_TOP):
+        hotspots = self.hotspots(top)
+        with open(json_path, 'wb') as hf:
+            json.dump({'tests_profiled': self.tests_profiled, 'functions': hotspots}, hf, indent=1)
+        if text_path is not None:
+            with open(text_path, 'wb') as tf:
+                tf.write(format_hotspots(hotspots, self.tests_profiled).encode('utf-8'))
+
+
+def format_hotspots(hotspots, tests_profiled):
+    lines = [u'Top {} functions by cumulative time across {} tests'.format(len(hotspots), tests_profiled), u'',
+             u'{:>12} {:>12} {:>10}  {}'.format(u'cumtime', u'tottime', u'calls', u'function')]
+    for hotspot in hotspots:
+        lines.append(u'{cumtime:12.6f} {tottime:12.6f} {calls:10d}  {function}'.format(**hotspot))
+        for test_id, cumulative_time in hotspot['tests']:
+            lines.append(u'{:12.6f} {:>12} {:>10}    {}'.format(cumulative_time, u'', u'', test_id))
+    return u'\n'.join(lines) + u'\n'
+
+
+class HotspotReporter(solid_test_report.SolidTestReporter):
+    """Aggregates the profiles of a run (the 'profile' report field) and writes the hotspot report when it ends.
+
+    The hotspots are written as JSON to hotspots_path and as text next to it (.txt instead of .json).
+    """
+
+    def __init__(self, hotspots_path, top=DEFAULT_TOP, contributors=DEFAULT_CONTRIBUTORS):
+        self.hotspots_path = hotspots_path
+        self.top = top
+        self.aggregator = HotspotAggregator(contributors)
+
+    def write(self, reports):
+        for report_dict in reports:
+            if report_dict.get('profile'):
+                self.aggregator.add_profile(solid_test_report.test_id(report_dict), report_dict['profile'])
+
+    def close(self):
+        if self.aggregator.tests_profiled:
+            self.aggregator.write(self.hotspots_path, os.path.splitext(self.hotspots_path)[0] + '.txt', self.top)
+
+
+def compare_hotspot_reports(old_hotspots_path, new_hotspots_path, top=20):
+    """Compares two hotspot reports, returns the top functions by cumulative time change.
+
+    Every entry is (function, old cumtime, new cumtime), functions missing from a report count as 0.
+    """
+    with open(old_hotspots_path, 'rb') as of:
+        old = dict((h['function'], h['cumtime']) for h in json.load(of)['functions'])
+    with open(new_hotspots_path, 'rb') as nf:
+        new = dict((h['function'], h['cumtime']) for h in json.load(nf)['functions'])
+    functions = set(old) | set(new)
+    changes = [(f, old.get(f, 0.0), new.get(f, 0.0)) for f in functions]
+    changes.sort(key=lambda c: abs(c[2] - c[1]), reverse=True)
+    return changes[:top]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(u'usage: {} OLD_HOTSPOTS_JSON NEW_HOTSPOTS_JSON'.format(sys.argv[0]))
+    print(u'{:>12} {:>12} {:>12}  {}'.format(u'old', u'new', u'change', u'function'))
+    for function, old_time, new_time in compare_hotspot_reports(sys.argv[1], sys.argv[2]):
+        print(u'{:12.6f} {:12.6f} {:+12.6f}  {}'.format(old_time, new_time, new_time - old_time, function))
@@ -1,18 +1,307 @@
+import io
+import sys
 import json
 import codecs
+import shutil
+import tempfile
+import collections
+import time
+import atexit
+import logging
+import threading
+import Queue
 
-from xml.etree.ElementTree import ElementTree, Element, tostring
+from xml.etree.ElementTree import ElementTree, Element, iterparse
+
+import solid_test_capture
+import solid_test_exceptions
+import solid_test_resources
+
+log = logging.getLogger()
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_FLUSH_SIZE = 100
+
+_STOP = object()
+# pipelines started and not closed yet, closed at exit so a crashing run does not lose reports
+_open_pipelines = set()
+
+# Lines of a JSON report that are not test case reports start with this, e.g. the exception records
+RECORD_LINE_PREFIX = '{"record": '
+
+
+def test_identity(test):
+    """Returns the 'name', 'class_name' and 'suite' fields identifying a test in the reports."""
+    return {
+        'name': test.get_name() or test.id().split('.')[-1],
+        'class_name': test.get_class() or test.id().split('.')[-2],
+        'suite': test.get_module() or test.id().split('.')[-3],
+    }
+
+
+def test_id(report_dict):
+    """Returns the 'suite.class_name.name' id of a test case report (or of a test_identity dict)."""
+    return u'.'.join((report_dict['suite'], report_dict['class_name'], report_dict['name']))
+
+
+def json_default(value):
+    if isinstance(value, solid_test_exceptions.StructuredException):
+        return value.format()
+    raise TypeError(u'{!r} is not JSON serializable'.format(value))
+
+
+def json_report_line(report_dict, encoding='utf-8'):
+    return json.dumps(report_dict, skipkeys=False, ensure_ascii=False, check_circular=True, encoding=encoding,
+                      sort_keys=False, default=json_default) + '\n'
+
+
+def is_record_line(line):
+    return line.startswith(RECORD_LINE_PREFIX)
+
+
+def exception_record(structured_exception):
+    """Returns the report line storing the traceback referenced by the exc_refs of test case reports."""
+    return collections.OrderedDict((('record', 'exception'), ('id', structured_exception.key),
+                                    ('traceback', structured_exception.format(timestamped=False))))
+
+
+def expand_exception_refs(report_dict, tracebacks):
+    """Turns the exc_refs of a test case report back into formatted exceptions in its exc field.
+
+    tracebacks maps the ids of the exception records read so far to their tracebacks.
+    """
+    refs = report_dict.pop('exc_refs', None)
+    if refs:
+        report_dict['exc'] = report_dict.get('exc', []) + [
+            u'{}\n{}'.format(timestamp, tracebacks.get(ref, u'<missing exception record {}>'.format(ref)))
+            for ref, timestamp in refs]
+    return report_dict
+
+
+def write_json_report_line(output_file, report_dict, encoding='utf-8'):
+    """Writes report_dict as a JSON line, same as json_report_line, streaming captured output into output_file."""
+    if not any(isinstance(v, solid_test_capture.CaptureBuffer) for v in report_dict.itervalues()):
+        output_file.write(json_report_line(report_dict, encoding))
+        return
+    output_file.write(u'{')
+    for i, (key, value) in enumerate(report_dict.iteritems()):
+        if i:
+            output_file.write(u', ')
+        output_file.write(json.dumps(key, ensure_ascii=False, encoding=encoding) + u': ')
+        if isinstance(value, solid_test_capture.CaptureBuffer):
+            output_file.write(u'"')
+            for chunk in value.iter_chunks():
+                output_file.write(json.dumps(chunk, ensure_ascii=False, encoding=encoding)[1:-1])
+            output_file.write(u'"')
+        else:
+            output_file.write(json.dumps(value, skipkeys=False, ensure_ascii=False, check_circular=True,
+                                         encoding=encoding, sort_keys=False, default=json_default))
+    output_file.write(u'}\n')
+
+
+def materialize_report(report_dict):
+    """Returns a copy of report_dict with captured output turned into text, e.g. to send it to another process."""
+    return dict((k, solid_test_capture.materialize(v)) for k, v in report_dict.iteritems())
+
+
+def close_captured_output(report_dict):
+    """Closes the CaptureBuffers of a report once it was written, releasing their spilled temporary files."""
+    for value in report_dict.itervalues():
+        if isinstance(value, solid_test_capture.CaptureBuffer):
+            value.close()
 
 
 def append_to_a_json_report(file_path, report_dict, encoding='utf-8'):
     with codecs.open(file_path, 'ab+', encoding=encoding) as jf:
-        jf.write(json.dumps(report_dict, skipkeys=False, ensure_ascii=False, check_circular=True, encoding=encoding,
-                            sort_keys=False) + '\n')
+        write_json_report_line(jf, report_dict, encoding)
+
+
+class SolidTestReporter(object):
+    """Base class of the reporters plugged into a ReportPipeline.
+
+    All methods are called from the pipeline's background thread.
+    """
+
+    def open(self):
+        pass
+
+    def write(self, reports):
+        raise NotImplementedError
+
+    def write_records(self, records):
+        """Called with the records submitted with ReportPipeline.submit_record(), reporters may ignore them."""
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonReporter(SolidTestReporter):
+    """Appends test case reports to a JSON-lines file, keeping the file open for the whole run.
+
+    Every distinct traceback is written once as an exception record line, test case reports reference it in
+    their exc_refs field as [record id, timestamp]. iter_json_report() expands them back into exc.
+    """
+
+    def __init__(self, file_path, encoding='utf-8'):
+        self.file_path = file_path
+        self.encoding = encoding
+        self._file = None
+        self._written_records = set()
+
+    def open(self):
+        self._file = codecs.open(self.file_path, 'ab+', encoding=self.encoding)
+        self._written_records = set()
+
+    def write(self, reports):
+        for report_dict in reports:
+            write_json_report_line(self._file, self._reference_exceptions(report_dict), self.encoding)
+
+    def write_records(self, records):
+        for record in records:
+            self._file.write(json_report_line(record, self.encoding))
+
+    def _reference_exceptions(self, report_dict):
+        exceptions = report_dict.get('exc')
+        if not exceptions or not any(isinstance(e, solid_test_exceptions.StructuredException) for e in exceptions):
+            return report_dict
+        report_dict = dict(report_dict)
+        report_dict['exc'] = []
+        report_dict['exc_refs'] = []
+        for exception in exceptions:
+            if not isinstance(exception, solid_test_exceptions.StructuredException):
+                report_dict['exc'].append(exception)
+                continue
+            if exception.key not in self._written_records:
+                self._file.write(json_report_line(exception_record(exception), self.encoding))
+                self._written_records.add(exception.key)
+            report_dict['exc_refs'].append([exception.key, exception.timestamp_string()])
+        return report_dict
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ReportPipeline(object):
+    """Takes test case reports off a queue on a background thread and hands them to the reporters in batches.
+
+    A batch is written once flush_size reports were collected or flush_interval seconds passed since the last
+    write, whichever comes first. close() writes everything that is still queued, pipelines that are not closed
+    are closed at exit so a crashing run does not lose reports.
+    """
+
+    def __init__(self, reporters=(), flush_interval=DEFAULT_FLUSH_INTERVAL, flush_size=DEFAULT_FLUSH_SIZE):
+        self.reporters = list(reporters)
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._opened = threading.Event()
+        # seconds spent in every reporter class
+        self.reporter_times = {}
+
+    def add_reporter(self, reporter):
+        if self._thread is not None:
+            raise RuntimeError(u'Reporters have to be added before the pipeline is started')
+        self.reporters.append(reporter)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._process_queue, name='solid-test-report-pipeline')
+        self._thread.daemon = True
+        self._thread.start()
+        self._opened.wait()
+        _open_pipelines.add(self)
+        return self
+
+    def submit(self, report_dict):
+        self._queue.put(report_dict)
+
+    def submit_record(self, record):
+        """Queues a record, a dict whose first key is 'record' naming its kind, e.g. a run summary.
+
+        Records are handed to the reporters' write_records() after the reports submitted before them.
+        """
+        self._queue.put(_Record(record))
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        _open_pipelines.discard(self)
+
+    def _call_reporters(self, method_name, *args):
+        for reporter in self.reporters:
+            start_time = time.time()
+            try:
+                getattr(reporter, method_name)(*args)
+            except:
+                log.exception(u'Reporter {} failed in {}, will ignore:'.format(reporter, method_name))
+            name = reporter.__class__.__name__
+            self.reporter_times[name] = self.reporter_times.get(name, 0.0) + time.time() - start_time
+
+    def _write_batch(self, batch):
+        if batch:
+            self._call_reporters('write', batch)
+            self._call_reporters('flush')
+            for report_dict in batch:
+                close_captured_output(report_dict)
+
+    def _process_queue(self):
+        self._call_reporters('open')
+        self._opened.set()
+        batch = []
+        deadline = time.time() + self.flush_interval
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if isinstance(item, _Record):
+                    self._write_batch(batch)
+                    batch = []
+                    self._call_reporters('write_records', [item.record])
+                    self._call_reporters('flush')
+                elif item is not None:
+                    batch.append(item)
+                if len(batch) >= self.flush_size or time.time() >= deadline:
+                    self._write_batch(batch)
+                    batch = []
+                    deadline = time.time() + self.flush_interval
+        finally:
+            self._write_batch(batch)
+            self._call_reporters('close')
+
+
+@atexit.register
+def _close_open_pipelines():
+    for pipeline in list(_open_pipelines):
+        pipeline.close()
+
+
+class _Record(object):
+    def __init__(self, record):
+        self.record = record
 
 
 def create_junit_report_from_json_report(json_report_path, output_xml_path, encoding='utf-8'):
 
     """
+    json_report_path can also be an SQLite results store (see solid_test_store), its reports of all runs are
+    converted.
+
     <?xml version="1.0" encoding="UTF-8"?>
 <testsuites>
    <testsuite name="JUnitXmlReporter" errors="0" tests="0" failures="0" time="0" timestamp="2013-05-24T10:23:58" />
@@ -45,75 +334,300 @@ def create_junit_report_from_json_report(json_report_path, output_xml_path, enco
     'exc': result.errors
     """
 
-    pass
+    # imported here, solid_test_store depends on this module
+    import solid_test_store
+    if solid_test_store.is_sqlite_path(json_report_path):
+        reports = solid_test_store.iter_reports(json_report_path)
+    else:
+        reports = iter_json_report(json_report_path, encoding=encoding)
 
+    with _JUnitSuites(encoding) as test_suites:
+        for tc in reports:
+            test_suites.add_report(tc)
+        test_suites.write(output_xml_path)
 
-    root_tag = Element('testsuites')
-    root_tag.tail = '\n'
-    test_suites = {}
 
-    for line in codecs.open(json_report_path, encoding=encoding):
-        tc = json.loads(line, encoding=encoding)
+def _count_outcome(counts, outcome):
+    counts['tests'] += 1
+    if outcome == 'fail':
+        counts['failures'] += 1
+    elif outcome == 'error':
+        counts['errors'] += 1
+    elif outcome == 'skip':
+        counts['skipped'] += 1
+    elif outcome not in ('pass', 'cached'):
+        counts['failures'] += 1
 
-        if tc['suite'] not in test_suites:
-            test_suites.update({tc['suite']: Element('testsuite', attrib={'name': tc['suite'], 'tests': 0, 'errors': 0,
-                                                                          'failures': 0, 'skipped': 0})})
 
-        test_suites[tc['suite']].attrib['tests'] = int(test_suites[tc['suite']].attrib['tests']) + 1
-        if tc['outcome'] == 'fail':
-            test_suites[tc['suite']].attrib['failures'] = int(test_suites[tc['suite']].attrib['failures']) + 1
-        elif tc['outcome'] == 'error':
-            test_suites[tc['suite']].attrib['errors'] = int(test_suites[tc['suite']].attrib['errors']) + 1
-        elif tc['outcome'] == 'skip':
-            test_suites[tc['suite']].attrib['skipped'] = int(test_suites[tc['suite']].attrib['skipped']) + 1
-        else:
-            test_suites[tc['suite']].attrib['failures'] = int(test_suites[tc['suite']].attrib['failures']) + 1
+def _testsuite_start_tag(counts, encoding):
+    suite_tag = Element('testsuite', attrib=dict((k, unicode(v)) for k, v in counts.iteritems()))
+    # an empty element serializes as '<testsuite ... />', reopen it to write the test cases in
+    return _serialize_element(suite_tag, encoding)[:-len(' />')] + '>'
+
 
-        for k in test_suites[tc['suite']].attrib:
-            if isinstance(test_suites[tc['suite']].attrib[k], (int, float)):
-                test_suites[tc['suite']].attrib[k] = str(test_suites[tc['suite']].attrib[k])
+class _JUnitSuites(object):
+    """Test cases grouped by suite, spooled to temporary files until they are written as one JUnit XML file."""
 
-        test_case_element = Element('testcase', attrib={'name': tc['name'], 'classname': tc['class_name'], 'time': tc['time']})
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self._suites = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for _, spool in self._suites.itervalues():
+            spool.close()
+        return False
+
+    def _suite(self, name):
+        if name not in self._suites:
+            self._suites[name] = ({'name': name, 'tests': 0, 'errors': 0, 'failures': 0, 'skipped': 0},
+                                  tempfile.TemporaryFile())
+        return self._suites[name]
+
+    def add_report(self, tc):
+        counts, spool = self._suite(tc['suite'])
+        _count_outcome(counts, tc['outcome'])
+        spool.write(_serialize_element(_testcase_element(tc), self.encoding))
+
+    def add_element(self, suite_name, test_case_element):
+        """Adds a parsed <testcase> element, counting its outcome from its failure/error/skipped child."""
+        counts, spool = self._suite(suite_name)
+        _count_outcome(counts, _junit_outcome(test_case_element))
         test_case_element.tail = '\n'
+        spool.write(_serialize_element(test_case_element, self.encoding))
 
-        for k in test_case_element.attrib:
-            if isinstance(test_case_element.attrib[k], (int, float)):
-                test_case_element.attrib[k] = str(test_case_element.attrib[k])
-
-        if tc['outcome'] == 'pass':
-            pass
-        elif tc['outcome'] == 'fail':
-            failed = Element('failure')
-            failed.text = '\n'.join(tc['exc'])
-            test_case_element.append(failed)
-        elif tc['outcome'] == 'error':
-            error = Element('error')
-            error.text = '\n'.join(tc['exc'])
-            test_case_element.append(error)
-        elif tc['outcome'] == 'skip':
-            test_case_element.append(Element('skipped'))
-            skip = Element('skipped')
-            skip.text = '\n'.join(tc['exc'])
-        else:
-            failed = Element('failure')
-            failed.text = '\n'.join(tc['exc'])
-            test_case_element.append(failed)
+    def write(self, output_xml_path):
+        with open(output_xml_path, 'wb') as xf:
+            xf.write(u"<?xml version='1.0' encoding='{}'?>\n".format(self.encoding).encode(self.encoding))
+            if not self._suites:
+                xf.write(u'<testsuites />\n'.encode(self.encoding))
+                return
+            xf.write(u'<testsuites>'.encode(self.encoding))
+            for counts, spool in self._suites.itervalues():
+                xf.write(_testsuite_start_tag(counts, self.encoding))
+                spool.seek(0)
+                shutil.copyfileobj(spool, xf)
+                xf.write(u'</testsuite>'.encode(self.encoding))
+            xf.write(u'</testsuites>\n'.encode(self.encoding))
+
+
+def _junit_outcome(test_case_element):
+    for tag, outcome in (('failure', 'fail'), ('error', 'error'), ('skipped', 'skip')):
+        if test_case_element.find(tag) is not None:
+            return outcome
+    return 'pass'
+
+
+def _iter_junit_test_cases(xml_path):
+    """Yields (suite name, <testcase> element) of a JUnit XML file, removing every test case once it was used."""
+    open_elements = []
+    for event, element in iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            open_elements.append(element)
+            continue
+        open_elements.pop()
+        if element.tag == 'testcase':
+            suites = [e for e in open_elements if e.tag == 'testsuite']
+            yield suites[-1].get('name', u'') if suites else u'', element
+            if open_elements:
+                open_elements[-1].remove(element)
+
+
+def _is_junit_file(path):
+    with open(path, 'rb') as rf:
+        return rf.read(64).lstrip().startswith('<')
+
+
+def merge_reports(input_paths, output_path, encoding='utf-8'):
+    """Merges JSON-lines, SQLite or JUnit XML reports, e.g. of the shards of a run, into one report.
+
+    The output is JUnit XML if output_path ends with .xml, a JSON-lines report otherwise (which can only be merged
+    from JSON-lines and SQLite reports). Every input is read once, as a stream, test cases are grouped by suite.
+    """
+    # imported here, solid_test_store depends on this module
+    import solid_test_store
+    if output_path.lower().endswith('.xml'):
+        with _JUnitSuites(encoding) as test_suites:
+            for path in input_paths:
+                if solid_test_store.is_sqlite_path(path):
+                    for tc in solid_test_store.iter_reports(path):
+                        test_suites.add_report(tc)
+                elif _is_junit_file(path):
+                    for suite_name, test_case_element in _iter_junit_test_cases(path):
+                        test_suites.add_element(suite_name, test_case_element)
+                else:
+                    for tc in iter_json_report(path, encoding=encoding):
+                        test_suites.add_report(tc)
+            test_suites.write(output_path)
+        return
+
+    with codecs.open(output_path, 'wb', encoding=encoding) as of:
+        for path in input_paths:
+            if solid_test_store.is_sqlite_path(path):
+                for tc in solid_test_store.iter_reports(path):
+                    of.write(json_report_line(tc, encoding))
+            elif _is_junit_file(path):
+                raise ValueError(u'JUnit report {} can only be merged into a JUnit report'.format(path))
+            else:
+                # JSON-lines reports are concatenated as they are, exception records included
+                with open(path, 'rb') as jf:
+                    for line in jf:
+                        if line.strip():
+                            of.write(line.decode(encoding).rstrip(u'\r\n') + u'\n')
+
+
+class LiveJUnitReporter(SolidTestReporter):
+    """Keeps a valid JUnit XML report on disk while the run goes on, plug it in with SolidTestSuite.add_reporter.
+
+    Every batch of the report pipeline is written as one <testsuite> element per suite, right before the closing
+    </testsuites> tag, so the file is complete after every batch even if the run is killed later. A suite spread
+    over several batches appears in several <testsuite> elements, merge_reports() joins them.
+    """
+
+    def __init__(self, xml_path, encoding='utf-8'):
+        self.xml_path = xml_path
+        self.encoding = encoding
+        self._file = None
+        self._end = None
+        self._closing_tag = u'</testsuites>\n'.encode(encoding)
+
+    def open(self):
+        self._file = open(self.xml_path, 'wb')
+        self._file.write(u"<?xml version='1.0' encoding='{}'?>\n<testsuites>".format(self.encoding).encode(
+            self.encoding))
+        self._end = self._file.tell()
+        self._file.write(self._closing_tag)
+        self._file.flush()
+
+    def write(self, reports):
+        suites = collections.OrderedDict()
+        for report_dict in reports:
+            suites.setdefault(report_dict['suite'], []).append(report_dict)
+        self._file.seek(self._end)
+        for suite_name, suite_reports in suites.iteritems():
+            counts = {'name': suite_name, 'tests': 0, 'errors': 0, 'failures': 0, 'skipped': 0}
+            for report_dict in suite_reports:
+                _count_outcome(counts, report_dict['outcome'])
+            self._file.write(_testsuite_start_tag(counts, self.encoding))
+            for report_dict in suite_reports:
+                self._file.write(_serialize_element(_testcase_element(_plain_report(report_dict)), self.encoding))
+            self._file.write(u'</testsuite>'.encode(self.encoding))
+        self._end = self._file.tell()
+        self._file.write(self._closing_tag)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _plain_report(report_dict):
+    """Returns report_dict with captured output and exceptions turned into text, as read from a JSON report."""
+    report_dict = materialize_report(report_dict)
+    report_dict['exc'] = [unicode(e) for e in report_dict.get('exc') or ()]
+    return report_dict
+
+
+def iter_json_report(json_report_path, encoding='utf-8', expand_exceptions=True):
+    """Yields test case reports from a JSON-lines report one at a time.
+
+    Record lines are not yielded, with expand_exceptions the exc_refs of the reports are turned back into
+    formatted exceptions in their exc field, see expand_exception_refs().
+    """
+    tracebacks = {}
+    with open(json_report_path, 'rb') as jf:
+        for line in jf:
+            if not line.strip():
+                continue
+            report_dict = json.loads(line.decode(encoding), encoding=encoding)
+            if 'record' in report_dict:
+                if report_dict['record'] == 'exception' and expand_exceptions:
+                    tracebacks[report_dict['id']] = report_dict['traceback']
+                continue
+            if expand_exceptions:
+                expand_exception_refs(report_dict, tracebacks)
+            yield report_dict
+
+
+def iter_json_records(json_report_path, kind=None, encoding='utf-8'):
+    """Yields the record lines of a JSON-lines report, only those of the given kind if one is given."""
+    with open(json_report_path, 'rb') as jf:
+        for line in jf:
+            if not is_record_line(line):
+                continue
+            record = json.loads(line.decode(encoding), encoding=encoding)
+            if kind is None or record['record'] == kind:
+                yield record
+
+
+def _serialize_element(element, encoding):
+    output = io.BytesIO()
+    ElementTree(element).write(output, encoding=encoding, xml_declaration=False)
+    return output.getvalue()
+
+
+def _testcase_properties(tc):
+    properties = []
+    if tc.get('resources'):
+        properties.extend(solid_test_resources.junit_properties(tc['resources']))
+    if tc.get('benchmark'):
+        properties.extend((u'benchmark.{}'.format(k), v) for k, v in sorted(tc['benchmark'].iteritems()))
+    return properties
+
+
+def _testcase_element(tc):
+    test_case_element = Element('testcase', attrib={'name': tc['name'], 'classname': tc['class_name'],
+                                                    'time': tc['time']})
+    test_case_element.tail = '\n'
 
+    for k in test_case_element.attrib:
+        if isinstance(test_case_element.attrib[k], (int, float)):
+            test_case_element.attrib[k] = str(test_case_element.attrib[k])
 
-        system_out = Element('system-out')
-        system_out.text = tc['stdout'] # tc['logger']
-        test_case_element.append(system_out)
+    properties = _testcase_properties(tc)
+    if properties:
+        properties_element = Element('properties')
+        for name, value in properties:
+            properties_element.append(Element('property', attrib={'name': name, 'value': unicode(value)}))
+        test_case_element.append(properties_element)
 
-        system_err = Element('system-err')
-        system_err.text = tc['stderr']
-        test_case_element.append(system_err)
+    if tc['outcome'] in ('pass', 'cached'):
+        pass
+    elif tc['outcome'] == 'fail':
+        failed = Element('failure')
+        failed.text = '\n'.join(tc['exc'])
+        test_case_element.append(failed)
+    elif tc['outcome'] == 'error':
+        error = Element('error')
+        error.text = '\n'.join(tc['exc'])
+        test_case_element.append(error)
+    elif tc['outcome'] == 'skip':
+        test_case_element.append(Element('skipped'))
+    else:
+        failed = Element('failure')
+        failed.text = '\n'.join(tc['exc'])
+        test_case_element.append(failed)
 
-        test_suites[tc['suite']].append(test_case_element)
+    system_out = Element('system-out')
+    system_out.text = tc['stdout']  # tc['logger']
+    test_case_element.append(system_out)
 
-    for s in test_suites:
-        root_tag.append(test_suites[s])
-    test_suites = None
+    system_err = Element('system-err')
+    system_err.text = tc['stderr']
+    test_case_element.append(system_err)
+    return test_case_element
 
-    #import pdb; pdb.set_trace()
 
-    ElementTree(root_tag).write(output_xml_path, encoding=encoding, xml_declaration=True)
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'merge':
+        merge_reports(sys.argv[3:], sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'junit':
+        create_junit_report_from_json_report(sys.argv[2], sys.argv[3])
+    else:
+        sys.exit(u'usage: {0} merge OUTPUT_REPORT INPUT_REPORT...\n       {0} junit JSON_REPORT OUTPUT_XML'.format(
+            sys.argv[0]))
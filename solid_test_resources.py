@@ -0,0 +1,99 @@
+import gc
+import time
+import resource
+import collections
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PHASES = ('setUp', 'test', 'tearDown')
+
+
+def _rusage():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime, usage.ru_stime, usage.ru_maxrss
+
+
+def _object_counts_by_type():
+    return collections.Counter(type(o).__name__ for o in gc.get_objects())
+
+
+class ResourceMonitor(object):
+    """Measures the resources used by the phases (setUp, test, tearDown) of one test.
+
+    Every phase records its wall time, user and system CPU time and how much the process' peak RSS grew (in KB).
+    With allocations=True it also records the number of allocations and, with top_allocators > 0, the biggest
+    allocators: source lines from tracemalloc where available (tracing is started if needed), object types
+    counted by the garbage collector otherwise. Allocation tracking is expensive and meant for diagnostic runs.
+    All measurements are of the whole process, they include other threads running at the same time.
+    """
+
+    def __init__(self, allocations=False, top_allocators=0):
+        self.allocations = allocations
+        self.top_allocators = top_allocators
+        self.phases = {}
+        self._started = {}
+        if allocations and tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, phase):
+        baseline = None
+        if self.allocations:
+            if tracemalloc is not None:
+                baseline = tracemalloc.take_snapshot()
+            elif self.top_allocators:
+                baseline = _object_counts_by_type()
+            else:
+                baseline = len(gc.get_objects())
+        self._started[phase] = (time.time(), _rusage(), baseline)
+
+    def stop(self, phase):
+        if phase not in self._started:
+            return
+        start_time, (user, system, max_rss), baseline = self._started.pop(phase)
+        end_user, end_system, end_max_rss = _rusage()
+        measurement = {
+            'wall': time.time() - start_time,
+            'cpu_user': end_user - user,
+            'cpu_system': end_system - system,
+            'max_rss_delta_kb': end_max_rss - max_rss,
+        }
+        if self.allocations:
+            measurement.update(self._allocations_since(baseline))
+        self.phases[phase] = measurement
+
+    def _allocations_since(self, baseline):
+        if tracemalloc is not None:
+            differences = tracemalloc.take_snapshot().compare_to(baseline, 'lineno')
+            allocations = {'allocations': sum(d.count_diff for d in differences if d.count_diff > 0)}
+            if self.top_allocators:
+                allocations['top_allocators'] = [
+                    u'{}:{} {:+d}B {:+d}'.format(d.traceback[0].filename, d.traceback[0].lineno, d.size_diff,
+                                                d.count_diff)
+                    for d in sorted(differences, key=lambda d: d.size_diff, reverse=True)[:self.top_allocators]]
+            return allocations
+        if self.top_allocators:
+            growth = _object_counts_by_type()
+            growth.subtract(baseline)
+            return {'allocations': sum(c for c in growth.itervalues() if c > 0),
+                    'top_allocators': [u'{} {:+d}'.format(name, count)
+                                       for name, count in growth.most_common(self.top_allocators) if count > 0]}
+        return {'allocations': max(0, len(gc.get_objects()) - baseline)}
+
+    def report(self):
+        return dict(self.phases)
+
+
+def junit_properties(resources):
+    """Flattens a 'resources' report field into (name, value) pairs for JUnit properties."""
+    properties = []
+    for phase in PHASES:
+        for metric, value in sorted(resources.get(phase, {}).iteritems()):
+            if metric == 'top_allocators':
+                for i, allocator in enumerate(value, 1):
+                    properties.append((u'resources.{}.top_allocator.{}'.format(phase, i), allocator))
+            else:
+                properties.append((u'resources.{}.{}'.format(phase, metric), value))
+    return properties
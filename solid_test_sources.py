@@ -0,0 +1,174 @@
+import copy
+import itertools
+import unittest
+
+import solid_test_report
+import solid_test_fixtures
+
+
+def fresh_copy(test):
+    """Returns a new instance of a TestCase for the same test method, other tests are returned as they are.
+
+    TestCases that need more than the method name to be created define __copy__.
+    """
+    if isinstance(test, unittest.TestCase):
+        if hasattr(test, '__copy__'):
+            return copy.copy(test)
+        return test.__class__(test._testMethodName)
+    return test
+
+
+class TestSource(object):
+    """Tests created on demand by factory, a callable returning an iterable of tests, e.g. a generator function.
+
+    factory is called again every time the source is iterated. Unless count is given, the number of tests is found
+    by iterating the source once, without keeping the tests. Subclasses that know their tests before creating them
+    (e.g. solid_test_discovery.DiscoveredTestSource) override fixture_names(), test_ids(), identities() and
+    test_at() and can be reorderable.
+    """
+
+    # whether reorder() is supported
+    reorderable = False
+
+    def __init__(self, factory, count=None):
+        self.factory = factory
+        self._count = count
+        # [index of the next test, iterator of the source] of test_at()
+        self._cursor = None
+
+    def __iter__(self):
+        return iter(self.factory())
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(1 for _ in self)
+        return self._count
+
+    def fixture_names(self):
+        """Returns an iterable of the module and class names of the tests, see solid_test_fixtures.fixture_names()."""
+        return (solid_test_fixtures.fixture_names(test) for test in self)
+
+    def test_ids(self):
+        """Returns an iterable of the ids the reports of the tests will have."""
+        return (solid_test_report.test_id(solid_test_report.test_identity(test)) for test in self)
+
+    def identities(self):
+        """Returns an iterable of the identity fields the reports of the tests will have, see test_identity()."""
+        return (solid_test_report.test_identity(test) for test in self)
+
+    def test_at(self, index):
+        """Returns the test at index.
+
+        The source is iterated from where the previous call left off, from its start only when index is before
+        that, so tests asked for mostly in order (e.g. by a distributed worker) are created once. Not thread-safe.
+        """
+        if self._cursor is None or index < self._cursor[0]:
+            self._cursor = [0, iter(self)]
+        test = next(itertools.islice(self._cursor[1], index - self._cursor[0], None))
+        self._cursor[0] = index + 1
+        return test
+
+    def reorder(self, order):
+        """Replaces the tests with order(tests, test_id, fixture_names), a reordered list or a subset of tests.
+
+        test_id and fixture_names are the functions returning the report id and the module and class names of one
+        of the tests passed to order.
+        """
+        raise NotImplementedError(u'Tests of {!r} can not be reordered'.format(self.factory))
+
+
+class TestSchedule(object):
+    """The tests of a run in order, created only when they are about to run.
+
+    The base tests are repeated repeat times (as fresh copies with fresh=True) and followed by the tests of the
+    TestSources. Tests are addressed by position, so a range of the schedule (start to stop, see split()) is
+    iterated without creating the tests before it, and nothing keeps a test alive once it was handed out.
+    """
+
+    def __init__(self, tests, repeat=1, fresh=False, sources=(), start=0, stop=None):
+        self.tests = tests
+        self.repeat = repeat
+        self.fresh = fresh
+        self.sources = sources
+        self._total = len(tests) * repeat + sum(len(source) for source in sources)
+        self.start = start
+        self.stop = self._total if stop is None else min(stop, self._total)
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def __iter__(self):
+        return self._iter(copy=self.fresh)
+
+    def fixture_names(self):
+        """Yields the module and class names of the tests, without creating the tests of sources that know them."""
+        return self._walk(solid_test_fixtures.fixture_names, lambda source: source.fixture_names())
+
+    def test_ids(self):
+        """Yields the report ids of the tests, without creating the tests of sources that know them."""
+        return self._walk(lambda test: solid_test_report.test_id(solid_test_report.test_identity(test)),
+                          lambda source: source.test_ids())
+
+    def identities(self):
+        """Yields the report identity fields of the tests, without creating the tests of sources that know them."""
+        return self._walk(solid_test_report.test_identity, lambda source: source.identities())
+
+    def test_at(self, position):
+        """Returns the test at position (counted from start), see TestSource.test_at() for the tests of sources."""
+        absolute = self.start + position
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        repeated = len(self.tests) * self.repeat
+        if absolute < repeated:
+            test = self.tests[absolute % len(self.tests)]
+            return fresh_copy(test) if self.fresh else test
+        offset = repeated
+        for source in self.sources:
+            size = len(source)
+            if absolute < offset + size:
+                return source.test_at(absolute - offset)
+            offset += size
+        raise IndexError(position)
+
+    def templates(self):
+        """Yields the tests without copying the repeated ones, e.g. to find out which fixtures they need."""
+        return self._iter(copy=False)
+
+    def _iter(self, copy):
+        return self._walk(fresh_copy if copy else lambda test: test, lambda source: source)
+
+    def _walk(self, base_item, source_items):
+        """Yields base_item(test) for the repeated base tests and the items of source_items(source) of the sources."""
+        repeated = len(self.tests) * self.repeat
+        position = self.start
+        while position < min(self.stop, repeated):
+            yield base_item(self.tests[position % len(self.tests)])
+            position += 1
+
+        offset = repeated
+        for source in self.sources:
+            if position >= self.stop:
+                return
+            size = len(source)
+            if position < offset + size:
+                end = min(self.stop, offset + size)
+                for item in itertools.islice(source_items(source), position - offset, end - offset):
+                    yield item
+                position = end
+            offset += size
+
+    def split(self, parts):
+        """Splits the schedule into at most parts contiguous ranges of (almost) equal size.
+
+        Contiguous ranges keep the fixture groups together, so the range of every worker sets up a class or module
+        fixture at most once.
+        """
+        size, remainder = divmod(len(self), parts)
+        ranges = []
+        start = self.start
+        for i in xrange(parts):
+            end = start + size + (1 if i < remainder else 0)
+            if end > start:
+                ranges.append(TestSchedule(self.tests, self.repeat, self.fresh, self.sources, start, end))
+            start = end
+        return ranges
@@ -0,0 +1,276 @@
+import json
+import time
+import collections
+import sqlite3
+import logging
+
+import solid_test_report
+import solid_test_capture
+import solid_test_exceptions
+
+log = logging.getLogger()
+
+SQLITE_HEADER = 'SQLite format 3\x00'
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY,
+    suite TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (suite, class_name, name)
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    test_id INTEGER NOT NULL REFERENCES tests (id),
+    outcome TEXT,
+    time REAL,
+    finished REAL NOT NULL,
+    exc_refs TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    result_id INTEGER PRIMARY KEY REFERENCES results (id),
+    stdout TEXT,
+    stderr TEXT,
+    logger TEXT
+);
+CREATE TABLE IF NOT EXISTS exceptions (
+    id TEXT PRIMARY KEY,
+    traceback TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_class_name ON tests (class_name);
+CREATE INDEX IF NOT EXISTS results_run_test ON results (run_id, test_id);
+CREATE INDEX IF NOT EXISTS results_test ON results (test_id);
+CREATE INDEX IF NOT EXISTS results_outcome ON results (outcome);
+CREATE INDEX IF NOT EXISTS results_time ON results (time);
+'''
+
+# Report fields with columns of their own, the others are kept as JSON in results.extra
+_COLUMN_FIELDS = ('suite', 'class_name', 'name', 'outcome', 'time', 'stdout', 'stderr', 'logger', 'exc')
+
+
+def is_sqlite_path(path):
+    """Tells if path is an SQLite results store: an existing SQLite file or a new file with an SQLite extension."""
+    try:
+        with open(path, 'rb') as sf:
+            return sf.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except IOError:
+        return path.lower().endswith(SQLITE_EXTENSIONS)
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+class SqliteReporter(solid_test_report.SolidTestReporter):
+    """Writes the test case reports of a run into an SQLite results store, see ResultStore.
+
+    Every run gets a row in runs, every test a row in tests and every report a row in results, with its captured
+    output in outputs and every distinct traceback once in exceptions. Each batch is one transaction, records
+    (see ReportPipeline.submit_record) are kept as JSON in records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self._connection = None
+        self._test_ids = {}
+
+    def open(self):
+        self._connection = connect(self.path)
+        self.run_id = self._connection.execute('INSERT INTO runs (started) VALUES (?)', (time.time(),)).lastrowid
+        self._connection.commit()
+
+    def _test_id(self, report_dict):
+        identity = (report_dict['suite'], report_dict['class_name'], report_dict['name'])
+        test_id = self._test_ids.get(identity)
+        if test_id is None:
+            self._connection.execute('INSERT OR IGNORE INTO tests (suite, class_name, name) VALUES (?, ?, ?)',
+                                     identity)
+            test_id = self._test_ids[identity] = self._connection.execute(
+                'SELECT id FROM tests WHERE suite = ? AND class_name = ? AND name = ?', identity).fetchone()[0]
+        return test_id
+
+    def _exc_refs(self, report_dict):
+        exc = []
+        exc_refs = []
+        for exception in report_dict.get('exc') or ():
+            if isinstance(exception, solid_test_exceptions.StructuredException):
+                self._connection.execute('INSERT OR IGNORE INTO exceptions (id, traceback) VALUES (?, ?)',
+                                         (exception.key, exception.format(timestamped=False)))
+                exc_refs.append([exception.key, exception.timestamp_string()])
+            else:
+                exc.append(exception)
+        return exc, exc_refs
+
+    def write(self, reports):
+        with self._connection:
+            for report_dict in reports:
+                exc, exc_refs = self._exc_refs(report_dict)
+                extra = dict((k, v) for k, v in report_dict.iteritems() if k not in _COLUMN_FIELDS)
+                if exc:
+                    extra['exc'] = exc
+                result_id = self._connection.execute(
+                    'INSERT INTO results (run_id, test_id, outcome, time, finished, exc_refs, extra) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (self.run_id, self._test_id(report_dict), report_dict['outcome'], report_dict['time'],
+                     time.time(), json.dumps(exc_refs) if exc_refs else None,
+                     json.dumps(extra, default=solid_test_report.json_default) if extra else None)).lastrowid
+                outputs = [solid_test_capture.materialize(report_dict.get(name)) or None
+                           for name in ('stdout', 'stderr', 'logger')]
+                if any(outputs):
+                    self._connection.execute('INSERT INTO outputs (result_id, stdout, stderr, logger) '
+                                             'VALUES (?, ?, ?, ?)', [result_id] + outputs)
+
+    def write_records(self, records):
+        with self._connection:
+            for record in records:
+                self._connection.execute('INSERT INTO records (run_id, kind, data) VALUES (?, ?, ?)',
+                                         (self.run_id, record['record'],
+                                          json.dumps(record, default=solid_test_report.json_default)))
+
+    def close(self):
+        if self._connection is not None:
+            with self._connection:
+                self._connection.execute('UPDATE runs SET finished = ? WHERE id = ?', (time.time(), self.run_id))
+            self._connection.close()
+            self._connection = None
+
+
+class ResultStore(object):
+    """Queries over an SQLite results store written by SqliteReporter.
+
+    The methods return iterators over the database cursor, so results are never loaded as a whole.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = connect(path)
+        self._connection.row_factory = sqlite3.Row
+
+    def close(self):
+        self._connection.close()
+
+    def runs(self, limit=None):
+        """Yields (id, started, finished) of the runs, latest first."""
+        return self._connection.execute('SELECT id, started, finished FROM runs ORDER BY id DESC LIMIT ?',
+                                        (-1 if limit is None else limit,))
+
+    def _last_run_ids(self, last_runs):
+        return [row['id'] for row in self.runs(last_runs)]
+
+    def slowest_tests(self, suite=None, class_name=None, limit=50, last_runs=10):
+        """Yields the slowest tests of the last runs by average duration, e.g. the slowest 50 of a suite.
+
+        Every row has suite, class_name, name, runs, average_time and max_time.
+        """
+        run_ids = self._last_run_ids(last_runs)
+        conditions, parameters = self._test_conditions(suite, class_name)
+        conditions.append('r.run_id IN ({})'.format(', '.join('?' * len(run_ids))))
+        parameters.extend(run_ids)
+        return self._connection.execute(
+            'SELECT t.suite, t.class_name, t.name, COUNT(*) AS runs, AVG(r.time) AS average_time, '
+            'MAX(r.time) AS max_time FROM results r JOIN tests t ON t.id = r.test_id WHERE {} '
+            'GROUP BY r.test_id ORDER BY average_time DESC LIMIT ?'.format(' AND '.join(conditions)),
+            parameters + [limit])
+
+    def outcome_counts(self, run_id=None):
+        """Yields (outcome, count) of a run, the latest one by default."""
+        if run_id is None:
+            run_id = next(iter(self._last_run_ids(1)), None)
+        return self._connection.execute('SELECT outcome, COUNT(*) FROM results WHERE run_id = ? GROUP BY outcome',
+                                        (run_id,))
+
+    def iter_reports(self, run_id=None, suite=None, class_name=None, outcome=None):
+        """Yields test case reports like solid_test_report.iter_json_report(), optionally filtered.
+
+        Without a run_id the reports of all runs are yielded, in the order they were written.
+        """
+        conditions, parameters = self._test_conditions(suite, class_name)
+        if run_id is not None:
+            conditions.append('r.run_id = ?')
+            parameters.append(run_id)
+        if outcome is not None:
+            conditions.append('r.outcome = ?')
+            parameters.append(outcome)
+        rows = self._connection.execute(
+            'SELECT t.suite, t.class_name, t.name, r.outcome, r.time, r.exc_refs, r.extra, o.stdout, o.stderr, '
+            'o.logger FROM results r JOIN tests t ON t.id = r.test_id LEFT JOIN outputs o ON o.result_id = r.id '
+            '{} ORDER BY r.id'.format('WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters)
+        tracebacks = _TracebackLookup(self._connection)
+        for row in rows:
+            report_dict = json.loads(row['extra']) if row['extra'] else {}
+            report_dict.update({'suite': row['suite'], 'class_name': row['class_name'], 'name': row['name'],
+                                'outcome': row['outcome'], 'time': row['time'], 'stdout': row['stdout'] or u'',
+                                'stderr': row['stderr'] or u'', 'logger': row['logger'] or u''})
+            report_dict.setdefault('exc', [])
+            if row['exc_refs']:
+                report_dict['exc_refs'] = json.loads(row['exc_refs'])
+                solid_test_report.expand_exception_refs(report_dict, tracebacks)
+            yield report_dict
+
+    def iter_records(self, kind=None, run_id=None):
+        """Yields the records of a run, the latest one by default, only those of the given kind if one is given."""
+        if run_id is None:
+            run_id = next(iter(self._last_run_ids(1)), None)
+        parameters = [run_id]
+        if kind is not None:
+            parameters.append(kind)
+        rows = self._connection.execute('SELECT data FROM records WHERE run_id = ? {}ORDER BY id'.format(
+            'AND kind = ? ' if kind is not None else ''), parameters)
+        for row in rows:
+            yield json.loads(row['data'], object_pairs_hook=collections.OrderedDict)
+
+    @staticmethod
+    def _test_conditions(suite, class_name):
+        conditions = []
+        parameters = []
+        if suite is not None:
+            conditions.append('t.suite = ?')
+            parameters.append(suite)
+        if class_name is not None:
+            conditions.append('t.class_name = ?')
+            parameters.append(class_name)
+        return conditions, parameters
+
+
+class _TracebackLookup(object):
+    """Mapping of exception ids to tracebacks, read from the exceptions table on demand."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._cache = {}
+
+    def get(self, key, default=None):
+        if key not in self._cache:
+            row = self._connection.execute('SELECT traceback FROM exceptions WHERE id = ?', (key,)).fetchone()
+            self._cache[key] = row[0] if row is not None else default
+        return self._cache[key]
+
+
+def iter_reports(path):
+    """Yields the test case reports of all runs in an SQLite results store."""
+    store = ResultStore(path)
+    try:
+        for report_dict in store.iter_reports():
+            yield report_dict
+    finally:
+        store.close()
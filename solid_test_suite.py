@@ -1,3 +1,4 @@
+import os
 import signal
 import datetime
 import time
@@ -5,13 +6,35 @@ import unittest
 import traceback
 import logging
 import sys
-from StringIO import StringIO
 import solid_test_report
+import solid_test_async
+import solid_test_capture
+import solid_test_fixtures
+import solid_test_history
+import solid_test_cache
+import solid_test_timeout
+import solid_test_resources
+import solid_test_profile
+import solid_test_overhead
+import solid_test_exceptions
+import solid_test_store
+import solid_test_sources
+import solid_test_metrics
+import solid_test_distributed
+import solid_test_isolation
+import solid_test_flakiness
 import random
+import functools
+import threading
+import multiprocessing
+import Queue
 
 log = logging.getLogger()
 
 SIGINT_TRIGGER = False
+PASSED_OUTCOMES = ('pass', 'cached')
+WORKER_POLL_INTERVAL = 0.1
+WORKER_JOIN_TIMEOUT = 5
 
 
 def exit_signal_handler(sig, frame):
@@ -50,12 +73,51 @@ class SolidTestSkipRunException(Exception):
 class SolidTestSuite(object):
     def __init__(self, tests=()):
         self._tests = []
+        # lazy repeats of the tests and lazy test sources, see multiply_tests(fresh=True) and add_test_source()
+        self._repeat = 1
+        self._fresh_repeats = False
+        # whether multiply_tests() repeated the tests, in place or fresh
+        self._multiplied = False
+        self._sources = []
+        self._randomized = False
+        # whether the tests were put in an order that groups them itself, see _reorder()
+        self._ordered = False
         self.add_tests(tests)
         self.pre_run_functions = self._get_func_list_by_prefix('pre_run')
         self.post_run_functions = self._get_func_list_by_prefix('post_run')
         self.pre_test_functions = self._get_func_list_by_prefix('pre_test')
         self.post_test_functions = self._get_func_list_by_prefix('post_test')
         self.stop_trigger = None
+        self.reporters = []
+        self.report_flush_interval = solid_test_report.DEFAULT_FLUSH_INTERVAL
+        self.report_flush_size = solid_test_report.DEFAULT_FLUSH_SIZE
+        self.report_pipeline = None
+        self.group_by_fixtures = True
+        self.fixture_manager = None
+        self.duration_store = None
+        self.result_cache = None
+        self._result_cache_keys = {}
+        self._result_cache_bypassed = False
+        self.default_timeout = None
+        self.timeout_in_subprocess = False
+        # whether the run warned that timeouts of tests outside the main thread are not enforced
+        self._timeouts_unenforced = False
+        self.resource_accounting = None
+        self.profiling = None
+        self.profiler = None
+        self.overhead = solid_test_overhead.OverheadTimer()
+        self.run_overhead = {}
+        self.live_metrics = None
+        self.metrics = None
+        self.metrics_server = None
+        self.coordinator = None
+        self.isolation = None
+        self.adaptive_repetition = None
+        self.flakiness = None
+        # routes captured output by thread or task in threaded and async runs, see solid_test_capture.OutputRouter
+        self.output_router = None
+        # held while the hooks and bookkeeping of a test run, which share the per test attributes, in threaded runs
+        self._test_case_lock = threading.RLock()
 
         self.total_test_run_cases_count = 0
         self.current_test_run_cases_ran = 0
@@ -73,18 +135,207 @@ class SolidTestSuite(object):
         self.original_stdout = None
         self.original_stderr = None
         self.logger_output_capture_handler = None
-        self.stdout_output = ''
-        self.stderr_output = ''
-        self.logger_output = ''
+        # the CaptureBuffers of the last captures, their text is read with stdout_output etc.
+        self.stdout_capture = ''
+        self.stderr_capture = ''
+        self.logger_capture = ''
+        self.capture_spill_threshold = solid_test_capture.DEFAULT_SPILL_THRESHOLD
+        self.capture_head_limit = None
+        self.capture_tail_limit = None
 
     def load_from_test_case_class(self, tc_class):
         self.add_tests(unittest.TestLoader().loadTestsFromTestCase(tc_class))
 
     def randomize_test_order(self):
-        random.shuffle(self._tests)
+        self._randomized = True
 
-    def multiply_tests(self, times):
-        self._tests = self._tests * times
+        def shuffled(tests, test_id, fixture_names):
+            if self.group_by_fixtures:
+                return solid_test_fixtures.group_tests(tests, shuffle=random.shuffle, keys=fixture_names)
+            return random.sample(tests, len(tests))
+        self._reorder(shuffled)
+
+    def _reorder(self, order):
+        """Replaces the tests and those of every source with order(tests, test_id, fixture_names).
+
+        See solid_test_sources.TestSource.reorder(), raises ValueError if a source can not be reordered. The
+        order is kept as it is, order groups the tests by fixtures itself if group_by_fixtures is set.
+        """
+        for source in self._sources:
+            if not source.reorderable:
+                raise ValueError(u'Tests of the source {!r} can not be reordered or selected'.format(source.factory))
+        self._tests = order(self._tests, lambda test: solid_test_report.test_id(solid_test_report.test_identity(test)),
+                            solid_test_fixtures.fixture_names)
+        for source in self._sources:
+            source.reorder(order)
+        self._ordered = True
+
+    def _fixture_grouping(self, fixture_names):
+        """Returns the function grouping tests by fixtures for an order, None if group_by_fixtures is not set."""
+        if not self.group_by_fixtures:
+            return None
+        return functools.partial(solid_test_fixtures.group_tests, keys=fixture_names)
+
+    def multiply_tests(self, times, fresh=False):
+        """Repeats the tests times.
+
+        By default the suite holds the same test instances times over. With fresh=True the repeats are not stored,
+        every one of them is a new instance of its test created right before it runs and released after its report
+        was submitted, so state does not leak between repeats and memory stays flat for long soak runs.
+        Repeated tests do not use the result cache, see enable_result_cache().
+        """
+        if times > 1:
+            self._multiplied = True
+        if fresh:
+            self._repeat *= times
+            self._fresh_repeats = True
+        else:
+            self._tests = self._tests * times
+
+    def add_test_source(self, factory, count=None):
+        """Adds tests created on demand by factory, a callable returning an iterable of tests (e.g. a generator).
+
+        They run after the other tests, see solid_test_sources.TestSource. Without count the source is iterated
+        once more to count its tests. factory can also be a TestSource, e.g. discovered tests (see
+        solid_test_discovery.add_discovered_tests()), only such sources support randomize_test_order(),
+        order_by_duration_history() and select_last_failed(), which raise ValueError for the others.
+        """
+        if not isinstance(factory, solid_test_sources.TestSource):
+            factory = solid_test_sources.TestSource(factory, count)
+        self._sources.append(factory)
+
+    def order_by_duration_history(self, duration_store, strategy=solid_test_history.LONGEST_FIRST):
+        """Sorts the tests with one of solid_test_history.ORDERING_STRATEGIES using a DurationStore.
+
+        The store is updated with the results of the following runs, which also log their estimated run time.
+        With group_by_fixtures the tests of a class stay together, so the order holds from class to class, except
+        that failed_first still runs the failed tests before all others, see solid_test_history.order_tests().
+        """
+        self._reorder(lambda tests, test_id, fixture_names: solid_test_history.order_tests(
+            tests, duration_store, strategy, test_id, self._fixture_grouping(fixture_names)))
+        self.duration_store = duration_store
+
+    def estimate_run_time(self, workers=None):
+        """Returns the run time estimated from the duration store and the number of tests without history."""
+        if self.duration_store is None:
+            raise ValueError(u'No duration store, see order_by_duration_history()')
+        total, unknown = self.duration_store.estimate(self._scheduled_tests().test_ids())
+        return total / max(1, workers or 1), unknown
+
+    def select_last_failed(self, json_report_path, mode=solid_test_history.LAST_FAILED_ONLY):
+        """Selects the tests that failed or errored in an existing JSON report.
+
+        With mode 'only' the other tests are dropped, with mode 'first' the failed tests are moved to the front.
+        With group_by_fixtures the tests are still grouped by class, with mode 'first' only the other tests are, so
+        the failed tests run before all others and their classes stay set up until their other tests ran. Tests are
+        matched by their name, class_name and suite. Returns the number of failed tests found.
+        """
+        if mode not in (solid_test_history.LAST_FAILED_ONLY, solid_test_history.LAST_FAILED_FIRST):
+            raise ValueError(u'Unknown last failed mode {!r}'.format(mode))
+        index = solid_test_history.ReportIndex(json_report_path)
+        failed_count = [0]
+
+        def select(tests, test_id, fixture_names):
+            failed, others = [], []
+            for test in tests:
+                if index.failed(test_id(test)):
+                    failed.append(test)
+                else:
+                    others.append(test)
+            failed_count[0] += len(failed)
+            group = self._fixture_grouping(fixture_names)
+            if mode == solid_test_history.LAST_FAILED_ONLY:
+                return group(failed) if group is not None else failed
+            return failed + (group(others) if group is not None else others)
+        self._reorder(select)
+        return failed_count[0]
+
+    def enable_result_cache(self, result_cache):
+        """Skips tests that passed before with the same solid_test_cache.test_cache_key, using a ResultCache.
+
+        Skipped tests are reported with the 'cached' outcome, results of the tests that ran update the cache.
+        Runs repeating the tests, with multiply_tests() or enable_adaptive_repetition(), bypass the cache: every
+        repeat runs and their results do not update it.
+        """
+        self.result_cache = result_cache
+
+    def _result_cache_key(self, test):
+        if self.result_cache is None or self._result_cache_bypassed:
+            return None
+        memo_key = (test.__class__, getattr(test, '_testMethodName', None))
+        if memo_key not in self._result_cache_keys:
+            self._result_cache_keys[memo_key] = solid_test_cache.test_cache_key(test)
+        return self._result_cache_keys[memo_key]
+
+    def enable_resource_accounting(self, allocations=False, top_allocators=0):
+        """Records the CPU time, peak RSS growth and optionally allocations of setUp, test and tearDown.
+
+        The measurements go into a 'resources' field of the reports, see solid_test_resources.ResourceMonitor.
+        """
+        self.resource_accounting = {'allocations': allocations, 'top_allocators': top_allocators}
+
+    def enable_profiling(self, output_dir=None, top=solid_test_profile.DEFAULT_TOP,
+                         contributors=solid_test_profile.DEFAULT_CONTRIBUTORS):
+        """Runs every test under cProfile, saving its profile into output_dir (JSON report path + '.profiles').
+
+        The report of a test names its profile file in a 'profile' field. When the run ends the profiles are merged
+        into output_dir/hotspots.json and hotspots.txt: the top functions by cumulative time across all tests and
+        the tests contributing most to each, see solid_test_profile.compare_hotspot_reports() to compare runs.
+        Profiling is not supported in async mode.
+        """
+        self.profiling = {'output_dir': output_dir, 'top': top, 'contributors': contributors}
+
+    def enable_overhead_accounting(self):
+        """Measures the time spent in the hook functions, capture start/stop, exception formatting and reporting.
+
+        Every report gets an 'overhead' field with the seconds spent per category on behalf of its test (the
+        captures a hook starts or stops count as capture time, not hook time), the totals of the run are logged and
+        kept in run_overhead, see solid_test_overhead.OverheadTimer.
+        """
+        self.overhead.enabled = True
+
+    def enable_metrics(self, address=None, progress_interval=None, window=solid_test_metrics.DEFAULT_WINDOW):
+        """Keeps live metrics of the runs: tests per second, durations, outcomes, running tests and an ETA.
+
+        With an address ('host:port', a port number or a Unix socket path) they are served over HTTP in the
+        Prometheus text format while the suite runs, see metrics_server.address for the port picked for port 0.
+        With a progress_interval a progress line is written to stderr every that many seconds. Rates and the
+        duration histogram cover the last window tests, see solid_test_metrics.RunMetrics.
+        """
+        self.live_metrics = {'address': address, 'progress_interval': progress_interval, 'window': window}
+
+    def enable_isolation(self, group_by=solid_test_isolation.GROUP_BY_TEST, preload=()):
+        """Runs every test (or every class or module, see group_by) in its own forked child process.
+
+        The children are forked from a fork server started with the run, which has the tests loaded and the
+        preload modules imported, so tests changing global state do not affect each other and a child costs no
+        interpreter or import startup. Fixtures and the tests run in the child, the pre_test/post_test functions
+        in this process, captured output and results are sent back. A child that crashes (e.g. segfaults) fails
+        its test with an error and the rest of its group continues in a new child. Only sequential runs are
+        isolated, see solid_test_isolation.ForkServer.
+        """
+        self.isolation = {'group_by': group_by, 'preload': tuple(preload)}
+
+    def enable_adaptive_repetition(self, max_width=solid_test_flakiness.DEFAULT_MAX_WIDTH,
+                                   confidence=solid_test_flakiness.DEFAULT_CONFIDENCE,
+                                   min_runs=solid_test_flakiness.DEFAULT_MIN_RUNS,
+                                   max_runs=solid_test_flakiness.DEFAULT_MAX_RUNS, time_budget=None):
+        """Repeats the tests until their failure rates are known well enough, instead of a fixed number of times.
+
+        The tests run in rounds, every round runs the tests whose failure rate interval (at confidence) is still
+        wider than max_width once more, as fresh copies, at least min_runs and at most max_runs times. No round
+        starts after time_budget seconds. A 'flakiness' record per test with its runs, failures, failure rate and
+        interval is written to the report, see solid_test_flakiness.FlakinessTracker. After randomize_test_order()
+        every round is shuffled and the records list the tests a test fails significantly more or less often
+        after, which is only meaningful in sequential runs. Replaces multiply_tests(), isolated and distributed
+        runs are not repeated.
+        """
+        self.adaptive_repetition = {'max_width': max_width, 'confidence': confidence, 'min_runs': min_runs,
+                                    'max_runs': max_runs, 'time_budget': time_budget}
+
+    def add_reporter(self, reporter):
+        """Plugs an additional solid_test_report.SolidTestReporter into the report pipeline of the next runs."""
+        self.reporters.append(reporter)
 
     def _get_func_list_by_prefix(self, prefix):
         names = [n for n in dir(self) if n.startswith(prefix)]
@@ -119,13 +370,15 @@ class SolidTestSuite(object):
     __hash__ = None
 
     def __iter__(self):
-        return iter(self._tests)
+        """Iterates over the tests in the order they run in."""
+        return iter(self._scheduled_tests())
 
     def count_test_cases(self):
+        """Counts the test cases, without creating repeated tests or keeping the tests of test sources."""
         cases = 0
-        for test in self:
+        for test in self._tests:
             cases += test.countTestCases()
-        return cases
+        return cases * self._repeat + sum(len(source) for source in self._sources)
 
     countTestCases = count_test_cases
 
@@ -150,84 +403,760 @@ class SolidTestSuite(object):
     def __call__(self, *args, **kwds):
         return self.run(*args, **kwds)
 
-    def run(self, result_json_path, stop_trigger, failfast=False):
+    def run(self, result_json_path, stop_trigger, failfast=False, workers=None, async_concurrency=None,
+            coordinator=None, threads=None):
+        """Runs the tests, writing their reports to result_json_path (an SQLite store for .db/.sqlite paths).
+
+        With workers > 1 the tests run in that many forked processes, with threads > 1 in a pool of that many
+        threads, with async_concurrency as tasks of an event loop, with a coordinator address ('host:port') on the
+        workers connecting to it, see run_worker().
+        """
+        run_start_time = time.time()
         self.stop_trigger = stop_trigger
         self.total_test_run_cases_count = self.count_test_cases()
+        self.overhead.start_run()
+        self._run_pre_run_functions()
+
+        if solid_test_store.is_sqlite_path(result_json_path):
+            reporters = [solid_test_store.SqliteReporter(result_json_path)] + self.reporters
+        else:
+            reporters = [solid_test_report.JsonReporter(result_json_path)] + self.reporters
+        if self.duration_store is not None:
+            estimate, unknown = self.estimate_run_time(workers)
+            log.info(u'Estimated run time: {:.1f}s ({} tests without history)'.format(estimate, unknown))
+            reporters.append(solid_test_history.DurationStoreReporter(self.duration_store))
+        if self.result_cache is not None:
+            self._result_cache_keys = {}
+            self._result_cache_bypassed = self._multiplied or (self.adaptive_repetition is not None and
+                                                               coordinator is None)
+            if self._result_cache_bypassed:
+                log.info(u'The result cache is bypassed while the tests are repeated, every repeat runs')
+            else:
+                reporters.append(solid_test_cache.ResultCacheReporter(self.result_cache))
+        self.profiler = None
+        if self.profiling is not None:
+            profile_dir = self.profiling['output_dir'] or result_json_path + '.profiles'
+            self.profiler = solid_test_profile.TestProfiler(profile_dir)
+            reporters.append(solid_test_profile.HotspotReporter(
+                os.path.join(profile_dir, 'hotspots.json'), self.profiling['top'], self.profiling['contributors']))
+        tests = self._scheduled_tests()
+        adaptive = self.adaptive_repetition is not None
+        if adaptive and coordinator is not None:
+            log.warn(u'Adaptive repetition is not supported in distributed runs, tests will not be repeated')
+            adaptive = False
+        fork_server = None
+        if self.isolation is not None:
+            if async_concurrency or coordinator is not None or (threads and threads > 1) or (workers and workers > 1):
+                log.warn(u'Isolation is only supported in sequential runs, tests will not be isolated')
+            elif adaptive:
+                log.warn(u'Isolation is not supported with adaptive repetition, tests will not be isolated')
+            else:
+                # forked before the report pipeline and metrics start their threads
+                fork_server = solid_test_isolation.ForkServer(self, tests, self.isolation['preload']).start()
+        self.report_pipeline = solid_test_report.ReportPipeline(
+            reporters, flush_interval=self.report_flush_interval, flush_size=self.report_flush_size).start()
+        metrics_services = self._start_metrics()
+        self.test_run_start_time = time.time()
 
+        def run_tests(tests):
+            if fork_server is not None:
+                self._run_isolated(tests, failfast, fork_server)
+            elif async_concurrency:
+                self._run_async(tests, failfast, async_concurrency)
+            elif coordinator is not None:
+                self._run_coordinator(tests, failfast, coordinator)
+            elif threads and threads > 1:
+                self._run_in_threads(tests, failfast, threads)
+            elif workers and workers > 1:
+                self._run_in_workers(tests, failfast, workers)
+            else:
+                self._run_sequentially(tests, failfast)
+
+        self.flakiness = None
+        try:
+            if adaptive:
+                self._run_adaptively(tests, run_tests)
+            else:
+                run_tests(tests)
+        finally:
+            if fork_server is not None:
+                fork_server.close()
+            self.report_pipeline.close()
+            for service in metrics_services:
+                service.close()
+            self.metrics_server = None
+        self.overhead.add_to_run(dict(('report_write.' + name, seconds)
+                                      for name, seconds in self.report_pipeline.reporter_times.iteritems()))
+        self._run_post_run_functions()
+
+        if self.overhead.enabled:
+            self.run_overhead = dict(self.overhead.run_totals)
+            log.info(solid_test_overhead.format_overhead(self.run_overhead, time.time() - run_start_time))
+
+    def run_worker(self, coordinator_address, failfast=False, name=None):
+        """Runs the tests handed out by a coordinator, a run() with coordinator=address, until there are no more.
+
+        The worker must load the same tests in the same order as the coordinator, its reports are sent to the
+        coordinator, which writes them to its result_json_path. The pre_run and post_run functions run in every
+        worker too. Returns the number of tests run, see solid_test_distributed.Worker.
+        """
+        self.stop_trigger = False
+        self.metrics = None
+        self._result_cache_bypassed = self._multiplied
+        self.total_test_run_cases_count = self.count_test_cases()
+        self.overhead.start_run()
+        self._run_pre_run_functions()
+        try:
+            if self.stop_trigger:
+                return 0
+            return solid_test_distributed.Worker(self, coordinator_address, name).run(failfast)
+        finally:
+            self._run_post_run_functions()
+
+    def _run_pre_run_functions(self):
         for pre_run_function in self.pre_run_functions:
-            try:
-                pre_run_function()
-            except SolidTestSkipRunException:
-                stop_trigger = True
-            except:
-                log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(pre_run_function))
+            with self.overhead.measure_run(pre_run_function.__name__):
+                try:
+                    pre_run_function()
+                except SolidTestSkipRunException:
+                    self.stop_trigger = True
+                except:
+                    log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(pre_run_function))
 
-        self.test_run_start_time = time.time()
-        for i, test in enumerate(self):
-            if stop_trigger or SIGINT_TRIGGER:
+    def _run_post_run_functions(self):
+        for post_run_function in self.post_run_functions:
+            with self.overhead.measure_run(post_run_function.__name__):
+                try:
+                    post_run_function()
+                except:
+                    log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(post_run_function))
+
+    def _start_metrics(self):
+        """Creates the metrics of the run and starts the services configured by enable_metrics(), returns them."""
+        self.metrics = None
+        if self.live_metrics is None:
+            return []
+        self.metrics = solid_test_metrics.RunMetrics(self.live_metrics['window'])
+        self.metrics.start_run(self.total_test_run_cases_count)
+        services = []
+        if self.live_metrics['address'] is not None:
+            self.metrics_server = solid_test_metrics.MetricsServer(self.metrics, self.live_metrics['address']).start()
+            log.info(u'Serving run metrics on {}'.format(self.metrics_server.address))
+            services.append(self.metrics_server)
+        if self.live_metrics['progress_interval']:
+            services.append(solid_test_metrics.ProgressLogger(self.metrics,
+                                                              self.live_metrics['progress_interval']).start())
+        return services
+
+    def _submit_report(self, test_case_report):
+        with self.overhead.measure_run('report_submit'):
+            self.report_pipeline.submit(test_case_report)
+        if self.flakiness is not None:
+            self.flakiness.add(test_case_report)
+        self.overhead.add_to_run(test_case_report.get('overhead', {}))
+
+    def _scheduled_tests(self):
+        """Returns the solid_test_sources.TestSchedule of the run.
+
+        Its tests are grouped by class and module, so their fixtures are set up once, unless they were put in an
+        order that groups them itself (see _reorder()), the tests of sources follow.
+        """
+        if self.group_by_fixtures and not self._ordered:
+            tests = solid_test_fixtures.group_tests(self._tests)
+        else:
+            tests = list(self._tests)
+        return solid_test_sources.TestSchedule(tests, self._repeat, self._fresh_repeats, tuple(self._sources))
+
+    def _run_adaptively(self, tests, run_tests):
+        """Runs rounds of the tests with run_tests until they converged, see enable_adaptive_repetition()."""
+        settings = self.adaptive_repetition
+        self.flakiness = solid_test_flakiness.FlakinessTracker(
+            settings['confidence'], settings['max_width'], settings['min_runs'], settings['max_runs'])
+        pending = list(solid_test_sources.TestSchedule(tests.tests, sources=tests.sources).templates())
+        deadline = None if settings['time_budget'] is None else time.time() + settings['time_budget']
+        rounds = 0
+        while pending and not (self.stop_trigger or SIGINT_TRIGGER):
+            if deadline is not None and time.time() >= deadline:
+                log.info(u'Adaptive repetition used up its time budget after {} rounds, {} tests did not '
+                         u'converge'.format(rounds, len(pending)))
+                break
+            if self._randomized:
+                if self.group_by_fixtures:
+                    pending = solid_test_fixtures.group_tests(pending, shuffle=random.shuffle)
+                else:
+                    random.shuffle(pending)
+            self.flakiness.start_round()
+            run_tests(solid_test_sources.TestSchedule(pending, fresh=True))
+            rounds += 1
+            pending = [test for test in pending if not self.flakiness.converged(
+                solid_test_report.test_id(solid_test_report.test_identity(test)))]
+        for record in self.flakiness.records(order_dependence=self._randomized):
+            self.report_pipeline.submit_record(record)
+
+    def _run_sequentially(self, tests, failfast):
+        self.fixture_manager = solid_test_fixtures.FixtureManager(names=tests.fixture_names())
+        try:
+            for test in tests:
+                if self.stop_trigger or SIGINT_TRIGGER:
+                    break
+                result, test_case_report = self._run_test_case(test)
+                self._submit_report(test_case_report)
+                self.current_test = None
+                if self._should_stop(result, failfast):
+                    break
+        finally:
+            self._tear_down_remaining_fixtures()
+
+    def _tear_down_remaining_fixtures(self):
+        """Tears down the fixtures a run that stopped early left set up."""
+        for key, exc_info in self.fixture_manager.tear_down_all():
+            log.error(u'Tearing down the fixtures of {} failed:\n{}'.format(
+                key, u''.join(traceback.format_exception(*exc_info))))
+
+    def _run_test_case(self, test):
+        cache_key = self._result_cache_key(test)
+        if self.result_cache is not None and cache_key in self.result_cache:
+            return self._run_cached_test_case(test, cache_key)
+
+        fixture_set_up_time, fixture_error = self.fixture_manager.set_up(test)
+        with self._test_case_lock:
+            result, skip_reason = self._start_test_case(test)
+            start_time = self.test_case_start_time
+        if cache_key is not None:
+            result.report_fields['cache_key'] = cache_key
+        #############################################
+        try:
+            if fixture_error is not None:
+                self._add_fixture_error(test, result, fixture_error)
+            elif skip_reason is not None:
+                result.add_skip(test, skip_reason)
+            else:
+                self._call_test(test, result)
+        except:
+            result.add_error(test, sys.exc_info())
+        #############################################
+        fixture_tear_down_time, fixture_error = self.fixture_manager.tear_down(test)
+        if fixture_error is not None:
+            self._add_fixture_error(test, result, fixture_error)
+        fixture_time = {'set_up': fixture_set_up_time, 'tear_down': fixture_tear_down_time}
+        with self._test_case_lock:
+            return result, self._finish_test_case(test, result, start_time, fixture_time)
+
+    def _run_isolated(self, tests, failfast, fork_server):
+        """Runs the tests one by one, each group of them in a child forked by the fork server."""
+        # the fixtures run in the children
+        self.fixture_manager = solid_test_fixtures.FixtureManager(())
+        group_by = self.isolation['group_by']
+        for group in self._isolation_groups(tests, group_by):
+            if self.stop_trigger or SIGINT_TRIGGER:
                 break
-            self.current_test = test
+            fork_server.start_group([position for position, _ in group])
+            for position, test in group:
+                if self.stop_trigger or SIGINT_TRIGGER:
+                    break
+                result, test_case_report = self._run_isolated_test_case(test, position, fork_server)
+                self._submit_report(test_case_report)
+                self.current_test = None
+                if self._should_stop(result, failfast):
+                    self.stop_trigger = True
+            fork_server.end_group()
 
-            result = SolidTestResult()
-            self.test_case_start_time = time.time()
+    @staticmethod
+    def _isolation_groups(tests, group_by):
+        """Yields lists of (position, test) of consecutive tests sharing a child process."""
+        group = []
+        key = None
+        for position, test in enumerate(tests):
+            test_key = solid_test_isolation.group_key(test, position, group_by)
+            if group and test_key != key:
+                yield group
+                group = []
+            key = test_key
+            group.append((position, test))
+        if group:
+            yield group
 
-            for pre_test_function in self.pre_test_functions:
+    def _run_isolated_test_case(self, test, position, fork_server):
+        cache_key = self._result_cache_key(test)
+        if self.result_cache is not None and cache_key in self.result_cache:
+            return self._run_cached_test_case(test, cache_key)
+
+        result, skip_reason = self._start_test_case(test)
+        start_time = self.test_case_start_time
+        buffers, combined = self._active_capture_buffers()
+        capture = dict((name, True) for name in buffers)
+        capture['combined'] = combined
+        kind, payload = fork_server.run(position, result, skip_reason, capture)
+        fixture_time = None
+        if kind == 'result':
+            child_result, outputs, fixture_time = payload
+            result.__dict__.update(child_result.__dict__)
+            for name, output in outputs.iteritems():
+                buffers[name].write(output)
+        else:
+            try:
+                raise solid_test_timeout.SolidTestSubprocessError(payload)
+            except solid_test_timeout.SolidTestSubprocessError:
+                result.add_error(test, sys.exc_info())
+        if cache_key is not None:
+            result.report_fields['cache_key'] = cache_key
+        return result, self._finish_test_case(test, result, start_time, fixture_time)
+
+    def _run_fixtures_and_test(self, test, result, skip_reason, fixture_set_up):
+        """Runs the test and tears down its fixtures the way _run_test_case() does, used by isolation children.
+
+        fixture_set_up is what fixture_manager.set_up() returned, called before the output capture started like in
+        _run_test_case(). Returns the fixture time, see _finish_test_case().
+        """
+        fixture_set_up_time, fixture_error = fixture_set_up
+        try:
+            if fixture_error is not None:
+                self._add_fixture_error(test, result, fixture_error)
+            elif skip_reason is not None:
+                result.add_skip(test, skip_reason)
+            else:
+                self._call_test(test, result)
+        except:
+            result.add_error(test, sys.exc_info())
+        fixture_tear_down_time, fixture_error = self.fixture_manager.tear_down(test)
+        if fixture_error is not None:
+            self._add_fixture_error(test, result, fixture_error)
+        return {'set_up': fixture_set_up_time, 'tear_down': fixture_tear_down_time}
+
+    def _call_test(self, test, result):
+        """Runs the test, interrupting it and recording an error if it exceeds its timeout.
+
+        The timeout comes from solid_test_timeout.timeout() on the test method or class, or default_timeout.
+        """
+        seconds = solid_test_timeout.get_timeout(test, self.default_timeout)
+        if seconds is None:
+            self._invoke_test(test, result)
+        elif solid_test_timeout.runs_in_subprocess(test, self.timeout_in_subprocess):
+            self._call_test_in_subprocess(test, result, seconds)
+        elif not solid_test_timeout.alarm_available():
+            if not self._timeouts_unenforced:
+                self._timeouts_unenforced = True
+                log.warn(u'Timeouts are only enforced for tests running in a subprocess in thread mode, {} and the '
+                         u'other tests with a timeout will not be interrupted, see timeout_in_subprocess'.format(test))
+            self._invoke_test(test, result)
+        else:
+            with solid_test_timeout.alarm(seconds) as timeout_alarm:
+                result.timeout_alarm = timeout_alarm
+                self._invoke_test(test, result)
+
+    def _invoke_test(self, test, result):
+        if self.profiler is None:
+            test(result)
+        else:
+            test_id = solid_test_report.test_id(solid_test_report.test_identity(test))
+            result.report_fields['profile'] = self.profiler.call(test_id, test, result)
+
+    def _call_test_in_subprocess(self, test, result, seconds):
+        buffers, combined = self._active_capture_buffers()
+
+        def run_test():
+            outputs = self._redirect_capture_to_new_buffers(buffers, combined)
+            self._invoke_test(test, result)
+            return result.__dict__, dict((k, v.getvalue()) for k, v in outputs.iteritems())
+
+        try:
+            result_state, outputs = solid_test_timeout.run_in_subprocess(run_test, seconds)
+        except (solid_test_timeout.SolidTestTimeoutException, solid_test_timeout.SolidTestSubprocessError):
+            result.add_error(test, sys.exc_info())
+        else:
+            result.__dict__.update(result_state)
+            for name, output in outputs.iteritems():
+                buffers[name].write(output)
+
+    def _active_capture_buffers(self):
+        """Returns the buffers capturing the current test's output by name and whether stderr goes to stdout's.
+
+        With an output router these are the buffers registered for the current thread (or task), the buffer_*
+        attributes are shared by all tests running concurrently.
+        """
+        if self.output_router is None:
+            stdout, stderr, logger = self.buffer_stdout, self.buffer_stderr, self.buffer_logger
+            combined = stdout is not None and sys.stderr is stdout
+        else:
+            stdout = self.output_router.stdout.current_buffer()
+            stderr = self.output_router.stderr.current_buffer()
+            logger = self.output_router.logger_handler.current_buffer()
+            combined = stdout is not None and stderr is stdout
+        if combined:
+            stderr = None
+        buffers = {'stdout': stdout, 'stderr': stderr, 'logger': logger}
+        return dict((name, buffer) for name, buffer in buffers.iteritems() if buffer is not None), combined
+
+    def _redirect_capture_to_new_buffers(self, buffers, combined):
+        """Points the active captures to new buffers, used in child processes to send back only their output.
+
+        buffers and combined are what _active_capture_buffers() returned in the parent.
+        """
+        outputs = dict((name, self._new_capture_buffer()) for name in buffers)
+        if self.output_router is not None:
+            for name, buffer in outputs.iteritems():
+                getattr(self.output_router, 'logger_handler' if name == 'logger' else name).register(buffer)
+            if combined:
+                self.output_router.stderr.register(outputs['stdout'])
+            return outputs
+        if 'stdout' in outputs:
+            if combined:
+                sys.stderr = outputs['stdout']
+            sys.stdout = outputs['stdout']
+        if 'stderr' in outputs:
+            sys.stderr = outputs['stderr']
+        if 'logger' in outputs:
+            self.logger_output_capture_handler.stream = outputs['logger']
+        return outputs
+
+    def _run_cached_test_case(self, test, cache_key):
+        """Reports a test that passed before with the same cache key without running it."""
+        self.fixture_manager.tear_down(test)
+        with self._test_case_lock:
+            result, _ = self._start_test_case(test)
+            result.add_cached(test)
+            result.report_fields['cache_key'] = cache_key
+            return result, self._finish_test_case(test, result, self.test_case_start_time)
+
+    @staticmethod
+    def _add_fixture_error(test, result, exc_info):
+        if issubclass(exc_info[0], unittest.SkipTest):
+            result.add_skip(test, unicode(exc_info[1]))
+        else:
+            result.add_error(test, exc_info)
+
+    def _start_test_case(self, test):
+        """Runs the pre_test functions, returns the test's result object and a skip reason if it should be skipped."""
+        self.current_test = test
+
+        result = SolidTestResult()
+        if self.resource_accounting is not None:
+            result.resource_monitor = solid_test_resources.ResourceMonitor(**self.resource_accounting)
+        skip_reason = None
+        self.test_case_start_time = time.time()
+        if self.metrics is not None:
+            self.metrics.test_started(id(test), solid_test_report.test_id(solid_test_report.test_identity(test)),
+                                      self.test_case_start_time)
+        self.overhead.start_test()
+
+        for pre_test_function in self.pre_test_functions:
+            with self.overhead.measure(pre_test_function.__name__):
                 try:
                     pre_test_function()
                 except SolidTestSkipRunException:
                     break
                 except SolidTestSkipTestException:
-                    test = unittest.skip(exception_to_string(sys.exc_info()))
+                    skip_reason = exception_to_string(sys.exc_info())
                 except:
                     log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(pre_test_function))
-            #############################################
-            try:
-                test(result)
-            except:
-                result.add_error(test, sys.exc_info())
-            finally:
-                self.last_test_case_outcome = result.outcome
-                self.current_test_run_cases_ran += 1
-                if self.last_test_case_outcome != 'pass':
-                    self.current_test_run_cases_passed += 1
-                else:
-                    self.current_test_run_cases_failed += 1
-                self.test_case_time = time.time() - self.test_case_start_time
-            #############################################
-            for post_test_function in self.post_test_functions:
+        # taken right away, in async mode the hooks of other tests run before this one finishes
+        result.overhead.update(self.overhead.finish_test())
+        return result, skip_reason
+
+    def _finish_test_case(self, test, result, start_time, fixture_time=None):
+        """Updates the run counters, runs the post_test functions and returns the test case report.
+
+        fixture_time holds the seconds spent in class/module fixtures ('set_up', 'tear_down') on behalf of this
+        test, tear down time is not counted in the test case time.
+        """
+        fixture_time = fixture_time or {'set_up': 0.0, 'tear_down': 0.0}
+        self.current_test = test
+        self.last_test_case_outcome = result.outcome
+        self.current_test_run_cases_ran += 1
+        self._count_outcome(self.last_test_case_outcome)
+        self.test_case_time = time.time() - start_time - fixture_time['tear_down']
+        if self.metrics is not None:
+            self.metrics.test_finished(id(test), self.last_test_case_outcome, self.test_case_time)
+
+        self.overhead.start_test()
+        for post_test_function in self.post_test_functions:
+            with self.overhead.measure(post_test_function.__name__):
                 try:
                     post_test_function()
                 except SolidTestSkipRunException:
-                    stop_trigger = True
+                    self.stop_trigger = True
                 except:
                     log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(post_test_function))
 
-            test_case_report = {
-                'name': test.get_name() or test.id().split('.')[-1],
-                'class_name': test.get_class() or test.id().split('.')[-2],
-                'suite': test.get_module() or test.id().split('.')[-3],
-                'outcome': self.last_test_case_outcome,
-                'time': self.test_case_time,
-                'stdout': self.stdout_output,
-                'stderr': self.stderr_output,
-                'logger': self.logger_output,
-                'exc': result.errors
-            }
+        test_case_report = solid_test_report.test_identity(test)
+        test_case_report.update({
+            'outcome': self.last_test_case_outcome,
+            'time': self.test_case_time,
+            'stdout': self.stdout_capture,
+            'stderr': self.stderr_capture,
+            'logger': self.logger_capture,
+            'exc': result.errors,
+            'fixture_time': fixture_time
+        })
+        if result.resource_monitor is not None:
+            test_case_report['resources'] = result.resource_monitor.report()
+        if self.overhead.enabled:
+            overhead = result.overhead
+            for category, seconds in self.overhead.finish_test().iteritems():
+                overhead[category] = overhead.get(category, 0.0) + seconds
+            test_case_report['overhead'] = overhead
+        test_case_report.update(result.report_fields)
+        return test_case_report
 
-            solid_test_report.append_to_a_json_report(result_json_path, test_case_report)
+    def _run_async(self, tests, failfast, concurrency):
+        """Runs the tests as tasks of one shared event loop, at most concurrency of them at a time.
 
+        Coroutine tests are interleaved while they wait on I/O, the pre_test/post_test functions run synchronously
+        right before and after each test, with current_test and the other per test attributes set for that test.
+        Coroutine test methods are cancelled when they exceed their timeout, synchronous ones are interrupted, tests
+        with a subprocess timeout run in a subprocess like in sequential runs, see _call_test().
+        """
+        if self.profiler is not None:
+            log.warn(u'Profiling is not supported in async mode, tests will not be profiled')
+            self.profiler = None
+        self.fixture_manager = solid_test_fixtures.FixtureManager(names=tests.fixture_names())
+        loop = solid_test_async.new_event_loop()
+        self.output_router = solid_test_capture.OutputRouter().install()
+        solid_test_capture.route_tasks_of(loop)
+        try:
+            tests = iter(tests)
+            lanes = [solid_test_async.asyncio.ensure_future(
+                solid_test_async.steps_coroutine(self._async_lane_steps(tests, failfast)), loop=loop)
+                for _ in xrange(concurrency)]
+            loop.run_until_complete(solid_test_async.asyncio.gather(*lanes))
+        finally:
+            self._tear_down_remaining_fixtures()
+            solid_test_capture.route_tasks_of(None)
+            self.output_router.uninstall()
+            self.output_router = None
+            solid_test_async.close_event_loop(loop)
+
+    def _async_lane_steps(self, tests, failfast):
+        # Lanes share the tests iterator, each lane runs one test at a time
+        for test in tests:
+            if self.stop_trigger or SIGINT_TRIGGER:
+                return
+            yield functools.partial(solid_test_async.steps_coroutine, self._async_test_case_steps(test, failfast))
+
+    def _async_test_case_steps(self, test, failfast):
+        cache_key = self._result_cache_key(test)
+        if self.result_cache is not None and cache_key in self.result_cache:
+            result, test_case_report = self._run_cached_test_case(test, cache_key)
+            self._submit_report(test_case_report)
             self.current_test = None
-            if result.stop:
-                stop_trigger = True
-            if failfast and self.last_test_case_outcome != 'pass':
-                log.info(u'Aborting test run due to "failfast" setting')
-                break
+            return
 
-        for post_run_function in self.post_run_functions:
+        fixture_set_up_time, fixture_error = self.fixture_manager.set_up(test)
+        result, skip_reason = self._start_test_case(test)
+        start_time = self.test_case_start_time
+        if cache_key is not None:
+            result.report_fields['cache_key'] = cache_key
+        try:
+            if fixture_error is not None:
+                self._add_fixture_error(test, result, fixture_error)
+            elif skip_reason is not None:
+                result.add_skip(test, skip_reason)
+            elif hasattr(test, 'run_async') and not (
+                    solid_test_timeout.get_timeout(test, self.default_timeout) is not None and
+                    solid_test_timeout.runs_in_subprocess(test, self.timeout_in_subprocess)):
+                result.coroutine_timeout = solid_test_timeout.get_timeout(test, self.default_timeout)
+                yield functools.partial(test.run_async, result)
+            else:
+                yield functools.partial(self._call_test, test, result)
+        except:
+            result.add_error(test, sys.exc_info())
+        fixture_tear_down_time, fixture_error = self.fixture_manager.tear_down(test)
+        if fixture_error is not None:
+            self._add_fixture_error(test, result, fixture_error)
+        fixture_time = {'set_up': fixture_set_up_time, 'tear_down': fixture_tear_down_time}
+        self._submit_report(self._finish_test_case(test, result, start_time, fixture_time))
+        self.current_test = None
+        if self._should_stop(result, failfast):
+            self.stop_trigger = True
+
+    def _run_in_threads(self, tests, failfast, threads):
+        """Runs the tests in a pool of threads, for I/O bound suites where worker processes cost too much memory.
+
+        The pre_test/post_test functions and the bookkeeping of a test run in its thread while holding a lock, so
+        current_test and the other per test attributes are those of that test, only the tests themselves run
+        concurrently. Captured output is routed to the test of the thread writing it, see
+        solid_test_capture.OutputRouter. Timeouts are only enforced in subprocesses, the alarm needs the main thread,
+        the run warns about the first test whose timeout is not.
+        """
+        self._timeouts_unenforced = False
+        if self.resource_accounting is not None:
+            log.warn(u'Resource accounting is process-wide in thread mode, the CPU time, RSS and allocations of a '
+                     u'test include those of the tests running next to it')
+        self.fixture_manager = solid_test_fixtures.FixtureManager(names=tests.fixture_names())
+        tests = iter(tests)
+        tests_lock = threading.Lock()
+
+        def thread_main():
             try:
-                post_run_function()
+                while not (self.stop_trigger or SIGINT_TRIGGER):
+                    with tests_lock:
+                        test = next(tests, None)
+                    if test is None:
+                        return
+                    result, test_case_report = self._run_test_case(test)
+                    with self._test_case_lock:
+                        self._submit_report(test_case_report)
+                        self.current_test = None
+                        if self._should_stop(result, failfast):
+                            self.stop_trigger = True
             except:
-                log.exception(u'Encountered unhandled exception in {}, will ignore:'.format(post_run_function))
+                log.exception(u'Test thread {} crashed:'.format(threading.current_thread().name))
+
+        self.output_router = solid_test_capture.OutputRouter().install()
+        pool = [threading.Thread(target=thread_main, name='solid-test-{}'.format(i)) for i in xrange(threads)]
+        try:
+            for thread in pool:
+                thread.daemon = True
+                thread.start()
+            for thread in pool:
+                # joined with a timeout, so ctrl-c reaches this thread
+                while thread.is_alive():
+                    thread.join(WORKER_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            self.stop_trigger = True
+            raise
+        finally:
+            self._tear_down_remaining_fixtures()
+            self.output_router.uninstall()
+            self.output_router = None
+
+    def _count_outcome(self, outcome):
+        if outcome in PASSED_OUTCOMES:
+            self.current_test_run_cases_passed += 1
+        else:
+            self.current_test_run_cases_failed += 1
+
+    def _should_stop(self, result, failfast):
+        if result.stop:
+            self.stop_trigger = True
+        if failfast and result.outcome not in PASSED_OUTCOMES:
+            log.info(u'Aborting test run due to "failfast" setting')
+            return True
+        return False
+
+    def _run_in_workers(self, tests, failfast, workers):
+        """Runs the suite in a pool of forked worker processes.
+
+        Every worker runs the pre_test/post_test hooks and the test cases of its own shard, reports are sent back
+        over a queue and handed to the report pipeline by this (parent) process only.
+        """
+        stop_event = multiprocessing.Event()
+        report_queue = multiprocessing.Queue()
+        processes = {}
+        for shard_id, shard in enumerate(tests.split(workers)):
+            process = multiprocessing.Process(target=self._worker_main,
+                                              args=(shard_id, shard, report_queue, stop_event, failfast))
+            # not daemonic, so workers can start subprocesses for tests with subprocess timeouts, they are
+            # terminated below if they do not stop on their own
+            process.start()
+            processes[shard_id] = process
+
+        running = set(processes)
+        try:
+            while running:
+                if self.stop_trigger or SIGINT_TRIGGER:
+                    stop_event.set()
+                try:
+                    kind, payload = report_queue.get(timeout=WORKER_POLL_INTERVAL)
+                except Queue.Empty:
+                    for shard_id in list(running):
+                        if processes[shard_id].exitcode is not None:
+                            log.error(u'Worker {} terminated unexpectedly (exit code {})'.format(
+                                shard_id, processes[shard_id].exitcode))
+                            running.discard(shard_id)
+                            if self.metrics is not None:
+                                self.metrics.test_stopped(shard_id)
+                    continue
+
+                if kind == 'done':
+                    running.discard(payload)
+                elif kind == 'start':
+                    self.metrics.test_started(*payload)
+                elif kind == 'report':
+                    shard_id, payload = payload
+                    if not self._add_worker_report(shard_id, payload, failfast):
+                        stop_event.set()
+        except KeyboardInterrupt:
+            stop_event.set()
+            raise
+        finally:
+            for process in processes.values():
+                process.join(WORKER_JOIN_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+
+    def _add_worker_report(self, worker, test_case_report, failfast):
+        """Submits the report of a test run by a worker, returns False if the run should stop (failfast)."""
+        if self.metrics is not None:
+            self.metrics.test_finished(worker, test_case_report['outcome'], test_case_report['time'])
+        self._submit_report(test_case_report)
+        self.last_test_case_outcome = test_case_report['outcome']
+        self.current_test_run_cases_ran += 1
+        self._count_outcome(test_case_report['outcome'])
+        return not (failfast and test_case_report['outcome'] not in PASSED_OUTCOMES)
+
+    def _run_coordinator(self, tests, failfast, address):
+        """Hands the tests out to workers on any host, see solid_test_distributed.Coordinator and run_worker().
+
+        Reports stream back to this process and go to the report pipeline like those of local workers. The run
+        waits for workers until every test was reported, the tests of workers that are lost are queued again.
+        """
+        self.coordinator = solid_test_distributed.Coordinator(tests, address).start()
+        log.info(u'Coordinating {} tests on {}'.format(len(tests), self.coordinator.address))
+        try:
+            while not self.coordinator.finished():
+                if self.stop_trigger or SIGINT_TRIGGER:
+                    self.coordinator.stop()
+                try:
+                    event = self.coordinator.events.get(timeout=WORKER_POLL_INTERVAL)
+                except Queue.Empty:
+                    self.coordinator.check_workers()
+                    continue
+
+                kind, worker, payload = event[:3]
+                if kind == 'start':
+                    if self.metrics is not None:
+                        self.metrics.test_started(worker, payload, event[3])
+                elif kind == 'left':
+                    if self.metrics is not None:
+                        self.metrics.test_stopped(worker)
+                else:
+                    if kind == 'lost':
+                        payload = solid_test_distributed.lost_test_report(self.coordinator.identities[payload], worker)
+                    if not self._add_worker_report(worker, payload, failfast):
+                        self.coordinator.stop()
+        except KeyboardInterrupt:
+            self.coordinator.stop()
+            raise
+        finally:
+            self.coordinator.close()
+
+    def _worker_main(self, shard_id, tests, report_queue, stop_event, failfast):
+        # Ctrl-c is handled by the parent process, which propagates it through stop_event
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.fixture_manager = solid_test_fixtures.FixtureManager(names=tests.fixture_names())
+        # the parent process keeps the metrics, the worker only tells it which test it starts
+        send_starts = self.metrics is not None
+        self.metrics = None
+        try:
+            for test in tests:
+                if self.stop_trigger or stop_event.is_set():
+                    break
+                if send_starts:
+                    report_queue.put(('start', (shard_id, solid_test_report.test_id(
+                        solid_test_report.test_identity(test)), time.time())))
+                result, test_case_report = self._run_test_case(test)
+                report_queue.put(('report', (shard_id, solid_test_report.materialize_report(test_case_report))))
+                solid_test_report.close_captured_output(test_case_report)
+                self.current_test = None
+                if self._should_stop(result, failfast) or self.stop_trigger:
+                    stop_event.set()
+                    break
+        except:
+            log.exception(u'Worker {} crashed:'.format(shard_id))
+        finally:
+            self._tear_down_remaining_fixtures()
+            report_queue.put(('done', shard_id))
 
     def start_capture(self):
         self.start_stdout_capture()
@@ -235,72 +1164,129 @@ class SolidTestSuite(object):
         self.start_root_logger_capture()
 
     def stop_capture(self):
-        self.stop_stdout_capture()
-        self.stop_stderr_capture()
-        self.stop_root_logger_capture()
+        self._stop_stdout_capture()
+        self._stop_stderr_capture()
+        self._stop_root_logger_capture()
 
+    @property
+    def stdout_output(self):
+        """The text captured by the last stdout capture, its buffer is closed once the test's report was written."""
+        return solid_test_capture.materialize(self.stdout_capture)
+
+    @property
+    def stderr_output(self):
+        return solid_test_capture.materialize(self.stderr_capture)
+
+    @property
+    def logger_output(self):
+        return solid_test_capture.materialize(self.logger_capture)
+
+    def _new_capture_buffer(self):
+        return solid_test_capture.CaptureBuffer(spill_threshold=self.capture_spill_threshold,
+                                                head_limit=self.capture_head_limit,
+                                                tail_limit=self.capture_tail_limit)
+
+    @solid_test_overhead.measured('capture_start')
     def start_root_logger_capture(self):
-        self.logger_output = ''
-        self.buffer_logger = StringIO()
+        self.logger_capture = ''
+        self.buffer_logger = self._new_capture_buffer()
+        if self.output_router is not None:
+            self.output_router.logger_handler.register(self.buffer_logger)
+            return
         self.logger_output_capture_handler = logging.StreamHandler(self.buffer_logger)
         root_logger = logging.getLogger()
         root_logger.addHandler(self.logger_output_capture_handler)
 
     def stop_root_logger_capture(self):
-        if self.buffer_logger is None:
+        return solid_test_capture.materialize(self._stop_root_logger_capture())
+
+    @solid_test_overhead.measured('capture_stop')
+    def _stop_root_logger_capture(self):
+        if self.output_router is not None:
+            output = self.output_router.logger_handler.unregister()
+        else:
+            output = self.buffer_logger
+        if output is None:
             msg = u'Logger capture stop was called before starting it!'
             log.warn(msg)
             return msg
         else:
-            self.buffer_logger.flush()
-            self.logger_output_capture_handler.flush()
-            output = self.buffer_logger.getvalue()
-            root_logger = logging.getLogger()
-            root_logger.removeHandler(self.logger_output_capture_handler)
+            output.flush()
+            if self.output_router is None:
+                self.logger_output_capture_handler.flush()
+                root_logger = logging.getLogger()
+                root_logger.removeHandler(self.logger_output_capture_handler)
             self.buffer_logger = None
             self.logger_output_capture_handler = None
-            self.logger_output = output
+            self.logger_capture = output
             return output
 
+    @solid_test_overhead.measured('capture_start')
     def start_stdout_capture(self, combine_with_stderr=False):
         self.original_stdout = sys.stdout
-        self.stdout_output = ''
-        self.buffer_stdout = StringIO()
-        if combine_with_stderr:
+        self.stdout_capture = ''
+        self.buffer_stdout = self._new_capture_buffer()
+        if self.output_router is not None:
+            self.output_router.stdout.register(self.buffer_stdout)
+            if combine_with_stderr:
+                self.output_router.stderr.register(self.buffer_stdout)
+        elif combine_with_stderr:
             sys.stdout = sys.stderr = self.buffer_stdout
         else:
             sys.stdout = self.buffer_stdout
 
+    @solid_test_overhead.measured('capture_start')
     def start_stderr_capture(self):
         self.original_stderr = sys.stderr
-        self.stderr_output = ''
-        self.buffer_stderr = StringIO()
-        sys.stderr = self.buffer_stderr
+        self.stderr_capture = ''
+        self.buffer_stderr = self._new_capture_buffer()
+        if self.output_router is not None:
+            self.output_router.stderr.register(self.buffer_stderr)
+        else:
+            sys.stderr = self.buffer_stderr
 
     def stop_stdout_capture(self):
-        if self.buffer_stdout is None:
+        return solid_test_capture.materialize(self._stop_stdout_capture())
+
+    @solid_test_overhead.measured('capture_stop')
+    def _stop_stdout_capture(self):
+        if self.output_router is not None:
+            output = self.output_router.stdout.unregister()
+            if output is not None and self.output_router.stderr.current_buffer() is output:
+                self.output_router.stderr.unregister()
+        else:
+            output = self.buffer_stdout
+        if output is None:
             msg = u'Stdout capture stop was called before starting it!'
             log.warn(msg)
             return msg
         else:
-            self.buffer_stdout.flush()
-            output = self.buffer_stdout.getvalue()
+            output.flush()
             self.buffer_stdout = None
-            sys.stdout = self.original_stdout
-            self.stdout_output = output
+            if self.output_router is None:
+                sys.stdout = self.original_stdout
+            self.stdout_capture = output
             return output
 
     def stop_stderr_capture(self):
-        if self.buffer_stderr is None:
+        return solid_test_capture.materialize(self._stop_stderr_capture())
+
+    @solid_test_overhead.measured('capture_stop')
+    def _stop_stderr_capture(self):
+        if self.output_router is not None:
+            output = self.output_router.stderr.unregister()
+        else:
+            output = self.buffer_stderr
+        if output is None:
             msg = u'Stderr capture stop was called before starting it!'
             log.warn(msg)
             return msg
         else:
-            self.buffer_stderr.flush()
-            output = self.buffer_stderr.getvalue()
+            output.flush()
             self.buffer_stderr = None
-            sys.stderr = self.original_stderr
-            self.stderr_output = output
+            if self.output_router is None:
+                sys.stderr = self.original_stderr
+            self.stderr_capture = output
             return output
 
 
@@ -314,24 +1300,55 @@ class SolidTestResult(object):
             'skip': 'skipped',
             'expected_fail': 'failed as expected',
             'unexpected_pass': 'passed unexpectedly',
+            'cached': 'passed before with unchanged sources and inputs, not run',
             None: 'unexpected termination'
         }
+        # solid_test_exceptions.StructuredException of every failure, formatted when reported
         self.errors = []
+        # additional fields for the test case report
+        self.report_fields = {}
+        self.resource_monitor = None
+        # seconds of framework overhead by category, see solid_test_overhead.OverheadTimer
+        self.overhead = {}
         self.skip_reason = ''
         self.stop = False
+        # the solid_test_timeout.alarm of the test, coroutine test methods in async runs get coroutine_timeout
+        self.timeout_alarm = None
+        self.coroutine_timeout = None
+
+    def start_phase(self, name):
+        """Called when a phase of the test (setUp, test, tearDown) starts."""
+        if self.resource_monitor is not None:
+            self.resource_monitor.start(name)
+
+    def end_phase(self, name):
+        """Called when a phase of the test (setUp, test, tearDown) ends."""
+        if self.resource_monitor is not None:
+            self.resource_monitor.stop(name)
+        if name == 'test' and self.timeout_alarm is not None:
+            self.timeout_alarm.stop_repeating()
+
+    def _structured_exception(self, err):
+        """Keeps err as a solid_test_exceptions.StructuredException, formatted only when it is reported."""
+        start_time = time.time()
+        try:
+            return solid_test_exceptions.StructuredException(err)
+        finally:
+            self.overhead['exception_capture'] = (self.overhead.get('exception_capture', 0.0) + time.time() -
+                                                  start_time)
 
     def add_error(self, test, err):
         """Called when an error has occurred. 'err' is a tuple of values as
         returned by sys.exc_info().
         """
-        self.errors.append(exception_to_string(err))
+        self.errors.append(self._structured_exception(err))
         self.outcome = 'error'
     addError = add_error
 
     def add_failure(self, test, err):
         """Called when an error has occurred. 'err' is a tuple of values as
         returned by sys.exc_info()."""
-        self.errors.append(exception_to_string(err))
+        self.errors.append(self._structured_exception(err))
         self.outcome = 'fail'
     addFailure = add_failure
 
@@ -340,6 +1357,11 @@ class SolidTestResult(object):
         self.outcome = 'pass'
     addSuccess = add_success
 
+    def add_cached(self, test):
+        """Called when a test is not run because it passed before with the same cache key."""
+        self.outcome = 'cached'
+    addCached = add_cached
+
     def add_skip(self, test, reason):
         """Called when a test is skipped."""
         self.outcome = 'skip'
@@ -348,7 +1370,7 @@ class SolidTestResult(object):
 
     def add_expected_failure(self, test, err):
         """Called when an expected failure/error occured."""
-        self.errors.append(exception_to_string(err))
+        self.errors.append(self._structured_exception(err))
         self.outcome = 'expected_fail'
     addExpectedFailure = add_expected_failure
 
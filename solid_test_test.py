@@ -1,6 +1,7 @@
 import solid_test_suite
 import solid_test_case
 import solid_test_report
+import solid_test_distributed
 import random
 import logging
 import sys
@@ -131,5 +132,9 @@ if __name__ == '__main__':
 
     json_report_path = 'results_json.txt'
     xml_report_path = 'results_junit.xml'
-    sts.run(json_report_path, stop_trigger=False)
+    if '--loopback' in sys.argv:
+        # the distributed mode with a coordinator and three workers on this machine
+        solid_test_distributed.run_on_loopback(sts, json_report_path, workers=3)
+    else:
+        sts.run(json_report_path, stop_trigger=False)
     solid_test_report.create_junit_report_from_json_report(json_report_path, xml_report_path)
@@ -0,0 +1,167 @@
+import os
+import sys
+import signal
+import threading
+import traceback
+import multiprocessing
+
+# After the first timeout the test is interrupted again every GRACE_INTERVAL seconds, in case it swallowed it
+GRACE_INTERVAL = 1.0
+# Time a timed out subprocess gets to send its stack before it is killed
+STACK_DUMP_TIMEOUT = 1.0
+
+
+class SolidTestTimeoutException(BaseException):
+    """Raised in a test that exceeded its timeout.
+
+    It is not an Exception subclass, so it is not swallowed by the test's own 'except Exception' handlers.
+    """
+    pass
+
+
+class SolidTestSubprocessError(Exception):
+    pass
+
+
+def timeout(seconds, subprocess=None):
+    """Sets the timeout of a test method or of all tests of a test class.
+
+    With subprocess=True the test runs in a forked child process, which is killed on timeout. Use it for tests
+    that can not be interrupted in-process, e.g. blocked in C code. Without subprocess the setting of the class or
+    the suite's timeout_in_subprocess applies.
+    """
+    def decorator(obj):
+        obj.__solid_timeout__ = seconds
+        if subprocess is not None:
+            obj.__solid_timeout_subprocess__ = subprocess
+        return obj
+    return decorator
+
+
+def _timeout_attribute(test, name, default):
+    method = getattr(test, getattr(test, '_testMethodName', ''), None)
+    for owner in (method, test.__class__):
+        if owner is not None and getattr(owner, name, None) is not None:
+            return getattr(owner, name)
+    return default
+
+
+def get_timeout(test, default=None):
+    """Returns the test's timeout in seconds: from its method, from its class or default."""
+    return _timeout_attribute(test, '__solid_timeout__', default)
+
+
+def runs_in_subprocess(test, default=False):
+    return _timeout_attribute(test, '__solid_timeout_subprocess__', default)
+
+
+def alarm_available():
+    """Returns whether alarm() can interrupt code running in the current thread, only the main thread gets SIGALRM."""
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def _timeout_message(seconds, frame):
+    return u'Test timed out after {}s, stack at the moment of timeout:\n{}'.format(
+        seconds, ''.join(traceback.format_stack(frame)))
+
+
+class alarm(object):
+    """Context manager interrupting the code it wraps with SolidTestTimeoutException after seconds.
+
+    Uses SIGALRM, so it only works in the main thread, elsewhere it does nothing.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._armed = False
+        self._fired = False
+        self._previous_handler = None
+
+    def __enter__(self):
+        if self.seconds is None or not alarm_available():
+            return self
+        self._previous_handler = signal.signal(signal.SIGALRM, self._handler)
+        self._armed = True
+        signal.setitimer(signal.ITIMER_REAL, self.seconds, GRACE_INTERVAL)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._disarm()
+        return False
+
+    def _disarm(self):
+        if self._armed:
+            self._armed = False
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._previous_handler)
+
+    def stop_repeating(self):
+        """Called when the test phase ends, so tearDown and the cleanups are not interrupted again and again.
+
+        A timeout that fired is not raised again, one that did not fire yet is raised once at most.
+        """
+        if self._fired:
+            self._disarm()
+        elif self._armed:
+            signal.setitimer(signal.ITIMER_REAL, signal.getitimer(signal.ITIMER_REAL)[0], 0)
+
+    def _handler(self, signum, frame):
+        if self._armed:
+            self._fired = True
+            raise SolidTestTimeoutException(_timeout_message(self.seconds, frame))
+
+
+def run_in_subprocess(func, seconds=None):
+    """Calls func in a forked child process and returns its (picklable) return value.
+
+    If the child does not finish in time it is asked for its stack, killed, and SolidTestTimeoutException is
+    raised with that stack. A child that dies without returning raises SolidTestSubprocessError, an exception
+    raised by func is raised again with its formatted traceback.
+    """
+    parent_end, child_end = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_subprocess_main, args=(func, seconds, child_end))
+    process.daemon = True
+    process.start()
+    child_end.close()
+    try:
+        if not parent_end.poll(seconds):
+            os.kill(process.pid, signal.SIGUSR1)
+            stack = u''
+            if parent_end.poll(STACK_DUMP_TIMEOUT):
+                kind, stack = parent_end.recv()
+            raise SolidTestTimeoutException(u'Test timed out after {}s in subprocess {}, stack at the moment of '
+                                            u'timeout:\n{}'.format(seconds, process.pid, stack))
+        try:
+            kind, payload = parent_end.recv()
+        except EOFError:
+            process.join()
+            raise SolidTestSubprocessError(u'Test subprocess {} terminated without a result (exit code {})'.format(
+                process.pid, process.exitcode))
+        if kind == 'exception':
+            raise SolidTestSubprocessError(payload)
+        return payload
+    finally:
+        parent_end.close()
+        if process.is_alive():
+            process.terminate()
+            process.join(STACK_DUMP_TIMEOUT)
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+
+def _subprocess_main(func, seconds, connection):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def dump_stack(signum, frame):
+        connection.send(('stack', _timeout_message(seconds, frame)))
+        os._exit(1)
+    signal.signal(signal.SIGUSR1, dump_stack)
+
+    try:
+        payload = ('result', func())
+    except:
+        payload = ('exception', u''.join(traceback.format_exception(*sys.exc_info())))
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    connection.send(payload)
+    connection.close()